@@ -5,6 +5,9 @@ library ieee;
     use ieee.std_logic_1164.all;
     use ieee.numeric_std.all;
     use ieee.math_real.all;
+    use ieee.std_logic_textio.all;
+
+use std.textio.all;
 
 library osvvm;
     use osvvm.TbUtilPkg.all;
@@ -23,7 +26,9 @@ library tb;
 
 entity tb_AluCore is
     generic (
-        runner_cfg : string
+        -- Written by python/alu.py.
+        cVectorPath : string := "./tests/logs/alu_vectors.txt";
+        runner_cfg  : string
     );
 end entity tb_AluCore;
 
@@ -35,6 +40,8 @@ architecture tb of tb_AluCore is
     signal opA_i      : std_logic_vector(31 downto 0) := x"00000000";
     signal opB_i      : std_logic_vector(31 downto 0) := x"00000000";
     signal res_o      : std_logic_vector(31 downto 0) := x"00000000";
+
+    file vectors : text;
 begin
     
     CreateClock(clk=>clk_i, period=>5 ns);
@@ -53,6 +60,11 @@ begin
     Stimuli: process
         variable local : std_logic_vector(1 downto 0);
         variable seed1, seed2 : integer := 999;
+        variable vector   : line;
+        variable vcontrol : std_logic_vector(11 downto 0);
+        variable vopA     : std_logic_vector(31 downto 0);
+        variable vopB     : std_logic_vector(31 downto 0);
+        variable vres     : std_logic_vector(31 downto 0);
 
         impure function rand_slv(len : integer) return std_logic_vector is
             variable r : real;
@@ -230,6 +242,36 @@ begin
                         end loop;
                     end loop;
                 end loop;
+            elsif run("t_vector_file") then
+                -- Each line is "controls opA opB res", controls holds addn, res_sel, funct3,
+                -- sright, sarith, slt and sltuns from the most significant bit down.
+                resetn_i <= '1';
+                en_i     <= '1';
+                file_open(vectors, cVectorPath, read_mode);
+                while not endfile(vectors) loop
+                    readline(vectors, vector);
+                    read(vector, vcontrol);
+                    hread(vector, vopA);
+                    hread(vector, vopB);
+                    hread(vector, vres);
+                    ctrl_alu_i.addn    <= vcontrol(11);
+                    ctrl_alu_i.res_sel <= vcontrol(10 downto 7);
+                    ctrl_alu_i.funct3  <= vcontrol(6 downto 4);
+                    ctrl_alu_i.sright  <= vcontrol(3);
+                    ctrl_alu_i.sarith  <= vcontrol(2);
+                    ctrl_alu_i.slt     <= vcontrol(1);
+                    ctrl_alu_i.sltuns  <= vcontrol(0);
+                    opA_i <= vopA;
+                    opB_i <= vopB;
+
+                    wait until rising_edge(clk_i);
+                    wait for 100 ps;
+
+                    check(res_o = vres,
+                        "Check: " & to_hstring(res_o) & " != " & to_hstring(vres) & " for " &
+                        to_string(vcontrol) & " " & to_hstring(vopA) & " " & to_hstring(vopB));
+                end loop;
+                file_close(vectors);
             end if;
         end loop;
         test_runner_cleanup(runner);
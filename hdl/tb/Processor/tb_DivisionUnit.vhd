@@ -4,6 +4,9 @@ library vunit_lib;
 library ieee;
     use ieee.std_logic_1164.all;
     use ieee.numeric_std.all;
+    use ieee.std_logic_textio.all;
+
+use std.textio.all;
 
 library osvvm;
     use osvvm.TbUtilPkg.all;
@@ -17,7 +20,11 @@ library rktcpu;
     use rktcpu.RiscVDefinitions.all;
 
 entity tb_DivisionUnit is
-    generic (runner_cfg : string);
+    generic (
+        -- Written by python/gdu.py --vectors.
+        cVectorPath : string := "./tests/logs/division_vectors.txt";
+        runner_cfg  : string
+    );
 end entity tb_DivisionUnit;
 
 architecture tb of tb_DivisionUnit is
@@ -29,7 +36,10 @@ architecture tb of tb_DivisionUnit is
     signal funct3   : std_logic_vector(2 downto 0);
     signal dresult  : std_logic_vector(31 downto 0);
     signal rresult  : std_logic_vector(31 downto 0);
+    signal derror   : std_logic;
     signal ddone    : std_logic;
+
+    file vectors : text;
 begin
     
     CreateClock(clk=>clk, period=>5 ns);
@@ -43,6 +53,7 @@ begin
         i_denom  => opB,
         o_div    => dresult,
         o_rem    => rresult,
+        o_error  => derror,
         o_valid  => ddone
     );
 
@@ -52,6 +63,13 @@ begin
         variable div     : std_logic_vector(31 downto 0);
         variable rrem    : std_logic_vector(31 downto 0);
         variable RandData : RandomPType;
+        variable vector   : line;
+        variable vsigned  : std_logic;
+        variable vnum     : std_logic_vector(31 downto 0);
+        variable vdenom   : std_logic_vector(31 downto 0);
+        variable vdiv     : std_logic_vector(31 downto 0);
+        variable vrem     : std_logic_vector(31 downto 0);
+        variable verror   : std_logic;
     begin
         test_runner_setup(runner, runner_cfg);
         while test_suite loop
@@ -73,6 +91,34 @@ begin
                 -- Error occurs because these are not equal to the expected. Fix this;
                 check(div   = dresult);
                 check(rrem  = rresult);
+            elsif run("t_vector_file") then
+                -- Each line is "signed num denom div rem error" with the bit-accurate results.
+                file_open(vectors, cVectorPath, read_mode);
+                while not endfile(vectors) loop
+                    readline(vectors, vector);
+                    read(vector, vsigned);
+                    hread(vector, vnum);
+                    hread(vector, vdenom);
+                    hread(vector, vdiv);
+                    hread(vector, vrem);
+                    read(vector, verror);
+                    issigned <= vsigned;
+                    opA      <= vnum;
+                    opB      <= vdenom;
+                    en       <= '1';
+                    wait until rising_edge(clk) and (ddone = '1' or derror = '1') for 100 ns;
+                    check(ddone = '1' or derror = '1', "timeout on " & to_hstring(vnum) & " / " & to_hstring(vdenom));
+                    check_equal(derror, verror, "error of " & to_hstring(vnum) & " / " & to_hstring(vdenom));
+                    if verror = '0' then
+                        check_equal(dresult, vdiv, "quotient of " & to_hstring(vnum) & " / " & to_hstring(vdenom));
+                        check_equal(rresult, vrem, "remainder of " & to_hstring(vnum) & " / " & to_hstring(vdenom));
+                    end if;
+                    -- Let the unit return to IDLE, a division by zero restarts once more.
+                    en <= '0';
+                    wait until rising_edge(clk);
+                    wait until rising_edge(clk);
+                end loop;
+                file_close(vectors);
             end if;
         end loop;
         test_runner_cleanup(runner);
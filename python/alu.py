@@ -0,0 +1,16 @@
+import time
+import argparse
+
+from rktcpu.riscv.alu import alu_suite, write_alu_vectors
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write AluCore reference vectors for tb_AluCore.")
+    parser.add_argument("vectors", nargs="?", default="tests/logs/alu_vectors.txt")
+    parser.add_argument("-n", "--count", type=int, default=1 << 20, help="random vectors after the corner cases")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    ops, a, b = alu_suite(args.count, args.seed)
+    count = write_alu_vectors(args.vectors, ops, a, b)
+    print("{} vectors written to {} in {:.3f} s".format(count, args.vectors, time.perf_counter() - start))
@@ -0,0 +1,81 @@
+import os
+import time
+import argparse
+import tempfile
+
+from rktcpu.model import RktCpuModel
+from rktcpu.trace import read_trace
+from rktcpu.riscv.progen import random_programs, write_hex
+from rktcpu.riscv.rv32i_vector import Rv32iVectorModel, DEFAULT_MEMORY_BYTES
+
+def check(programs, vector, traces, count, max_instructions=None) -> int:
+    """Rerun the first count programs on the int engine, returns the number of mismatches."""
+    workdir = tempfile.mkdtemp()
+    hexpath, logpath = os.path.join(workdir, "fuzz.hex"), os.path.join(workdir, "fuzz.bin")
+    reasons = vector.stop_reasons()
+    mismatches = 0
+    for i in range(count):
+        write_hex(hexpath, programs[i])
+        model = RktCpuModel(dict(enablelogging=True, logformat="bin", logpath=logpath, hexpath=hexpath,
+                                 startingaddr=0, engine="int", memory="paged"))
+        try:
+            result = model.run(max_instructions=max_instructions)
+            reason = result.reason
+        except ValueError:
+            reason = "fault"
+        model.close()
+        golden = read_trace(logpath)
+        if reason != reasons[i] or len(golden) != len(traces[i]) or not (golden == traces[i]).all():
+            mismatches += 1
+            print("instance {}: int {} ({} writes), vector {} ({} writes)".format(
+                i, reason, len(golden), reasons[i], len(traces[i])))
+    os.remove(hexpath)
+    os.remove(logpath)
+    os.rmdir(workdir)
+    return mismatches
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run many random RV32I programs on the vectorized engine.")
+    parser.add_argument("-n", "--count", type=int, default=4096, help="programs run in parallel")
+    parser.add_argument("--length", type=int, default=400, help="random instructions per program")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--registers", type=int, default=8, help="registers used by the random body")
+    parser.add_argument("--dependency", type=float, default=0.5, help="chance a source is the previous destination")
+    parser.add_argument("--memory", type=int, default=DEFAULT_MEMORY_BYTES, help="bytes of memory per instance")
+    parser.add_argument("--max-instructions", type=int, default=None)
+    parser.add_argument("--check", type=int, default=0, metavar="K",
+                        help="compare the first K instances against the int engine")
+    parser.add_argument("--export", metavar="DIR", help="write {name}.hex and {name}_golden.csv per instance")
+    parser.add_argument("--export-count", type=int, default=16)
+    args = parser.parse_args()
+
+    t = time.perf_counter()
+    programs = random_programs(args.count, args.length, seed=args.seed, registers=args.registers,
+                               dependency=args.dependency, memory_bytes=args.memory)
+    generated = time.perf_counter() - t
+    trace = bool(args.check or args.export)
+    vector = Rv32iVectorModel(args.count, memory_bytes=args.memory, trace=trace)
+    vector.load(programs)
+    t = time.perf_counter()
+    retired = vector.run(args.max_instructions)
+    elapsed = time.perf_counter() - t
+    print("{} programs of {} words generated in {:.2f}s".format(args.count, programs.shape[1], generated))
+    print("{} instructions retired in {:.2f}s ({:.2f} M/s)".format(retired, elapsed, retired / elapsed / 1e6))
+    reasons = vector.stop_reasons()
+    for reason in sorted(set(reasons), key=str):
+        print("  {:<18} {:>8}".format(reason, reasons.count(reason)))
+
+    traces = vector.traces() if trace else None
+    status = 0
+    if args.check:
+        mismatches = check(programs, vector, traces, min(args.check, args.count), args.max_instructions)
+        print("{} of {} instances differ from the int engine".format(mismatches, min(args.check, args.count)))
+        status = 1 if mismatches else 0
+    if args.export:
+        os.makedirs(args.export, exist_ok=True)
+        for i in range(min(args.export_count, args.count)):
+            name = "fuzz{:05d}".format(i)
+            write_hex(os.path.join(args.export, name + ".hex"), programs[i])
+            vector.write_trace(os.path.join(args.export, name + "_golden.csv"), traces[i])
+        print("{} programs exported to {}".format(min(args.export_count, args.count), args.export))
+    raise SystemExit(status)
@@ -1,18 +1,52 @@
+import argparse
 
 import numpy as np
 
-numerator = 31 * (2 ** 32 - 1)
-denominator = 3 * (2 ** 32 - 1)
+from rktcpu.gdu import (goldschmidt, sweep, iterations_needed, random_operands, corner_operands,
+                        write_vectors, GDU_ITERATIONS)
 
-denominator = denominator >> 2
-numerator   = numerator   >> 2
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Goldschmidt division as implemented by DivisionUnit.vhd.")
+    parser.add_argument("--pair", nargs=2, type=lambda text: int(text, 0), metavar=("NUM", "DENOM"),
+                        help="print the iterations of one division")
+    parser.add_argument("--signed", action="store_true")
+    parser.add_argument("--iterations", type=int, default=GDU_ITERATIONS)
+    parser.add_argument("-n", "--count", type=int, default=1 << 20, help="random pairs to sweep")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--vectors", help="write tb_DivisionUnit vectors (corner cases and --vector-count random pairs)")
+    parser.add_argument("--vector-count", type=int, default=1000)
+    args = parser.parse_args()
 
-for i in range(0, 12):
-    fval = 2 * (2 ** 32 - 1) - denominator
-    numerator   *= fval
-    denominator *= fval
-    numerator    = numerator >> 32
-    denominator  = denominator >> 32
-    print(str(numerator) + "/" + str(denominator))
-
-print(int(numerator/denominator))
\ No newline at end of file
+    if args.pair:
+        num, denom = args.pair
+        result = goldschmidt([num], [denom], args.signed, iterations=args.iterations, intermediates=True)
+        print("shift {}".format(int(result.shift[0])))
+        for i, (f, n, d) in enumerate(zip(result.fval[:, 0], result.num[:, 0], result.denom[:, 0])):
+            print("{:>2} fval 0x{:016X} num 0x{:016X} denom 0x{:016X}".format(i + 1, int(f), int(n), int(d)))
+        print("div 0x{:08X} rem 0x{:08X} error {}".format(
+            int(result.quotient[0]), int(result.remainder[0]), int(result.error[0])))
+    elif args.vectors:
+        # Every pair is written unsigned and signed.
+        cnum, cdenom = corner_operands()
+        rnum, rdenom = random_operands(args.vector_count, args.seed)
+        num, denom = np.concatenate((cnum, rnum)), np.concatenate((cdenom, rdenom))
+        num, denom = np.tile(num, 2), np.tile(denom, 2)
+        signed = np.repeat([False, True], len(num) // 2)
+        count = write_vectors(args.vectors, num, denom, signed, iterations=args.iterations)
+        print("{} vectors written to {}".format(count, args.vectors))
+    else:
+        num, denom = random_operands(args.count, args.seed)
+        cnum, cdenom = corner_operands()
+        num, denom = np.concatenate((cnum, num)), np.concatenate((cdenom, denom))
+        summary = sweep(num, denom, args.signed, iterations=args.iterations)
+        print("{} pairs, {} divisions by zero".format(summary.pairs, summary.divide_by_zero))
+        print("quotient errors  {:>10} ({:.4%})".format(summary.quotient_errors, summary.quotient_errors / summary.pairs))
+        print("remainder errors {:>10} ({:.4%})".format(summary.remainder_errors, summary.remainder_errors / summary.pairs))
+        print("max quotient error {}".format(summary.max_quotient_error))
+        for a, b, _, gdu, riscv in summary.examples:
+            print("  0x{:08X} / 0x{:08X} gdu 0x{:08X} riscv 0x{:08X}".format(a, b, gdu, riscv))
+        needed = iterations_needed(num[:1 << 16], denom[:1 << 16], args.signed)
+        print("iterations needed for an exact quotient (first {} pairs):".format(min(len(num), 1 << 16)))
+        for k, count in enumerate(np.bincount(needed, minlength=18).tolist()):
+            if count:
+                print("  {:>5} {:>8}".format("never" if k == 17 else k, count))
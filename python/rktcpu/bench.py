@@ -0,0 +1,257 @@
+import fnmatch
+import json
+import os
+import pathlib
+import platform
+import random
+import tempfile
+import time
+
+import numpy as np
+
+from rktcpu.model import RktCpuModel, ENGINES, MEMORIES
+from rktcpu.goldencache import model_digest
+from rktcpu.trace import TRACE_FORMATS
+from rktcpu.riscv.rv32i import Rv32iModel, Instruction, ECALL_INSTRUCTION, ALU_OPCODE, ALU_IMMED_OPCODE, \
+    LOAD_OPCODE, STORE_OPCODE, LOAD_UPPER_OPCODE
+from rktcpu.riscv.rv32i_int import Rv32iIntModel
+from rktcpu.riscv.memory import read_hex, DMEM_REGION
+from rktcpu.riscv.bus import BRAM_REGION
+from rktcpu.riscv.alu import ALT_FUNCT7
+from rktcpu.riscv.progen import encode_r, encode_i, encode_s, encode_b, encode_u, write_hex
+
+BENCH_VERSION = 1
+
+# Relative slowdown of a rate that compare_results reports.
+DEFAULT_THRESHOLD = 0.10
+
+# Work per benchmark at scale 1.0, scaled down by --quick runs.
+BENCH_SIZES = {
+    "test_steps"   : 20000,
+    "loop_steps"   : 200000,
+    "micro_calls"  : 100000,
+    "hex_words"    : 1 << 18,
+}
+
+# (base, bytes) of the data accessed by the loop kernel and the memory
+# microbenchmarks on each memory backend.
+DATA_WINDOWS = {
+    "dict"  : (DMEM_REGION[0], 1 << 16),
+    "paged" : (DMEM_REGION[0], 1 << 16),
+    "bus"   : (BRAM_REGION[0], BRAM_REGION[1] - BRAM_REGION[0] + 1),
+}
+
+# Image loaders timed by the hex benchmarks, the bus ROM is too small for the image.
+HEX_LOADERS = ("read_hex", "dict", "paged")
+
+def machine_info() -> dict:
+    """Host, interpreter and model source the results were measured with."""
+    return {
+        "node"      : platform.node(),
+        "platform"  : platform.platform(),
+        "machine"   : platform.machine(),
+        "processor" : platform.processor(),
+        "cpus"      : os.cpu_count(),
+        "python"    : "{} {}".format(platform.python_implementation(), platform.python_version()),
+        "numpy"     : np.__version__,
+        "model"     : model_digest(),
+        "time"      : time.strftime("%Y-%m-%dT%H:%M:%S"),
+    }
+
+def loop_kernel(data=DMEM_REGION[0]) -> np.ndarray:
+    """Endless loop of ALU, shift, word and byte memory and branch instructions.
+
+    The counter in x1 never wraps within a benchmark run, so the closing
+    bne is always taken and the ecall is never reached.
+    """
+    base = data >> 12
+    body = [
+        encode_i(ALU_IMMED_OPCODE, 1, 0, 1, 1),           # addi x1, x1, 1
+        encode_r(ALU_OPCODE, 3, 0, 3, 1, 0),              # add  x3, x3, x1
+        encode_r(ALU_OPCODE, 4, 4, 3, 1, 0),              # xor  x4, x3, x1
+        encode_i(ALU_IMMED_OPCODE, 5, 1, 4, 3),           # slli x5, x4, 3
+        encode_s(STORE_OPCODE, 2, 2, 5, 0),               # sw   x5, 0(x2)
+        encode_i(LOAD_OPCODE, 6, 2, 2, 0),                # lw   x6, 0(x2)
+        encode_r(ALU_OPCODE, 3, 0, 3, 6, ALT_FUNCT7),     # sub  x3, x3, x6
+        encode_i(ALU_IMMED_OPCODE, 7, 7, 1, 0xFF),        # andi x7, x1, 0xFF
+        encode_s(STORE_OPCODE, 0, 2, 7, 4),               # sb   x7, 4(x2)
+        encode_i(LOAD_OPCODE, 8, 4, 2, 4),                # lbu  x8, 4(x2)
+    ]
+    body.append(encode_b(1, 1, 0, -4 * len(body)))        # bne  x1, x0, loop
+    prologue = [
+        encode_i(ALU_IMMED_OPCODE, 1, 0, 0, 0),           # addi x1, x0, 0
+        encode_u(LOAD_UPPER_OPCODE, 2, base),             # lui  x2, data
+        encode_i(ALU_IMMED_OPCODE, 3, 0, 0, 0),           # addi x3, x0, 0
+    ]
+    return np.array([int(word) for word in prologue + body] + [ECALL_INSTRUCTION], dtype=np.uint32)
+
+def _best(fn, repeat) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def _bench_run(hexpath, engine, memory, steps, repeat) -> tuple:
+    # Only the engine loop is timed, the model is rebuilt for every repeat.
+    best = None
+    for _ in range(repeat):
+        model = RktCpuModel(dict(enablelogging=False, logpath=None, hexpath=hexpath, startingaddr=0,
+                                 engine=engine, memory=memory))
+        result = model.run(max_instructions=steps, until_idle=False)
+        model.close()
+        if best is None or result.elapsed < best[1]:
+            best = (result.retired, result.elapsed)
+    return best[0], "instr", best[1]
+
+def _instructions(tests) -> list:
+    words = [word for path in tests for word in read_hex(path)]
+    return words or [int(loop_kernel()[0])]
+
+def _bench_decode(words, calls, repeat) -> tuple:
+    cpu = Rv32iModel()
+    stream = [words[i % len(words)] for i in range(calls)]
+    return calls, "calls", _best(lambda: [cpu.decode(instr) for instr in stream], repeat)
+
+def _bench_predecode(words, calls, repeat) -> tuple:
+    stream = [words[i % len(words)] for i in range(calls)]
+    return calls, "calls", _best(lambda: [Instruction(instr) for instr in stream], repeat)
+
+def _bench_alu(cpu, calls, repeat) -> tuple:
+    rng = random.Random(0)
+    funct7 = (0, ALT_FUNCT7)
+    args = [(rng.getrandbits(32), rng.getrandbits(32), rng.randrange(8), funct7[rng.randrange(2)])
+            for _ in range(calls)]
+    alu = cpu.alu
+    return calls, "calls", _best(lambda: [alu(a, b, funct3, f7) for a, b, funct3, f7 in args], repeat)
+
+def _bench_memory(memory, write, mode, calls, repeat) -> tuple:
+    mem  = MEMORIES[memory]()
+    step = {"b": 1, "h": 2}.get(mode, 4)
+    # The data window is written once so that reads hit.
+    base, size = DATA_WINDOWS[memory]
+    addrs = [base + (i * step) % size for i in range(calls)]
+    for addr in range(base, base + size, 4):
+        mem.write(addr, 0)
+    if write:
+        fn = lambda: [mem.write(addr, addr, mode) for addr in addrs]
+    else:
+        fn = lambda: [mem.read(addr, mode) for addr in addrs]
+    return calls, "accesses", _best(fn, repeat)
+
+def _bench_log(fmt, calls, workdir, repeat) -> tuple:
+    path = os.path.join(workdir, "bench.{}".format(fmt))
+    records = [(4 * i, 1 + i % 31, (i * 0x9E3779B1) & 0xFFFFFFFF) for i in range(calls)]
+    def fn():
+        sink = TRACE_FORMATS[fmt](path)
+        write = sink.write
+        for pc, rd, res in records:
+            write(pc, rd, res)
+        sink.close()
+    return calls, "records", _best(fn, repeat)
+
+def _bench_hex(hexpath, words, loader, repeat) -> tuple:
+    if loader == "read_hex":
+        fn = lambda: read_hex(hexpath)
+    else:
+        fn = lambda: MEMORIES[loader](instr_path=hexpath, instr_addr=0)
+    return words, "words", _best(fn, repeat)
+
+def benchmarks(tests, workdir, scale=1.0) -> list:
+    """(name, thunk) of every benchmark, a thunk returns (count, unit, seconds)."""
+    sizes = {key: max(1, int(value * scale)) for key, value in BENCH_SIZES.items()}
+    calls = sizes["micro_calls"]
+    out = list()
+
+    loops = dict()
+    for memory in MEMORIES:
+        loops[memory] = os.path.join(workdir, "loop_{}.hex".format(memory))
+        write_hex(loops[memory], loop_kernel(DATA_WINDOWS[memory][0]))
+    for engine in ENGINES:
+        for path in tests:
+            name = pathlib.Path(path).stem
+            out.append(("run/{}/{}".format(engine, name),
+                        lambda path=path, engine=engine: _bench_run(path, engine, "paged", sizes["test_steps"], 3)))
+        for memory in MEMORIES:
+            out.append(("run/{}/loop/{}".format(engine, memory),
+                        lambda engine=engine, memory=memory: _bench_run(loops[memory], engine, memory, sizes["loop_steps"], 1)))
+
+    words = _instructions(tests)
+    out.append(("micro/decode", lambda: _bench_decode(words, calls, 3)))
+    out.append(("micro/predecode", lambda: _bench_predecode(words, calls, 3)))
+    out.append(("micro/alu/numpy", lambda: _bench_alu(Rv32iModel(), calls, 3)))
+    out.append(("micro/alu/int", lambda: _bench_alu(Rv32iIntModel(), calls, 3)))
+    for memory in MEMORIES:
+        for mode in ("w", "b"):
+            out.append(("micro/{}/read/{}".format(memory, mode),
+                        lambda memory=memory, mode=mode: _bench_memory(memory, False, mode, calls, 3)))
+            out.append(("micro/{}/write/{}".format(memory, mode),
+                        lambda memory=memory, mode=mode: _bench_memory(memory, True, mode, calls, 3)))
+    for fmt in TRACE_FORMATS:
+        out.append(("micro/log/{}".format(fmt), lambda fmt=fmt: _bench_log(fmt, calls, workdir, 3)))
+
+    image = os.path.join(workdir, "image.hex")
+    count = sizes["hex_words"]
+    def hex_image(loader):
+        if not os.path.exists(image):
+            rng = np.random.default_rng(0)
+            write_hex(image, rng.integers(0, 1 << 32, size=count, dtype=np.uint64).astype(np.uint32))
+        return _bench_hex(image, count, loader, 3)
+    for loader in HEX_LOADERS:
+        out.append(("hex/{}".format(loader), lambda loader=loader: hex_image(loader)))
+    return out
+
+def run_benchmarks(tests, scale=1.0, patterns=None, progress=None) -> dict:
+    """Run the benchmarks whose names match one of patterns (all by default), returns the result document."""
+    results = dict()
+    with tempfile.TemporaryDirectory() as workdir:
+        for name, thunk in benchmarks(tests, workdir, scale):
+            if patterns and not any(fnmatch.fnmatch(name, pattern) for pattern in patterns):
+                continue
+            count, unit, seconds = thunk()
+            results[name] = {"count": count, "unit": unit, "seconds": seconds, "rate": count / seconds}
+            if progress is not None:
+                progress(name, results[name])
+    return {"version": BENCH_VERSION, "machine": machine_info(), "scale": scale, "results": results}
+
+def save_results(path, document) -> None:
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+def load_results(path) -> dict:
+    with open(path, "r") as f:
+        document = json.load(f)
+    if document.get("version") != BENCH_VERSION:
+        raise ValueError("Unsupported benchmark results version in {}".format(path))
+    return document
+
+def compare_results(baseline, current, threshold=DEFAULT_THRESHOLD) -> list:
+    """(name, baseline rate, current rate, relative change) of every benchmark slower by more than threshold."""
+    slower = list()
+    for name, result in sorted(current["results"].items()):
+        if name not in baseline["results"]:
+            continue
+        old, new = baseline["results"][name]["rate"], result["rate"]
+        change = new / old - 1.0
+        if change < -threshold:
+            slower.append((name, old, new, change))
+    return slower
+
+def machine_differences(baseline, current) -> list:
+    """Metadata keys, other than the model source and time, that differ between two result documents."""
+    ignore = ("model", "time")
+    a, b = baseline["machine"], current["machine"]
+    return [key for key in sorted(set(a) | set(b)) if key not in ignore and a.get(key) != b.get(key)]
+
+def format_results(document, baseline=None) -> str:
+    lines = ["{:<32} {:>10} {:>9} {:>12} {:<10}{}".format("benchmark", "count", "seconds", "rate", "",
+                                                         " {:>8}".format("change") if baseline else "")]
+    for name, result in document["results"].items():
+        line = "{:<32} {:>10} {:>9.4f} {:>12.0f} {:<10}".format(
+            name, result["count"], result["seconds"], result["rate"], result["unit"] + "/s")
+        if baseline and name in baseline["results"]:
+            line += " {:>+8.1%}".format(result["rate"] / baseline["results"][name]["rate"] - 1.0)
+        lines.append(line)
+    return "\n".join(line.rstrip() for line in lines)
@@ -0,0 +1,214 @@
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from rktcpu.trace import iter_trace, TRACE_DTYPE
+
+# RegisterWriteLogger.vhd writes cycle,pc,rd,rdwen,res,valid with hex values
+# as "0x..." and std_logic values as "'1'".
+HDL_COLUMNS = ["cycle", "pc", "rd", "rdwen", "res", "valid"]
+HDL_DTYPE   = np.dtype([("row", "<u8"), ("cycle", "<u8"), ("pc", "<u4"), ("rd", "u1"), ("res", "<u4")])
+
+DEFAULT_CHUNK   = 1 << 18
+DEFAULT_CONTEXT = 3
+
+# Maps an ASCII byte to its hex digit value, the NUL padding of numpy byte
+# strings to 0xFE and anything else (U, X, Z...) to 0xFF.
+_HEX_DIGITS = np.full(256, 0xFF, dtype=np.uint8)
+_HEX_DIGITS[0] = 0xFE
+for _i, _c in enumerate(b"0123456789abcdef"):
+    _HEX_DIGITS[_c] = _i
+for _i, _c in enumerate(b"ABCDEF"):
+    _HEX_DIGITS[_c] = 10 + _i
+
+def hex_to_uint32(values) -> tuple:
+    """Convert "0x..." strings of up to 8 digits to uint32, vectorized.
+
+    Returns (values, ok) where ok is False for fields holding non-hex
+    characters such as unresolved 'U' or 'X' bits.
+    """
+    raw = np.asarray(values, dtype="S10")
+    digits = _HEX_DIGITS[raw.view(np.uint8).reshape(len(raw), 10)[:, 2:]]
+    out = np.zeros(len(raw), dtype=np.uint32)
+    ok  = np.ones(len(raw), dtype=bool)
+    # Shorter fields end in NUL padding, shift in one digit column at a time.
+    for column in digits.T:
+        digit = column < 16
+        ok &= digit | (column == 0xFE)
+        out = np.where(digit, (out << 4) | column, out)
+    return out, ok
+
+def iter_hdl_log(path, chunk=DEFAULT_CHUNK, ignore_x0=True):
+    """Yield HDL_DTYPE arrays of the valid register writes of a RegisterWriteLogger CSV."""
+    reader = pd.read_csv(path, usecols=HDL_COLUMNS, dtype=str, chunksize=chunk)
+    for frame in reader:
+        keep = (frame["valid"].to_numpy() == "'1'") & (frame["rdwen"].to_numpy() == "'1'")
+        frame = frame[keep]
+        pc, pc_ok   = hex_to_uint32(frame["pc"])
+        rd, rd_ok   = hex_to_uint32(frame["rd"])
+        res, res_ok = hex_to_uint32(frame["res"])
+        out = np.empty(len(frame), dtype=HDL_DTYPE)
+        out["row"]   = frame.index.to_numpy()
+        out["cycle"] = frame["cycle"].to_numpy(dtype=np.uint64)
+        out["pc"]    = np.where(pc_ok, pc, 0xFFFFFFFF)
+        out["rd"]    = np.where(rd_ok, rd, 0xFF)
+        out["res"]   = np.where(res_ok, res, 0xFFFFFFFF)
+        # Unresolved values never match a golden value, x0 writes are not
+        # part of the golden trace.
+        if ignore_x0:
+            out = out[(out["rd"] != 0) | ~(pc_ok & rd_ok & res_ok)]
+        yield out
+
+@dataclass
+class Divergence:
+    index   : int
+    row     : int
+    cycle   : int
+    hdl     : list = field(default_factory=list)
+    golden  : list = field(default_factory=list)
+
+@dataclass
+class ComparisonResult:
+    compared        : int = 0
+    matching        : int = 0
+    pc_mismatches   : int = 0
+    rd_mismatches   : int = 0
+    res_mismatches  : int = 0
+    golden_records  : int = 0
+    hdl_records     : int = 0
+    first           : Divergence = None
+
+    @property
+    def mismatches(self) -> int:
+        return self.compared - self.matching
+
+    @property
+    def golden_exhausted(self) -> bool:
+        return self.hdl_records > self.golden_records
+
+    @property
+    def passed(self) -> bool:
+        return self.mismatches == 0 and not self.golden_exhausted
+
+class _GoldenStream():
+    """Golden records handed out in order, read from the trace in chunks."""
+    def __init__(self, path, chunk) -> None:
+        self.chunks  = iter_trace(path, chunk)
+        self.buffer  = np.empty(0, dtype=TRACE_DTYPE)
+        self.records = 0
+
+    def take(self, count) -> np.ndarray:
+        parts = [self.buffer]
+        while sum(len(part) for part in parts) < count:
+            records = next(self.chunks, None)
+            if records is None:
+                break
+            self.records += len(records)
+            parts.append(records)
+        buffer = np.concatenate(parts) if len(parts) > 1 else parts[0]
+        self.buffer = buffer[count:]
+        return buffer[:count]
+
+    def drain(self) -> int:
+        """Count the records left in the trace, returns the total."""
+        for records in self.chunks:
+            self.records += len(records)
+        return self.records
+
+def _window(tail, records, local, context) -> tuple:
+    # Records around records[local] with up to context of them from tail,
+    # and how many more records after the window are still missing.
+    window = np.concatenate((tail, records))
+    start = len(tail) + local - min(context, len(tail) + local)
+    stop  = len(tail) + local + context + 1
+    return window[start:stop], max(0, stop - len(window))
+
+def compare_traces(hdl_path, golden_path, chunk=DEFAULT_CHUNK, context=DEFAULT_CONTEXT,
+                   ignore_x0=True, stop_on_mismatch=False) -> ComparisonResult:
+    """Compare an HDL register-write log against a golden trace in chunks.
+
+    Records are matched in order and both traces are read a chunk at a
+    time. Only the first divergence is kept, with up to context records on
+    either side from both streams.
+    """
+    golden       = _GoldenStream(golden_path, chunk)
+    result       = ComparisonResult()
+    tail         = np.empty(0, dtype=HDL_DTYPE)
+    golden_tail  = np.empty(0, dtype=TRACE_DTYPE)
+    after        = 0
+    golden_after = 0
+    offset       = 0
+    for records in iter_hdl_log(hdl_path, chunk=chunk, ignore_x0=ignore_x0):
+        result.hdl_records += len(records)
+        ref = golden.take(len(records))
+        if after:
+            result.first.hdl += _format_hdl(records[:after])
+            after -= min(after, len(records))
+        if golden_after:
+            result.first.golden += _format_golden(ref[:golden_after])
+            golden_after -= min(golden_after, len(ref))
+        count = len(ref)
+        if count:
+            hdl = records[:count]
+            pc_ok  = hdl["pc"] == ref["pc"]
+            rd_ok  = hdl["rd"] == ref["rd"]
+            res_ok = hdl["res"] == ref["res"]
+            match  = pc_ok & rd_ok & res_ok
+            result.compared       += count
+            result.matching       += int(match.sum())
+            result.pc_mismatches  += int(count - pc_ok.sum())
+            result.rd_mismatches  += int(count - rd_ok.sum())
+            result.res_mismatches += int(count - res_ok.sum())
+            if result.first is None and not match.all():
+                local = int(np.argmin(match))
+                hdl_window, after           = _window(tail, records, local, context)
+                golden_window, golden_after = _window(golden_tail, ref, local, context)
+                result.first = Divergence(
+                    index=offset + local,
+                    row=int(records["row"][local]),
+                    cycle=int(records["cycle"][local]),
+                    hdl=_format_hdl(hdl_window),
+                    golden=_format_golden(golden_window)
+                )
+        offset += len(records)
+        if len(ref) < len(records):
+            # The golden trace ended, nothing is left to extend its window.
+            golden_after = 0
+        if context:
+            tail        = np.concatenate((tail, records))[-context:]
+            golden_tail = np.concatenate((golden_tail, ref))[-context:]
+        if stop_on_mismatch and result.first is not None and not (after or golden_after):
+            break
+    if golden_after:
+        result.first.golden += _format_golden(golden.take(golden_after))
+    result.golden_records = golden.drain()
+    return result
+
+def _format_hdl(records) -> list:
+    return ["cycle {:>8} pc 0x{:08X} rd 0x{:02X} res 0x{:08X}".format(
+        int(r["cycle"]), int(r["pc"]), int(r["rd"]), int(r["res"])) for r in records]
+
+def _format_golden(records) -> list:
+    return ["pc 0x{:08X} rd 0x{:02X} res 0x{:08X}".format(
+        int(r["pc"]), int(r["rd"]), int(r["res"])) for r in records]
+
+def format_report(result) -> str:
+    lines = [
+        "> Compared register writes: {}".format(result.compared),
+        "> Differing PC values: {}".format(result.pc_mismatches),
+        "> Differing RD values: {}".format(result.rd_mismatches),
+        "> Differing RES values: {}".format(result.res_mismatches),
+    ]
+    if result.golden_exhausted:
+        lines.append("> Golden trace ended after {} of {} HDL register writes".format(
+            result.golden_records, result.hdl_records))
+    if result.first is not None:
+        first = result.first
+        lines.append("> First divergence at write {} (CSV row {}, cycle {})".format(
+            first.index, first.row, first.cycle))
+        lines.append(">   HDL:")
+        lines += [">     " + line for line in first.hdl]
+        lines.append(">   Golden:")
+        lines += [">     " + line for line in first.golden]
+    return "\n".join(lines)
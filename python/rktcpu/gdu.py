@@ -0,0 +1,215 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from rktcpu.vectors import write_columns
+
+# Iterations of the STAGE0/STAGE1 loop of DivisionUnit.vhd (iter < 4).
+GDU_ITERATIONS = 4
+
+# Rising edges from i_en to o_valid: IDLE, EXTEND, a STAGE0/STAGE1 pair
+# per iteration, the final STAGE0 and POST_PROCESS.
+GDU_LATENCY = 4 + 2 * GDU_ITERATIONS
+
+MASK32 = np.uint64(0xFFFFFFFF)
+
+# cConstTwo, 2.0 in the unsigned Q32.32 format of the datapath.
+CONST_TWO = np.uint64(2 << 32)
+
+# Operand pairs evaluated at once by sweep(), small enough for the
+# intermediates to stay in cache.
+DEFAULT_CHUNK = 1 << 14
+
+# Operands that exercise the pre-shift, the sign handling and overflow.
+CORNER_VALUES = sorted({0, 1, 2, 3, 5, 7, 10, 0x7FFFFFFF, 0x80000000, 0x80000001, 0xFFFFFFFF, 0xFFFFFFFE}
+                       | {1 << i for i in range(32)}
+                       | {(1 << i) - 1 for i in range(2, 33)}
+                       | {(1 << i) + 1 for i in range(2, 32)})
+
+@dataclass
+class GduResult:
+    quotient  : np.ndarray
+    remainder : np.ndarray
+    # Division by zero, o_error is pulsed and o_valid never rises.
+    error     : np.ndarray
+    # Right shift applied in EXTEND.
+    shift     : np.ndarray
+    # (iterations, n) values of fval and of num and denom after each
+    # iteration, only kept with intermediates=True.
+    fval      : np.ndarray = None
+    num       : np.ndarray = None
+    denom     : np.ndarray = None
+
+def _uint32(values) -> np.ndarray:
+    # Accepts signed or unsigned integers, negative values wrap.
+    return (np.asarray(values, dtype=np.int64) & 0xFFFFFFFF).astype(np.uint64)
+
+def _negate(values, mask=None) -> np.ndarray:
+    out = np.uint64(0) - values
+    return out if mask is None else out & mask
+
+def _mul_q32(a, b1, b0) -> np.ndarray:
+    """Bits 95..32 of the 128-bit product a * b, as num_product(95 downto 32).
+
+    b is given as its 32-bit limbs. With a split the same way every partial
+    product fits a uint64, the wrapping sums are exact modulo 2**64.
+    """
+    a1, a0 = a >> np.uint64(32), a & MASK32
+    out = a0 * b0
+    out >>= np.uint64(32)
+    term = a1 * b0
+    out += term
+    np.multiply(a0, b1, out=term)
+    out += term
+    np.multiply(a1, b1, out=term)
+    term <<= np.uint64(32)
+    out += term
+    return out
+
+def _first_high_bit(values) -> np.ndarray:
+    # find_first_high_bit, 0 for 0. float64 holds 32-bit integers exactly.
+    return np.maximum(np.frexp(values.astype(np.float64))[1] - 1, 0).astype(np.uint64)
+
+def _magnitudes(num, denom, signed) -> tuple:
+    # IDLE: operand magnitudes and whether the results are negated.
+    num   = _uint32(num)
+    denom = _uint32(denom)
+    signed = np.broadcast_to(np.asarray(signed, dtype=bool), num.shape)
+    snum = signed & (num >> np.uint64(31) == 1)
+    sden = signed & (denom >> np.uint64(31) == 1)
+    cnum   = np.where(snum, _negate(num, MASK32), num)
+    cdenom = np.where(sden, _negate(denom, MASK32), denom)
+    return cnum, cdenom, snum != sden
+
+def _finish(num, cnum, cdenom, negative) -> tuple:
+    # STAGE0 remainder and POST_PROCESS sign correction.
+    remdr = (cnum - (num >> np.uint64(32)) * cdenom) & MASK32
+    num   = np.where(negative, _negate(num), num)
+    remdr = np.where(negative, _negate(remdr, MASK32), remdr)
+    return ((num >> np.uint64(32)) & MASK32).astype(np.uint32), remdr.astype(np.uint32)
+
+def goldschmidt(num, denom, signed=False, iterations=GDU_ITERATIONS, intermediates=False) -> GduResult:
+    """Bit-accurate DivisionUnit.vhd for arrays of 32-bit operands.
+
+    signed is a bool or a bool array. Like the RTL, signed operands are
+    divided as magnitudes and both results are negated when the signs
+    differ, so the remainder does not follow the RISC-V sign rule.
+    """
+    cnum, cdenom, negative = _magnitudes(num, denom, signed)
+    shift = _first_high_bit(cdenom)
+    n = (cnum << np.uint64(32)) >> shift
+    d = (cdenom << np.uint64(32)) >> shift
+    history = ([], [], [])
+    for _ in range(iterations):
+        fval = CONST_TWO - d
+        f1, f0 = fval >> np.uint64(32), fval & MASK32
+        n = _mul_q32(n, f1, f0)
+        d = _mul_q32(d, f1, f0)
+        if intermediates:
+            for column, value in zip(history, (fval, n, d)):
+                column.append(value)
+
+    quotient, remainder = _finish(n, cnum, cdenom, negative)
+    result = GduResult(quotient=quotient, remainder=remainder, error=cdenom == 0,
+                       shift=shift.astype(np.uint8))
+    if intermediates:
+        result.fval, result.num, result.denom = [np.stack(column) if column else np.empty((0,) + n.shape, np.uint64)
+                                                  for column in history]
+    return result
+
+def riscv_divide(num, denom, signed=False) -> tuple:
+    """Reference DIV[U]/REM[U] results of the RISC-V M extension as (quotient, remainder)."""
+    unum   = _uint32(num).astype(np.int64)
+    udenom = _uint32(denom).astype(np.int64)
+    signed = np.broadcast_to(np.asarray(signed, dtype=bool), unum.shape)
+    a = np.where(signed & (unum >= 1 << 31), unum - (1 << 32), unum)
+    b = np.where(signed & (udenom >= 1 << 31), udenom - (1 << 32), udenom)
+    zero = b == 0
+    safe = np.where(zero, 1, b)
+    # Truncating division, -2**31 / -1 wraps back to -2**31 with remainder 0.
+    quotient  = np.sign(a) * np.sign(safe) * (np.abs(a) // np.abs(safe))
+    remainder = a - quotient * safe
+    quotient  = np.where(zero, -1, quotient)
+    remainder = np.where(zero, a, remainder)
+    return (quotient & 0xFFFFFFFF).astype(np.uint32), (remainder & 0xFFFFFFFF).astype(np.uint32)
+
+def iterations_needed(num, denom, signed=False, max_iterations=16) -> np.ndarray:
+    """Fewest iterations after which the quotient equals the RISC-V one, max_iterations + 1 if never.
+
+    Division by zero, where the RTL produces no result, reports 0.
+    """
+    result = goldschmidt(num, denom, signed, iterations=max_iterations, intermediates=True)
+    expected, _ = riscv_divide(num, denom, signed)
+    cnum, cdenom, negative = _magnitudes(num, denom, signed)
+    needed = np.full(len(expected), max_iterations + 1, dtype=np.int64)
+    for k in range(max_iterations, 0, -1):
+        quotient, _ = _finish(result.num[k - 1], cnum, cdenom, negative)
+        needed[quotient == expected] = k
+    needed[result.error] = 0
+    return needed
+
+@dataclass
+class SweepSummary:
+    pairs              : int = 0
+    divide_by_zero     : int = 0
+    quotient_errors    : int = 0
+    remainder_errors   : int = 0
+    # Largest |gdu - reference| of the signed quotients.
+    max_quotient_error : int = 0
+    # First few mismatching (num, denom, signed, gdu quotient, riscv quotient).
+    examples           : list = None
+
+    @property
+    def passed(self) -> bool:
+        return not self.quotient_errors and not self.remainder_errors
+
+def sweep(num, denom, signed=False, iterations=GDU_ITERATIONS, chunk=DEFAULT_CHUNK, examples=10) -> SweepSummary:
+    """Compare goldschmidt() with riscv_divide() over operand arrays in chunks, division by zero excluded."""
+    num   = _uint32(num)
+    denom = _uint32(denom)
+    signed = np.broadcast_to(np.asarray(signed, dtype=bool), num.shape)
+    summary = SweepSummary(examples=[])
+    for start in range(0, len(num), chunk):
+        a, b, s = num[start:start + chunk], denom[start:start + chunk], signed[start:start + chunk]
+        result = goldschmidt(a, b, s, iterations=iterations)
+        quotient, remainder = riscv_divide(a, b, s)
+        valid = ~result.error
+        bad_q = valid & (result.quotient != quotient)
+        bad_r = valid & (result.remainder != remainder)
+        summary.pairs            += len(a)
+        summary.divide_by_zero   += int(result.error.sum())
+        summary.quotient_errors  += int(bad_q.sum())
+        summary.remainder_errors += int(bad_r.sum())
+        if bad_q.any():
+            # Quotients of signed pairs are compared as signed values.
+            view = lambda q: np.where(s[bad_q], q[bad_q].astype(np.int32), q[bad_q]).astype(np.int64)
+            diff = np.abs(view(result.quotient) - view(quotient))
+            summary.max_quotient_error = max(summary.max_quotient_error, int(diff.max()))
+        for i in np.flatnonzero(bad_q | bad_r)[:examples - len(summary.examples)].tolist():
+            summary.examples.append((int(a[i]), int(b[i]), bool(s[i]), int(result.quotient[i]), int(quotient[i])))
+    return summary
+
+def random_operands(count, seed=0) -> tuple:
+    """Random (num, denom) pairs, half uniform and half with log-uniform magnitudes."""
+    rng = np.random.default_rng(seed)
+    def draw():
+        values = rng.integers(0, 1 << 32, size=count, dtype=np.uint64)
+        small  = rng.random(count) < 0.5
+        bits   = rng.integers(0, 33, size=count, dtype=np.uint64)
+        return np.where(small, values >> (np.uint64(32) - bits), values)
+    return draw(), draw()
+
+def corner_operands() -> tuple:
+    """Every pair of CORNER_VALUES."""
+    values = np.array(CORNER_VALUES, dtype=np.uint64)
+    num, denom = np.meshgrid(values, values, indexing="ij")
+    return num.ravel(), denom.ravel()
+
+def write_vectors(path, num, denom, signed=False, iterations=GDU_ITERATIONS) -> int:
+    """Write "signed num denom div rem error" lines with the bit-accurate results for tb_DivisionUnit."""
+    num   = _uint32(num)
+    denom = _uint32(denom)
+    signed = np.broadcast_to(np.asarray(signed, dtype=bool), num.shape)
+    result = goldschmidt(num, denom, signed, iterations=iterations)
+    return write_columns(path, [(signed, 1, 2), (num, 8, 16), (denom, 8, 16),
+                                (result.quotient, 8, 16), (result.remainder, 8, 16), (result.error, 1, 2)])
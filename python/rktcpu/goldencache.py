@@ -0,0 +1,113 @@
+import functools
+import hashlib
+import json
+import os
+import pathlib
+import zlib
+
+# Entries beyond this total size are evicted, least recently used first.
+DEFAULT_MAX_BYTES = 256 << 20
+
+# Settings that name files rather than change what the model executes.
+_PATH_SETTINGS = ("logpath", "hexpath", "elfpath")
+
+MODEL_SOURCE = pathlib.Path(__file__).resolve().parent
+
+@functools.lru_cache(maxsize=None)
+def model_digest(root=MODEL_SOURCE) -> str:
+    """Hash of every Python source file of the model package."""
+    digest = hashlib.sha256()
+    root = pathlib.Path(root)
+    for path in sorted(root.rglob("*.py")):
+        digest.update(str(path.relative_to(root)).encode())
+        digest.update(b"\0")
+        digest.update(path.read_bytes())
+    return digest.hexdigest()
+
+def golden_key(image, settings, max_instructions) -> str:
+    """Content hash of the program image, the run settings and the model source."""
+    if isinstance(image, (str, os.PathLike)):
+        image = pathlib.Path(image).read_bytes()
+    settings = {k: v for k, v in settings.items() if k not in _PATH_SETTINGS}
+    digest = hashlib.sha256(image)
+    digest.update(json.dumps([settings, max_instructions], sort_keys=True).encode())
+    digest.update(model_digest().encode())
+    return digest.hexdigest()
+
+class GoldenCache():
+    """Directory of zlib-compressed binary golden traces keyed by golden_key.
+
+    Each entry is a compressed trace and a small JSON file with the run
+    result. Hits refresh the entry's modification time, which orders the
+    LRU eviction. Entries are written under a temporary name and renamed,
+    so concurrent workers never see a partial entry.
+    """
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES) -> None:
+        self.directory = pathlib.Path(directory)
+        self.max_bytes = max_bytes
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def _paths(self, key) -> tuple:
+        return self.directory / "{}.trace.z".format(key), self.directory / "{}.json".format(key)
+
+    def get(self, key, tracepath):
+        """Write the cached trace to tracepath and return its metadata, or None on a miss."""
+        trace, meta = self._paths(key)
+        try:
+            with open(meta, "r") as f:
+                info = json.load(f)
+            data = zlib.decompress(trace.read_bytes())
+        except (FileNotFoundError, ValueError, zlib.error):
+            return None
+        with open(tracepath, "wb") as f:
+            f.write(data)
+        for path in (trace, meta):
+            try:
+                os.utime(path)
+            except FileNotFoundError:
+                pass
+        return info
+
+    def put(self, key, tracepath, info) -> None:
+        """Store the trace at tracepath with its JSON-serializable metadata."""
+        trace, meta = self._paths(key)
+        suffix = ".{}.tmp".format(os.getpid())
+        with open(str(trace) + suffix, "wb") as f:
+            f.write(zlib.compress(pathlib.Path(tracepath).read_bytes()))
+        with open(str(meta) + suffix, "w") as f:
+            json.dump(info, f)
+        # The metadata goes last, get() treats a missing one as a miss.
+        os.replace(str(trace) + suffix, trace)
+        os.replace(str(meta) + suffix, meta)
+
+    def size(self) -> int:
+        return sum(path.stat().st_size for path in self.directory.iterdir() if path.is_file())
+
+    def evict(self) -> int:
+        """Remove least recently used entries until the cache fits max_bytes, returns the count removed."""
+        entries = []
+        for meta in self.directory.glob("*.json"):
+            trace, meta = self._paths(meta.stem)
+            try:
+                size = meta.stat().st_size + trace.stat().st_size
+                entries.append((meta.stat().st_mtime, size, meta, trace))
+            except FileNotFoundError:
+                continue
+        total = sum(entry[1] for entry in entries)
+        removed = 0
+        for _, size, meta, trace in sorted(entries, key=lambda entry: entry[0]):
+            if total <= self.max_bytes:
+                break
+            for path in (meta, trace):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+            removed += 1
+        return removed
+
+    def clear(self) -> None:
+        for path in self.directory.iterdir():
+            if path.is_file():
+                path.unlink()
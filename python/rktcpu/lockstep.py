@@ -0,0 +1,232 @@
+import collections
+import os
+import signal
+import stat
+import subprocess
+import time
+from dataclasses import dataclass
+
+from rktcpu.compare import Divergence, DEFAULT_CONTEXT
+from rktcpu.model import RktCpuModel
+from rktcpu.trace import QueueTraceSink
+
+# The int engine has the lowest overhead for runs of a single instruction.
+LOCKSTEP_SETTINGS = {
+    "enablelogging" : False,
+    "logpath"       : None,
+    "startingaddr"  : 0,
+    "engine"        : "int",
+    "memory"        : "paged"
+}
+
+# Seconds between polls of a log that has no new data.
+DEFAULT_POLL = 0.05
+
+# Instructions the model may retire without a register write before an HDL
+# write is reported as having no golden counterpart.
+DEFAULT_MAX_GAP = 1 << 16
+
+# Reasons reported by LockstepResult.
+LOCKSTEP_MISMATCH      = "mismatch"
+LOCKSTEP_MODEL_STOPPED = "model_stopped"
+LOCKSTEP_END_OF_LOG    = "end_of_log"
+
+@dataclass
+class LockstepResult:
+    checked : int = 0
+    retired : int = 0
+    rows    : int = 0
+    reason  : str = None
+    killed  : bool = False
+    first   : Divergence = None
+
+    @property
+    def passed(self) -> bool:
+        return self.reason == LOCKSTEP_END_OF_LOG
+
+def follow(path, process=None, poll=DEFAULT_POLL, timeout=None):
+    """Yield the lines appended to a growing log file or written to a FIFO.
+
+    RegisterWriteLogger.vhd reopens its file every cycle, so the log is
+    read without blocking and a missing file, end of file or a FIFO without
+    a writer all mean "no data yet". Following ends once process has exited
+    and its output is drained, or after timeout seconds without new data.
+    A trailing partial line is only yielded at the end.
+    """
+    fd = None
+    offset = 0
+    buffer = b""
+    last = time.monotonic()
+    try:
+        while True:
+            exited = process is not None and process.poll() is not None
+            if fd is None and os.path.exists(path):
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            data = b""
+            if fd is not None:
+                if stat.S_ISREG(os.fstat(fd).st_mode) and os.fstat(fd).st_size < offset:
+                    # Truncated by the first file_open in write_mode.
+                    os.lseek(fd, 0, os.SEEK_SET)
+                    offset = 0
+                    buffer = b""
+                try:
+                    data = os.read(fd, 1 << 16)
+                except BlockingIOError:
+                    pass
+            if data:
+                offset += len(data)
+                last = time.monotonic()
+                *lines, buffer = (buffer + data).split(b"\n")
+                for line in lines:
+                    yield line.decode("ascii", "replace")
+                continue
+            if exited or (timeout is not None and time.monotonic() - last > timeout):
+                break
+            time.sleep(poll)
+        if buffer.strip():
+            yield buffer.decode("ascii", "replace")
+    finally:
+        if fd is not None:
+            os.close(fd)
+
+def _parse_hex(text):
+    # Fields holding U or X bits are kept as text.
+    try:
+        return int(text, 16)
+    except ValueError:
+        return text
+
+def _format(cycle, pc, rd, res) -> str:
+    # Unresolved HDL values are shown as they were logged.
+    fields = [value if isinstance(value, str) else fmt.format(value)
+              for value, fmt in ((pc, "0x{:08X}"), (rd, "0x{:02X}"), (res, "0x{:08X}"))]
+    line = "pc {} rd {} res {}".format(*fields)
+    return line if cycle is None else "cycle {:>8} {}".format(cycle, line)
+
+class LockstepChecker():
+    """Compare RegisterWriteLogger lines against the model as they arrive.
+
+    Every valid HDL register write advances the model one instruction at a
+    time until it writes a register, so the model never runs ahead of the
+    simulation. Writes to x0 are skipped as in compare_traces. The model
+    must not have run yet, the block engine captures the log sink when it
+    translates code.
+    """
+    def __init__(self, model, context=DEFAULT_CONTEXT, max_gap=DEFAULT_MAX_GAP) -> None:
+        self.model   = model
+        self.max_gap = max_gap
+        self.sink    = QueueTraceSink()
+        model.cpu.log = self.sink
+        self.hdl     = collections.deque(maxlen=context)
+        self.golden  = collections.deque(maxlen=context)
+        self.result  = LockstepResult()
+
+    def _next_golden(self):
+        records = self.sink.records
+        gap = 0
+        while not records and gap < self.max_gap:
+            run = self.model.run(max_instructions=1, until_ecall=False, until_idle=False)
+            self.result.retired += run.retired
+            gap += 1
+            if not run.retired:
+                break
+        return records.popleft() if records else None
+
+    def feed(self, line) -> bool:
+        """Check one log line, returns False once the model and the HDL diverged."""
+        fields = line.strip().split(",")
+        if len(fields) < 6 or fields[0] == "cycle":
+            return True
+        row = self.result.rows
+        self.result.rows += 1
+        cycle, pc, rd, rdwen, res, valid = fields[:6]
+        if valid != "'1'" or rdwen != "'1'":
+            return True
+        pc, rd, res = _parse_hex(pc), _parse_hex(rd), _parse_hex(res)
+        # Unresolved values never match, x0 writes are not in the golden trace.
+        if rd == 0 and not isinstance(pc, str) and not isinstance(res, str):
+            return True
+        hdl = _format(cycle, pc, rd, res)
+        golden = self._next_golden()
+        if golden is not None and golden == (pc, rd, res):
+            self.result.checked += 1
+            self.hdl.append(hdl)
+            self.golden.append(_format(None, *golden))
+            return True
+        self.result.reason = LOCKSTEP_MISMATCH if golden is not None else LOCKSTEP_MODEL_STOPPED
+        self.result.first = Divergence(
+            index=self.result.checked,
+            row=row,
+            cycle=int(cycle) if cycle.isdigit() else 0,
+            hdl=list(self.hdl) + [hdl],
+            golden=list(self.golden) + ([] if golden is None else [_format(None, *golden)])
+        )
+        return False
+
+    def check(self, lines, process=None, sig=signal.SIGTERM) -> LockstepResult:
+        """Feed lines until the first divergence, then send sig to the simulator process."""
+        for line in lines:
+            if not self.feed(line):
+                if process is not None and process.poll() is None:
+                    stop_process(process, sig)
+                    self.result.killed = True
+                break
+        else:
+            self.result.reason = LOCKSTEP_END_OF_LOG
+        return self.result
+
+def stop_process(process, sig=signal.SIGTERM) -> None:
+    """Signal process, or its whole group when it leads one (e.g. VUnit and its GHDL child)."""
+    try:
+        if os.getpgid(process.pid) == process.pid:
+            os.killpg(process.pid, sig)
+        else:
+            process.send_signal(sig)
+    except ProcessLookupError:
+        pass
+
+def run_lockstep(hexpath, logpath, command=None, fifo=False, settings=None, context=DEFAULT_CONTEXT,
+                 poll=DEFAULT_POLL, timeout=None, sig=signal.SIGTERM) -> LockstepResult:
+    """Start the simulator command and check its register-write log while it runs.
+
+    A stale log is removed first, or replaced by a named FIFO when fifo is
+    set. Without a command, an already running simulation is followed until
+    timeout seconds pass without new lines.
+    """
+    if os.path.lexists(logpath) and not (fifo and stat.S_ISFIFO(os.stat(logpath).st_mode)):
+        os.remove(logpath)
+    if fifo and not os.path.exists(logpath):
+        os.mkfifo(logpath)
+    model = RktCpuModel(dict(LOCKSTEP_SETTINGS, **(settings or {}), hexpath=hexpath))
+    process = None
+    try:
+        checker = LockstepChecker(model, context=context)
+        if command is not None:
+            process = subprocess.Popen(command, start_new_session=True)
+        return checker.check(follow(logpath, process, poll, timeout), process, sig)
+    finally:
+        if process is not None:
+            process.wait()
+        model.close()
+        if fifo:
+            os.remove(logpath)
+
+def format_lockstep_report(result) -> str:
+    lines = [
+        "> Checked register writes: {}".format(result.checked),
+        "> Model instructions retired: {}".format(result.retired),
+        "> HDL log rows: {}".format(result.rows),
+    ]
+    if result.reason == LOCKSTEP_MODEL_STOPPED:
+        lines.append("> The model produced no register write for the HDL write below")
+    if result.killed:
+        lines.append("> Simulator stopped at the first divergence")
+    if result.first is not None:
+        first = result.first
+        lines.append("> First divergence at write {} (CSV row {}, cycle {})".format(
+            first.index, first.row, first.cycle))
+        lines.append(">   HDL:")
+        lines += [">     " + line for line in first.hdl]
+        lines.append(">   Golden:")
+        lines += [">     " + line for line in first.golden]
+    return "\n".join(lines)
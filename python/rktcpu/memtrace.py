@@ -0,0 +1,174 @@
+from array import array
+
+import numpy as np
+
+# One record per load or store, data is the value read or written.
+MEMTRACE_DTYPE = np.dtype([("pc", "<u4"), ("addr", "<u4"), ("size", "u1"), ("write", "u1"), ("data", "<u4")])
+
+MEMTRACE_HEADER = "pc,addr,size,rw,data,\n"
+MEMTRACE_RECORD = "0x%08X,0x%08X,%d,%s,0x%08X,\n"
+
+# Records buffered before they are moved into a record block.
+DEFAULT_BLOCK = 1 << 16
+
+# Access size in bytes of each memory mode. Loads and stores always pass a
+# mode, reads without one are instruction fetches and are not traced.
+MODE_SIZES = {"b": 1, "h": 2, "w": 4}
+
+# Reason reported by RktCpuModel.run when a watchpoint is hit.
+STOP_WATCHPOINT = "watchpoint"
+
+WATCH_ACCESSES = {"r": (True, False), "w": (False, True), "rw": (True, True)}
+
+class WatchStops(frozenset):
+    """Breakpoint set that contains every pc once a watchpoint was hit.
+
+    Passed to the engine in place of the breakpoints, so the run stops
+    before the instruction after the access through the existing
+    breakpoint check.
+    """
+    def __new__(cls, pcs, tracer):
+        stops = super().__new__(cls, pcs)
+        stops.tracer = tracer
+        return stops
+
+    def __contains__(self, pc) -> bool:
+        return self.tracer.hit is not None or frozenset.__contains__(self, pc)
+
+    def __bool__(self) -> bool:
+        return True
+
+class MemoryTracer():
+    """Memory wrapper recording loads and stores and checking watchpoints.
+
+    The pc of each access is the pc of the executing instruction, reads
+    without a mode are instruction fetches and are skipped. Records
+    are buffered in an array and moved into preallocated MEMTRACE_DTYPE
+    blocks of block records. read() and write() are rebound to the variant
+    for the enabled features, so a tracer that neither records nor watches
+    forwards straight to the wrapped memory. Watchpoints are inclusive
+    address ranges, the first access that overlaps one is kept in hit until
+    take_hit().
+    """
+    def __init__(self, mem, cpu, record=True, block=DEFAULT_BLOCK) -> None:
+        self.mem         = mem
+        self.cpu         = cpu
+        self.record      = record
+        self.block       = block
+        self.watchpoints = list()
+        self.hit         = None
+        self.blocks      = list()
+        self._buffer     = array("I")
+        self._update()
+
+    def __getattr__(self, name):
+        return getattr(self.mem, name)
+
+    @property
+    def decoded(self):
+        return self.mem.decoded
+
+    def _update(self) -> None:
+        if self.watchpoints:
+            self.read, self.write = self._read_watched, self._write_watched
+        elif self.record:
+            self.read, self.write = self._read_recorded, self._write_recorded
+        else:
+            self.read, self.write = self.mem.read, self.mem.write
+
+    def set_record(self, record) -> None:
+        self.record = record
+        self._update()
+
+    def add_watchpoint(self, lo, hi=None, access="w") -> None:
+        """Watch lo..hi (inclusive) for loads ("r"), stores ("w") or both ("rw")."""
+        if access not in WATCH_ACCESSES:
+            raise ValueError("Unknown watchpoint access: {}".format(access))
+        hi = lo if hi is None else hi
+        if hi < lo:
+            raise ValueError("Empty watchpoint range 0x{:08X}..0x{:08X}".format(lo, hi))
+        self.watchpoints.append((lo, hi) + WATCH_ACCESSES[access])
+        self._update()
+
+    def clear_watchpoints(self) -> None:
+        self.watchpoints.clear()
+        self.hit = None
+        self._update()
+
+    def take_hit(self):
+        """Return the (pc, addr, size, write, data) of the watchpoint hit and clear it, or None."""
+        hit, self.hit = self.hit, None
+        return hit
+
+    def _append(self, addr, mode, write, data) -> None:
+        buffer = self._buffer
+        buffer.extend((self.cpu.pc, addr, MODE_SIZES[mode] | write << 8, data))
+        if len(buffer) >= 4 * self.block:
+            self.flush()
+
+    def _read_recorded(self, addr, mode=None):
+        data = self.mem.read(addr, mode)
+        if mode is not None:
+            self._append(addr, mode, 0, data)
+        return data
+
+    def _write_recorded(self, addr, data, mode=None):
+        self.mem.write(addr, data, mode)
+        self._append(addr, mode or "w", 1, int(data) & 0xFFFFFFFF)
+
+    def _watch(self, addr, mode, write, data) -> None:
+        if self.record:
+            self._append(addr, mode, write, data)
+        if self.hit is not None:
+            return
+        size = MODE_SIZES[mode]
+        for lo, hi, reads, writes in self.watchpoints:
+            if addr <= hi and addr + size > lo and (writes if write else reads):
+                self.hit = (int(self.cpu.pc), int(addr), size, bool(write), int(data))
+                return
+
+    def _read_watched(self, addr, mode=None):
+        data = self.mem.read(addr, mode)
+        if mode is not None:
+            self._watch(addr, mode, 0, data)
+        return data
+
+    def _write_watched(self, addr, data, mode=None):
+        self.mem.write(addr, data, mode)
+        self._watch(addr, mode or "w", 1, int(data) & 0xFFFFFFFF)
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        words = np.frombuffer(self._buffer, dtype=np.uint32).reshape(-1, 4)
+        out = np.empty(self.block, dtype=MEMTRACE_DTYPE)
+        count = len(words)
+        out["pc"][:count]    = words[:, 0]
+        out["addr"][:count]  = words[:, 1]
+        out["size"][:count]  = words[:, 2] & 0xFF
+        out["write"][:count] = words[:, 2] >> 8
+        out["data"][:count]  = words[:, 3]
+        self.blocks.append(out[:count])
+        # The view is released before the buffer is resized.
+        del words
+        del self._buffer[:]
+
+    def records(self) -> np.ndarray:
+        """Every access so far as one MEMTRACE_DTYPE array."""
+        self.flush()
+        if not self.blocks:
+            return np.empty(0, dtype=MEMTRACE_DTYPE)
+        return np.concatenate(self.blocks)
+
+    def reset(self) -> None:
+        self._buffer = array("I")
+        self.blocks.clear()
+
+    def write_csv(self, path) -> int:
+        """Write the accesses as pc,addr,size,rw,data lines, returns the number of records."""
+        records = self.records()
+        with open(path, "w") as f:
+            f.write(MEMTRACE_HEADER)
+            f.write("".join(MEMTRACE_RECORD % (pc, addr, size, "w" if write else "r", data)
+                            for pc, addr, size, write, data in records.tolist()))
+        return len(records)
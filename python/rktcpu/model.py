@@ -1,27 +1,244 @@
+import time
 from dataclasses import dataclass
 from typing import Any
 
 import numpy as np
 
-from rktcpu.riscv.rv32i import Rv32iModel
-from rktcpu.riscv.memory import Memory
+from rktcpu.riscv.rv32i import Rv32iModel, STOP_BREAKPOINT, STOP_MAX_INSTRUCTIONS
+from rktcpu.riscv.rv32i_int import Rv32iIntModel
+from rktcpu.riscv.rv32i_block import Rv32iBlockModel
+from rktcpu.riscv.memory import Memory, PagedMemory, IMEM_REGION
+from rktcpu.riscv.bus import Bus
 from rktcpu.riscv.csr import CsrRegisters
+from rktcpu.riscv.elf import ElfImage
+from rktcpu.riscv.cache import CachedMemory, build_caches
+from rktcpu.profiler import Profiler
+from rktcpu.memtrace import MemoryTracer, WatchStops, STOP_WATCHPOINT
+from rktcpu.snapshot import Snapshot, save_snapshots, load_snapshots
+
+# Execution engines selectable through settings["engine"]. All engines
+# produce identical register-write logs.
+ENGINES = {
+    "numpy" : Rv32iModel,
+    "int"   : Rv32iIntModel,
+    "block" : Rv32iBlockModel,
+}
+
+# Stop reason reported by RktCpuModel.run when until_pc is reached.
+STOP_UNTIL_PC = "until_pc"
+
+@dataclass
+class RunResult:
+    retired    : int
+    reason     : str
+    elapsed    : float
+    pc         : int
+    # (pc, addr, size, write, data) of the access that stopped the run.
+    watchpoint : tuple = None
+
+# Memory backends selectable through settings["memory"].
+MEMORIES = {
+    "dict"  : Memory,
+    "paged" : PagedMemory,
+    "bus"   : Bus,
+}
 
 class RktCpuModel():
     def __init__(self, settings) -> None:
-        self.cpu = Rv32iModel(
+        engine = settings.get("engine", "numpy")
+        if engine not in ENGINES:
+            raise ValueError("Unknown engine: {}".format(engine))
+        self.cpu = ENGINES[engine](
             logpath=settings["logpath"],
-            enablelogging=settings["enablelogging"]
-        )
-        self.mem = Memory(
-            instr_path=settings["hexpath"], 
-            instr_addr=settings["startingaddr"]
+            enablelogging=settings["enablelogging"],
+            logformat=settings.get("logformat", "csv")
         )
+        memory = settings.get("memory", "dict")
+        if memory not in MEMORIES:
+            raise ValueError("Unknown memory: {}".format(memory))
+        self.symbols = dict()
+        code_region  = IMEM_REGION
+        if settings.get("elfpath") is not None:
+            # Map the PT_LOAD segments of the executable and start at its entry.
+            self.mem = MEMORIES[memory]()
+            image = ElfImage(settings["elfpath"])
+            image.load(self.mem)
+            self.symbols = image.symbols
+            self.cpu.pc  = image.entry
+            code_region  = image.code_region() or code_region
+            image.close()
+        else:
+            self.mem = MEMORIES[memory](
+                instr_path=settings["hexpath"], 
+                instr_addr=settings["startingaddr"]
+            )
         self.csr = CsrRegisters()
+        # Unwrapped memory, reads through it leave the cache models untouched.
+        self.backing = self.mem
+
+        # Optional I$/D$ models between the engine and the memory, kept in
+        # self.cached as the memory trace may wrap it later.
+        self.icache, self.dcache = build_caches(settings)
+        self.cached = None
+        if self.icache is not None or self.dcache is not None:
+            if engine == "block":
+                raise ValueError("The cache model needs the numpy or int engine")
+            self.cached = CachedMemory(self.mem, self.cpu, icache=self.icache, dcache=self.dcache)
+            self.mem = self.cached
+
+        # Optional per-pc profile, nothing is hooked into the engine without it.
+        self.profiler = None
+        if settings.get("profile", False):
+            self.profiler = Profiler(code_region)
+            self.profiler.attach(self.cpu)
+
+        # Optional load/store trace and watchpoints, the memory is only
+        # wrapped once either is enabled.
+        self.engine   = engine
+        self.memtrace = None
+        if settings.get("memtrace", False):
+            self.enable_memtrace()
+        for watchpoint in settings.get("watchpoints", ()):
+            self.add_watchpoint(*watchpoint)
+
+        # The bus snapshots its devices in the paged format.
+        self.paged = memory != "dict"
+
+        # Automatic snapshots every checkpoint_every instructions, keyed by
+        # the number of instructions retired since reset.
+        self.checkpoint_every = settings.get("checkpoint_every")
+        self.checkpoints = dict()
+
+    def enable_memtrace(self, record=True) -> MemoryTracer:
+        if self.memtrace is None:
+            self.memtrace = MemoryTracer(self.mem, self.cpu, record=record)
+            self.mem = self.memtrace
+        elif record:
+            self.memtrace.set_record(True)
+        return self.memtrace
+
+    def add_watchpoint(self, lo, hi=None, access="w") -> None:
+        """Stop run() after a load ("r"), store ("w") or either ("rw") that touches lo..hi."""
+        if self.engine == "block":
+            # Translated blocks only check for stops at their start.
+            raise ValueError("Watchpoints need the numpy or int engine")
+        self.enable_memtrace(record=False).add_watchpoint(lo, hi, access)
+
+    def _stops(self, stops) -> frozenset:
+        if self.memtrace is not None and self.memtrace.watchpoints:
+            return WatchStops(stops, self.memtrace)
+        return frozenset(stops)
 
-    def step(self) -> None:
+    def _take_hit(self):
+        return None if self.memtrace is None else self.memtrace.take_hit()
+
+    def _watch_hit(self) -> bool:
+        return self.memtrace is not None and self.memtrace.hit is not None
+
+    def step(self):
+        """Execute one instruction, returns the watchpoint hit of its access or None."""
         self.cpu.step(self.mem, self.csr)
-        self.csr.step()
+        return self._take_hit()
+
+    def run(self, max_instructions=None, until_pc=None, until_ecall=True,
+            breakpoints=(), until_idle=True) -> RunResult:
+        """Execute in the engine's own loop until a stop condition is met.
+
+        The run stops after max_instructions, before executing until_pc, a
+        breakpoint or an ecall, or once the program jumps to itself without
+        changing state (until_idle).
+        """
+        stops = set(breakpoints)
+        if until_pc is not None:
+            stops.add(until_pc)
+        start = time.perf_counter()
+        if self.checkpoint_every:
+            retired, reason = self._run_checkpointed(max_instructions, self._stops(stops), until_ecall, until_idle)
+        else:
+            retired, reason = self.cpu.run(
+                self.mem, self.csr,
+                max_instructions=max_instructions,
+                breakpoints=self._stops(stops),
+                until_ecall=until_ecall,
+                until_idle=until_idle
+            )
+        elapsed = time.perf_counter() - start
+        pc = int(self.cpu.pc)
+        # A hit is reported once, whichever stop followed it.
+        watchpoint = self._take_hit()
+        if watchpoint is not None and reason in (STOP_BREAKPOINT, STOP_MAX_INSTRUCTIONS):
+            reason = STOP_WATCHPOINT
+        elif reason == STOP_BREAKPOINT and pc == until_pc:
+            reason = STOP_UNTIL_PC
+        return RunResult(retired=retired, reason=reason, elapsed=elapsed, pc=pc, watchpoint=watchpoint)
+
+    def _run_checkpointed(self, max_instructions, stops, until_ecall, until_idle) -> tuple:
+        # Run in slices that end on multiples of checkpoint_every.
+        every   = self.checkpoint_every
+        retired = 0
+        while True:
+            if self.csr.retired % every == 0 and self.csr.retired not in self.checkpoints:
+                self.checkpoints[self.csr.retired] = self.snapshot()
+            limit = every - self.csr.retired % every
+            if max_instructions is not None:
+                limit = min(limit, max_instructions - retired)
+            if retired and self.cpu.pc in stops:
+                return retired, STOP_BREAKPOINT
+            count, reason = self.cpu.run(
+                self.mem, self.csr,
+                max_instructions=limit,
+                breakpoints=stops,
+                until_ecall=until_ecall,
+                until_idle=until_idle
+            )
+            retired += count
+            if reason != STOP_MAX_INSTRUCTIONS or retired == max_instructions or self._watch_hit():
+                return retired, reason
+
+    def snapshot(self) -> Snapshot:
+        """Capture pc, registers, CSRs and memory, only pages written since the last snapshot are copied."""
+        return Snapshot(
+            retired=self.csr.retired,
+            pc=int(self.cpu.pc),
+            registers=self.cpu.get_registers(),
+            csr=self.csr.snapshot(),
+            memory=self.mem.snapshot(),
+            paged=self.paged
+        )
+
+    def restore(self, snapshot) -> None:
+        """Return to a snapshot. The register-write log is not rewound."""
+        if snapshot.paged != self.paged:
+            raise ValueError("Snapshot and model memory backends differ")
+        self.mem.restore(snapshot.memory)
+        self.csr.restore(snapshot.csr)
+        self.cpu.set_registers(snapshot.registers)
+        self.cpu.pc = snapshot.pc
+
+    def seek(self, retired) -> RunResult:
+        """Restore the closest checkpoint before instruction retired and replay up to it."""
+        start = max((n for n in self.checkpoints if n <= retired), default=None)
+        if start is None:
+            raise ValueError("No checkpoint at or before instruction {}".format(retired))
+        self.restore(self.checkpoints[start])
+        return self.run(max_instructions=retired - start, until_ecall=False, until_idle=False)
+
+    def save_checkpoints(self, path) -> None:
+        save_snapshots(path, [self.checkpoints[n] for n in sorted(self.checkpoints)])
+
+    def load_checkpoints(self, path) -> None:
+        for snapshot in load_snapshots(path):
+            self.checkpoints[snapshot.retired] = snapshot
+
+    def cache_report(self, top=10) -> str:
+        if self.cached is None:
+            return ""
+        return self.cached.report(top)
+
+    def profile_report(self, ref=None, top=20) -> str:
+        if self.profiler is None:
+            return ""
+        return self.profiler.report(self.backing, ref=ref, top=top)
 
     def close(self) -> None:
         self.cpu.close()
@@ -0,0 +1,261 @@
+import csv
+from array import array
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+
+from rktcpu.compare import hex_to_uint32, DEFAULT_CHUNK
+from rktcpu.model import RktCpuModel
+from rktcpu.profiler import read_ref
+from rktcpu.riscv.rv32i import BRANCH_OPCODE, LOAD_OPCODE, STORE_OPCODE, ALU_OPCODE, ALU_IMMED_OPCODE, \
+    JUMP_OPCODE, JUMP_REG_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE, FENCE_OPCODE, ECALL_OPCODE
+
+# The cycle counter of RegisterWriteLogger.vhd is a natural range 0 to 2**16 - 1.
+CYCLE_MODULUS = 1 << 16
+
+# Retirements of the HDL log (valid = '1' rows) and of the golden model.
+HDL_RETIRE_DTYPE    = np.dtype([("row", "<u8"), ("cycle", "<i8"), ("pc", "<u4")])
+GOLDEN_RETIRE_DTYPE = np.dtype([("pc", "<u4"), ("instr", "<u4"), ("next", "<u4")])
+
+# Causes of the idle cycles before a retirement, checked in this order
+# against the previous one or two instructions.
+STALL_CAUSES = ("jump", "branch_taken", "load_use", "raw_1", "raw_2", "branch_not_taken", "memory", "other")
+
+INSTRUCTION_CLASSES = {
+    ALU_OPCODE        : "alu",
+    ALU_IMMED_OPCODE  : "alu_immed",
+    LOAD_OPCODE       : "load",
+    STORE_OPCODE      : "store",
+    BRANCH_OPCODE     : "branch",
+    JUMP_OPCODE       : "jal",
+    JUMP_REG_OPCODE   : "jalr",
+    LOAD_UPPER_OPCODE : "lui",
+    AUIPC_OPCODE      : "auipc",
+    FENCE_OPCODE      : "fence",
+    ECALL_OPCODE      : "system",
+}
+
+ANALYSIS_SETTINGS = {
+    "enablelogging" : False,
+    "logpath"       : None,
+    "startingaddr"  : 0,
+    "engine"        : "int",
+    "memory"        : "paged"
+}
+
+@dataclass
+class PipelineReport:
+    name          : str
+    retired       : int = 0
+    # Cycles from the first logged cycle to the last aligned retirement.
+    cycles        : int = 0
+    # Cycles before the first retirement.
+    startup       : int = 0
+    # Index of the first retirement whose pc differs from the model, or None.
+    diverged      : int = None
+    # cause -> [occurrences, stalled occurrences, stall cycles]
+    causes        : dict = field(default_factory=dict)
+    # instruction class -> [retired, stall cycles before the next retirement]
+    classes       : dict = field(default_factory=dict)
+    # (pc, retired, stall cycles, main cause) rows, most stall cycles first.
+    pcs           : list = field(default_factory=list)
+
+    @property
+    def stall_cycles(self) -> int:
+        return sum(entry[2] for entry in self.causes.values())
+
+    @property
+    def cpi(self) -> float:
+        return self.cycles / self.retired if self.retired else 0.0
+
+    @property
+    def ipc(self) -> float:
+        return self.retired / self.cycles if self.cycles else 0.0
+
+    @property
+    def steady_cpi(self) -> float:
+        """CPI without the startup cycles, 1.0 for a pipeline that never stalls."""
+        return (self.cycles - self.startup) / self.retired if self.retired else 0.0
+
+def read_hdl_retirements(path, chunk=DEFAULT_CHUNK) -> tuple:
+    """Return (first logged cycle, HDL_RETIRE_DTYPE array) of the valid rows of a RegisterWriteLogger CSV."""
+    parts = []
+    first = None
+    reader = pd.read_csv(path, usecols=["cycle", "pc", "valid"], dtype=str, chunksize=chunk)
+    for frame in reader:
+        cycles = frame["cycle"].to_numpy(dtype=np.int64)
+        if first is None and len(cycles):
+            first = int(cycles[0])
+        # Unwrap the 16-bit counter before dropping the invalid rows.
+        parts.append((frame.index.to_numpy(), cycles, frame["valid"].to_numpy() == "'1'", frame["pc"]))
+    if not parts:
+        return 0, np.empty(0, dtype=HDL_RETIRE_DTYPE)
+    rows   = np.concatenate([part[0] for part in parts])
+    cycles = np.concatenate([part[1] for part in parts])
+    valid  = np.concatenate([part[2] for part in parts])
+    wraps  = np.concatenate(([0], np.cumsum(np.diff(cycles) < 0)))
+    cycles = cycles + wraps * CYCLE_MODULUS
+    out = np.empty(int(valid.sum()), dtype=HDL_RETIRE_DTYPE)
+    out["row"]   = rows[valid]
+    out["cycle"] = cycles[valid]
+    out["pc"]    = np.concatenate([hex_to_uint32(part[3][part[2]])[0] for part in parts])
+    return first, out
+
+def golden_retirements(hexpath, count, settings=None) -> np.ndarray:
+    """Step the model count times and return the GOLDEN_RETIRE_DTYPE stream."""
+    model = RktCpuModel(dict(ANALYSIS_SETTINGS, **(settings or {}), hexpath=hexpath))
+    pcs, instrs, nexts = array("I"), array("I"), array("I")
+    try:
+        for _ in range(count):
+            pc = int(model.cpu.pc)
+            pcs.append(pc)
+            instrs.append(int(model.mem.read(pc)))
+            model.step()
+            nexts.append(int(model.cpu.pc) & 0xFFFFFFFF)
+    finally:
+        model.close()
+    out = np.empty(len(pcs), dtype=GOLDEN_RETIRE_DTYPE)
+    out["pc"], out["instr"], out["next"] = pcs, instrs, nexts
+    return out
+
+def _decode(instr) -> tuple:
+    # Register fields and which of them an instruction actually uses.
+    opcode = instr & 0x7F
+    funct3 = (instr >> 12) & 0x7
+    rd, rs1, rs2 = (instr >> 7) & 0x1F, (instr >> 15) & 0x1F, (instr >> 20) & 0x1F
+    csr = (opcode == ECALL_OPCODE) & (funct3 != 0)
+    reads_rs1 = np.isin(opcode, [ALU_OPCODE, ALU_IMMED_OPCODE, LOAD_OPCODE, STORE_OPCODE, BRANCH_OPCODE,
+                                 JUMP_REG_OPCODE]) | (csr & (funct3 < 4))
+    reads_rs2 = np.isin(opcode, [ALU_OPCODE, STORE_OPCODE, BRANCH_OPCODE])
+    writes = (np.isin(opcode, [ALU_OPCODE, ALU_IMMED_OPCODE, LOAD_OPCODE, JUMP_OPCODE, JUMP_REG_OPCODE,
+                               LOAD_UPPER_OPCODE, AUIPC_OPCODE]) | csr) & (rd != 0)
+    return opcode, rd, np.where(reads_rs1, rs1, -1), np.where(reads_rs2, rs2, -1), writes
+
+def _depends(rs1, rs2, rd, writes, distance) -> np.ndarray:
+    # Whether instruction i reads the register written by instruction i - distance.
+    out = np.zeros(len(rs1), dtype=bool)
+    producer = np.where(writes[:-distance], rd[:-distance], -2)
+    out[distance:] = (rs1[distance:] == producer) | (rs2[distance:] == producer)
+    return out
+
+def classify(golden) -> np.ndarray:
+    """Index into STALL_CAUSES of the likely cause of a stall before each retirement."""
+    opcode, rd, rs1, rs2, writes = _decode(golden["instr"].astype(np.int64))
+    prev = np.concatenate(([-1], opcode[:-1]))
+    taken = np.zeros(len(golden), dtype=bool)
+    taken[1:] = golden["next"][:-1] != (golden["pc"][:-1].astype(np.int64) + 4) & 0xFFFFFFFF
+    raw_1 = _depends(rs1, rs2, rd, writes, 1)
+    raw_2 = _depends(rs1, rs2, rd, writes, 2) if len(golden) > 2 else np.zeros(len(golden), dtype=bool)
+    conditions = [
+        np.isin(prev, [JUMP_OPCODE, JUMP_REG_OPCODE]),
+        (prev == BRANCH_OPCODE) & taken,
+        (prev == LOAD_OPCODE) & raw_1,
+        raw_1,
+        raw_2,
+        prev == BRANCH_OPCODE,
+        np.isin(prev, [LOAD_OPCODE, STORE_OPCODE]),
+    ]
+    return np.select(conditions, range(len(conditions)), default=len(conditions)).astype(np.int64)
+
+def analyze(hdl_path, hexpath, name=None, settings=None, top=20) -> PipelineReport:
+    """Align the HDL retirements with the model and attribute the idle cycles between them."""
+    first, hdl = read_hdl_retirements(hdl_path)
+    report = PipelineReport(name=name or hexpath)
+    if not len(hdl):
+        return report
+    golden = golden_retirements(hexpath, len(hdl), settings)
+    count = min(len(hdl), len(golden))
+    mismatch = np.flatnonzero(hdl["pc"][:count] != golden["pc"][:count])
+    if len(mismatch):
+        report.diverged = int(mismatch[0])
+        count = report.diverged
+    hdl, golden = hdl[:count], golden[:count]
+    if not count:
+        return report
+
+    cycles = hdl["cycle"]
+    gaps = np.zeros(count, dtype=np.int64)
+    gaps[1:] = np.diff(cycles) - 1
+    cause = classify(golden)
+    report.retired = count
+    report.startup = int(cycles[0] - first)
+    report.cycles  = int(cycles[-1] - first + 1)
+
+    ncauses = len(STALL_CAUSES)
+    occurrences = np.bincount(cause[1:], minlength=ncauses)
+    stalled     = np.bincount(cause[1:], weights=gaps[1:] > 0, minlength=ncauses)
+    stall       = np.bincount(cause[1:], weights=gaps[1:], minlength=ncauses)
+    report.causes = {name: [int(o), int(s), int(c)] for name, o, s, c in zip(STALL_CAUSES, occurrences, stalled, stall)}
+
+    opcode = (golden["instr"] & 0x7F).astype(np.int64)
+    for op, label in INSTRUCTION_CLASSES.items():
+        select = opcode == op
+        if select.any():
+            report.classes[label] = [int(select.sum()), int(gaps[1:][select[:-1]].sum())]
+
+    # Join the per-retirement stalls on pc, the main cause is the one with
+    # the most cycles at that pc.
+    pcs, inverse = np.unique(golden["pc"], return_inverse=True)
+    retired   = np.bincount(inverse, minlength=len(pcs))
+    pc_stall  = np.bincount(inverse, weights=gaps, minlength=len(pcs))
+    per_cause = np.bincount(inverse * ncauses + cause, weights=gaps,
+                            minlength=len(pcs) * ncauses).reshape(len(pcs), ncauses)
+    order = np.argsort(pc_stall, kind="stable")[::-1][:top]
+    report.pcs = [(int(pcs[i]), int(retired[i]), int(pc_stall[i]), STALL_CAUSES[int(per_cause[i].argmax())])
+                  for i in order if pc_stall[i] > 0]
+    return report
+
+def format_pipeline_report(report, ref=None) -> str:
+    ref = read_ref(ref) if isinstance(ref, str) else (ref or dict())
+    lines = [
+        "{}: {} retired in {} cycles, CPI {:.3f} (IPC {:.3f}), steady-state CPI {:.3f}".format(
+            report.name, report.retired, report.cycles, report.cpi, report.ipc, report.steady_cpi),
+        "  startup {} cycles, {} stall cycles".format(report.startup, report.stall_cycles),
+    ]
+    if report.diverged is not None:
+        lines.append("  HDL and model pcs diverge at retirement {}, analysis stops there".format(report.diverged))
+    lines.append("  {:<18} {:>10} {:>10} {:>12} {:>8}".format("cause", "count", "stalled", "cycles", "avg"))
+    for name, (count, stalled, cycles) in report.causes.items():
+        if count:
+            lines.append("  {:<18} {:>10} {:>10} {:>12} {:>8.3f}".format(name, count, stalled, cycles, cycles / count))
+    lines.append("  {:<18} {:>10} {:>12}".format("class", "retired", "cycles after"))
+    for name, (count, cycles) in sorted(report.classes.items(), key=lambda item: item[1][1], reverse=True):
+        lines.append("  {:<18} {:>10} {:>12}".format(name, count, cycles))
+    if report.pcs:
+        lines.append("  stalls by pc:")
+        for pc, retired, cycles, cause in report.pcs:
+            basic, line, source = ref.get(pc, ("", "", ""))
+            lines.append("    0x{:08X} {:>8} retired {:>8} cycles {:<16} {:<24} {}".format(
+                pc, retired, cycles, cause, basic, source).rstrip())
+    return "\n".join(lines)
+
+SUMMARY_COLUMNS = ["test", "retired", "cycles", "cpi", "steady_cpi", "startup", "stall_cycles"] + \
+                  ["{}_cycles".format(cause) for cause in STALL_CAUSES]
+
+def summary_row(report) -> dict:
+    row = {"test": report.name, "retired": report.retired, "cycles": report.cycles,
+           "cpi": round(report.cpi, 6), "steady_cpi": round(report.steady_cpi, 6),
+           "startup": report.startup, "stall_cycles": report.stall_cycles}
+    for cause in STALL_CAUSES:
+        row["{}_cycles".format(cause)] = report.causes.get(cause, [0, 0, 0])[2]
+    return row
+
+def write_summary(path, reports) -> None:
+    """Write one SUMMARY_COLUMNS row per test, to keep as a CPI baseline."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=SUMMARY_COLUMNS)
+        writer.writeheader()
+        writer.writerows(summary_row(report) for report in reports)
+
+def compare_summary(baseline_path, reports, tolerance=0.0) -> list:
+    """Return (test, baseline CPI, CPI) for every test whose CPI grew by more than tolerance (relative)."""
+    with open(baseline_path, newline="") as f:
+        baseline = {row["test"]: float(row["cpi"]) for row in csv.DictReader(f)}
+    regressions = []
+    for report in reports:
+        old = baseline.get(report.name)
+        # The summary keeps six decimals.
+        if old is not None and round(report.cpi, 6) > old * (1 + tolerance):
+            regressions.append((report.name, old, report.cpi))
+    return regressions
@@ -0,0 +1,183 @@
+import numpy as np
+
+from rktcpu.riscv.memory import IMEM_REGION
+from rktcpu.riscv.rv32i import predecode, BRANCH_OPCODE, JUMP_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE
+
+# Columns of a flat profile, one row per executed pc.
+PROFILE_DTYPE = np.dtype([("pc", "<u4"), ("count", "<u8"), ("taken", "<u8"), ("instr", "<u4")])
+
+class Profiler():
+    """Per-pc execution counts kept in preallocated arrays indexed by pc >> 2.
+
+    attach() wraps every handler of the engine's opcode table, so nothing
+    is added to the engine when profiling is off. Besides the execution
+    count, each pc counts how often the next pc was not pc + 4, which is
+    the taken count of branches. The arrays cover region, pcs outside it
+    are counted in the outside dict. The opcode mix is derived from the
+    counts when reported, so self-modifying code is attributed to the final
+    contents of memory.
+    """
+    def __init__(self, region=IMEM_REGION) -> None:
+        self.base    = region[0]
+        self.counts  = np.zeros((region[1] - region[0] + 1) >> 2, dtype=np.int64)
+        self.taken   = np.zeros((region[1] - region[0] + 1) >> 2, dtype=np.int64)
+        # {pc: [count, taken]} for pcs outside the arrays.
+        self.outside = dict()
+        self._saved  = None
+
+    def _wrap(self, cpu, handler):
+        counts  = self.counts
+        taken   = self.taken
+        outside = self.outside
+        base    = self.base
+        size    = len(counts)
+        def profiled(decoded, mem, csr):
+            pc = cpu.pc
+            nextpc = handler(decoded, mem, csr)
+            index = (int(pc) - base) >> 2
+            if 0 <= index < size:
+                counts[index] += 1
+                if nextpc != pc + 4:
+                    taken[index] += 1
+            else:
+                row = outside.setdefault(int(pc), [0, 0])
+                row[0] += 1
+                if nextpc != pc + 4:
+                    row[1] += 1
+            return nextpc
+        return profiled
+
+    def attach(self, cpu) -> None:
+        if self._saved is not None:
+            raise ValueError("Profiler is already attached")
+        self._saved = (cpu, list(cpu.opcodes))
+        cpu.opcodes[:] = [self._wrap(cpu, handler) for handler in cpu.opcodes]
+        # Translated blocks bypass the opcode table.
+        if hasattr(cpu, "flush_blocks"):
+            cpu.flush_blocks()
+
+    def detach(self) -> None:
+        cpu, opcodes = self._saved
+        cpu.opcodes[:] = opcodes
+        self._saved = None
+
+    def reset(self) -> None:
+        self.counts[:] = 0
+        self.taken[:]  = 0
+        self.outside.clear()
+
+    @property
+    def retired(self) -> int:
+        return int(self.counts.sum()) + sum(count for count, _ in self.outside.values())
+
+    def _range_count(self, start, end) -> int:
+        # Instructions executed from start to end inclusive.
+        lo = max(start - self.base, 0) >> 2
+        hi = max(end - self.base + 4, 0) >> 2
+        count = int(self.counts[lo:hi].sum())
+        return count + sum(row[0] for pc, row in self.outside.items() if start <= pc <= end)
+
+    def flat_profile(self, mem) -> np.ndarray:
+        """Return a PROFILE_DTYPE row for every executed pc, sorted by pc."""
+        index = np.flatnonzero(self.counts)
+        outside = sorted(self.outside.items())
+        out = np.empty(len(index) + len(outside), dtype=PROFILE_DTYPE)
+        out["pc"][:len(index)]    = self.base + (index << 2)
+        out["count"][:len(index)] = self.counts[index]
+        out["taken"][:len(index)] = self.taken[index]
+        out["pc"][len(index):]    = [pc for pc, _ in outside]
+        out["count"][len(index):] = [count for _, (count, _) in outside]
+        out["taken"][len(index):] = [taken for _, (_, taken) in outside]
+        out = out[np.argsort(out["pc"], kind="stable")]
+        out["instr"] = [mem.read(int(pc)) for pc in out["pc"]]
+        return out
+
+    def hot_spots(self, mem, top=20) -> np.ndarray:
+        profile = self.flat_profile(mem)
+        return profile[np.argsort(profile["count"], kind="stable")[::-1][:top]]
+
+    def opcode_mix(self, mem) -> dict:
+        """Return {(opcode, funct3): executed count}, funct3 is None for U/J types."""
+        mix = dict()
+        for row in self.flat_profile(mem):
+            decoded = predecode(int(row["instr"]))
+            funct3 = None if decoded.opcode in (JUMP_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE) else decoded.funct3
+            key = (decoded.opcode, funct3)
+            mix[key] = mix.get(key, 0) + int(row["count"])
+        return mix
+
+    def branches(self, mem) -> np.ndarray:
+        """Return (pc, taken, not taken) rows for every executed conditional branch."""
+        profile = self.flat_profile(mem)
+        profile = profile[(profile["instr"] & 0x7F) == BRANCH_OPCODE]
+        out = np.empty(len(profile), dtype=[("pc", "<u4"), ("taken", "<u8"), ("not_taken", "<u8")])
+        out["pc"]        = profile["pc"]
+        out["taken"]     = profile["taken"]
+        out["not_taken"] = profile["count"] - profile["taken"]
+        return out
+
+    def hot_loops(self, mem, top=10) -> list:
+        """Return (start, end, iterations, instructions) for taken backward branches and jumps.
+
+        A loop runs from the branch target to the branch, instructions is the
+        total executed in that range.
+        """
+        loops = []
+        for row in self.flat_profile(mem):
+            decoded = predecode(int(row["instr"]))
+            if decoded.opcode not in (BRANCH_OPCODE, JUMP_OPCODE) or not row["taken"] or decoded.imm >= 0:
+                continue
+            end   = int(row["pc"])
+            start = (end + decoded.imm) & 0xFFFFFFFF
+            instructions = self._range_count(start, end)
+            loops.append((start, end, int(row["taken"]), instructions))
+        loops.sort(key=lambda loop: loop[3], reverse=True)
+        return loops[:top]
+
+    def report(self, mem, ref=None, top=20) -> str:
+        """Format hot spots, hot loops and the opcode mix, with source lines from a .ref listing."""
+        ref = read_ref(ref) if isinstance(ref, str) else (ref or dict())
+        total = max(self.retired, 1)
+        lines = ["{} instructions retired".format(self.retired), "", "hot spots:"]
+        for row in self.hot_spots(mem, top):
+            pc = int(row["pc"])
+            basic, line, source = ref.get(pc, ("", "", ""))
+            lines.append("  0x{:08X} {:>12} {:>7.2%} {:>10} taken  {:<28} {:>5} {}".format(
+                pc, int(row["count"]), row["count"] / total, int(row["taken"]), basic, line, source).rstrip())
+        lines += ["", "hot loops:"]
+        for start, end, iterations, instructions in self.hot_loops(mem, top):
+            lines.append("  0x{:08X}-0x{:08X} {:>12} iterations {:>12} instructions {:>7.2%}".format(
+                start, end, iterations, instructions, instructions / total))
+        lines += ["", "opcode mix:"]
+        mix = sorted(self.opcode_mix(mem).items(), key=lambda item: item[1], reverse=True)
+        for (opcode, funct3), count in mix:
+            lines.append("  opcode 0b{:07b} funct3 {:>4} {:>12} {:>7.2%}".format(
+                opcode, "-" if funct3 is None else funct3, count, count / total))
+        return "\n".join(lines)
+
+def read_ref(path) -> dict:
+    """Read a .ref listing (Address, Code, Basic, Line, Source) into {pc: (basic, line, source)}."""
+    ref = dict()
+    with open(path, "r") as f:
+        header = f.readline()
+        columns = [header.index(name) for name in ("Basic", "Line", "Source")]
+        for text in f:
+            if not text.startswith("0x"):
+                continue
+            text = text.rstrip("\n")
+            basic  = text[columns[0]:columns[1]].strip()
+            line   = text[columns[1]:columns[2]].strip()
+            source = text[columns[2]:].strip()
+            ref[int(text.split()[0], 16)] = (basic, line, source)
+    return ref
+
+def write_flat_profile(path, profile, ref=None) -> None:
+    """Write a flat profile as CSV, joined with a .ref listing when given."""
+    ref = read_ref(ref) if isinstance(ref, str) else (ref or dict())
+    total = max(int(profile["count"].sum()), 1)
+    with open(path, "w") as f:
+        f.write("pc,count,percent,taken,instr,basic,line,source\n")
+        for pc, count, taken, instr in profile.tolist():
+            basic, line, source = ref.get(pc, ("", "", ""))
+            f.write('0x{:08X},{},{:.4f},{},0x{:08X},"{}",{},"{}"\n'.format(
+                pc, count, 100 * count / total, taken, instr, basic, line, source.replace('"', '""')))
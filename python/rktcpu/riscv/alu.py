@@ -0,0 +1,117 @@
+import numpy as np
+
+from rktcpu.vectors import write_columns
+
+# funct7 of SUB and SRA/SRAI.
+ALT_FUNCT7 = 0b0100000
+
+def _signed(values):
+    return values.view(np.int32)
+
+def _high(product):
+    # Upper word of a 64-bit product held in an int64 or uint64.
+    return (product >> 32).astype(np.uint32)
+
+# Reference operations on uint32 arrays, or on np.uint32 scalars for the
+# scalar engine. Shift amounts use the low five bits of the second operand
+# as BarrelShift.vhd does.
+ALU_OPS = {
+    "add"    : lambda a, b: np.add(a, b),
+    "sub"    : lambda a, b: np.subtract(a, b),
+    "sll"    : lambda a, b: np.left_shift(a, b & np.uint32(31)),
+    "slt"    : lambda a, b: np.less(_signed(a), _signed(b)).astype(np.uint32),
+    "sltu"   : lambda a, b: np.less(a, b).astype(np.uint32),
+    "xor"    : lambda a, b: np.bitwise_xor(a, b),
+    "srl"    : lambda a, b: np.right_shift(a, b & np.uint32(31)),
+    "sra"    : lambda a, b: np.right_shift(_signed(a), (b & np.uint32(31)).astype(np.int32)).astype(np.uint32),
+    "or"     : lambda a, b: np.bitwise_or(a, b),
+    "and"    : lambda a, b: np.bitwise_and(a, b),
+    # MultiplierUnit.vhd, the low word is the same for every signedness.
+    "mul"    : lambda a, b: np.multiply(a, b),
+    "mulh"   : lambda a, b: _high(_signed(a).astype(np.int64) * _signed(b).astype(np.int64)),
+    "mulhsu" : lambda a, b: _high(_signed(a).astype(np.int64) * b.astype(np.int64)),
+    "mulhu"  : lambda a, b: _high(a.astype(np.uint64) * b.astype(np.uint64)),
+}
+
+ALU_OP_NAMES = tuple(ALU_OPS)
+
+# Operations of funct3, funct7 only selects SUB and SRA.
+BASE_OP_NAMES = ("add", "sll", "slt", "sltu", "xor", "srl", "or", "and")
+MUL_OP_NAMES  = ("mul", "mulh", "mulhsu", "mulhu")
+
+# alu_controls_t of AluCore.vhd as (addn, res_sel, funct3, sright, sarith, slt, sltuns).
+ALU_CONTROLS = {
+    "add"  : (0, 0b1000, 0b000, 0, 0, 0, 0),
+    "sub"  : (1, 0b1000, 0b000, 0, 0, 0, 0),
+    "sll"  : (0, 0b0010, 0b001, 0, 0, 0, 0),
+    "slt"  : (0, 0b0001, 0b010, 0, 0, 1, 0),
+    "sltu" : (0, 0b0001, 0b011, 0, 0, 1, 1),
+    "xor"  : (0, 0b0100, 0b100, 0, 0, 0, 0),
+    "srl"  : (0, 0b0010, 0b101, 1, 0, 0, 0),
+    "sra"  : (0, 0b0010, 0b101, 1, 1, 0, 0),
+    "or"   : (0, 0b0100, 0b110, 0, 0, 0, 0),
+    "and"  : (0, 0b0100, 0b111, 0, 0, 0, 0),
+}
+
+# Operands that exercise carries, the sign bit and shift amounts past 31.
+CORNER_OPERANDS = (0x00000000, 0x00000001, 0x00000002, 0x0000001F, 0x00000020, 0x00000021,
+                   0x7FFFFFFE, 0x7FFFFFFF, 0x80000000, 0x80000001, 0xFFFFFFFE, 0xFFFFFFFF)
+
+def alu_op(funct3, funct7=None) -> str:
+    """Name of the RV32I operation of funct3, funct7 is None for the register-immediate add."""
+    if funct7 == ALT_FUNCT7 and funct3 == 0:
+        return "sub"
+    if funct7 == ALT_FUNCT7 and funct3 == 5:
+        return "sra"
+    return BASE_OP_NAMES[funct3]
+
+def evaluate(op, a, b) -> np.ndarray:
+    """Apply one named operation to uint32 operand arrays."""
+    return ALU_OPS[op](np.asarray(a, dtype=np.uint32), np.asarray(b, dtype=np.uint32))
+
+def evaluate_mixed(ops, a, b) -> np.ndarray:
+    """Apply ops[i], an index into ALU_OP_NAMES, to a[i] and b[i]."""
+    ops = np.asarray(ops)
+    a   = np.asarray(a, dtype=np.uint32)
+    b   = np.asarray(b, dtype=np.uint32)
+    # Group the vectors by operation with one stable sort of the small indices.
+    order  = np.argsort(ops.astype(np.uint8), kind="stable")
+    counts = np.bincount(ops, minlength=len(ALU_OP_NAMES))
+    a, b   = a[order], b[order]
+    out    = np.empty(len(a), dtype=np.uint32)
+    start  = 0
+    for index, count in enumerate(counts.tolist()):
+        if count:
+            stop = start + count
+            out[order[start:stop]] = ALU_OPS[ALU_OP_NAMES[index]](a[start:stop], b[start:stop])
+            start = stop
+    return out
+
+def alu_suite(count, seed=0, ops=tuple(ALU_CONTROLS)) -> tuple:
+    """(op indices, a, b) with every corner pair for each op followed by count random vectors."""
+    indices = np.array([ALU_OP_NAMES.index(op) for op in ops])
+    corner  = np.array(CORNER_OPERANDS, dtype=np.uint32)
+    ca, cb  = [grid.ravel() for grid in np.meshgrid(corner, corner, indexing="ij")]
+    rng = np.random.default_rng(seed)
+    ra = rng.integers(0, 1 << 32, size=count, dtype=np.uint64).astype(np.uint32)
+    rb = rng.integers(0, 1 << 32, size=count, dtype=np.uint64).astype(np.uint32)
+    rops = rng.choice(indices, size=count)
+    return (np.concatenate((np.repeat(indices, len(ca)), rops)),
+            np.concatenate((np.tile(ca, len(indices)), ra)),
+            np.concatenate((np.tile(cb, len(indices)), rb)))
+
+def write_alu_vectors(path, ops, a, b) -> int:
+    """Write "controls a b res" lines for tb_AluCore.
+
+    controls is alu_controls_t as 12 bits: addn, res_sel, funct3, sright,
+    sarith, slt and sltuns from the most significant bit down.
+    """
+    table = np.zeros(len(ALU_OP_NAMES), dtype=np.uint64)
+    for op, (addn, res_sel, funct3, sright, sarith, slt, sltuns) in ALU_CONTROLS.items():
+        table[ALU_OP_NAMES.index(op)] = (addn << 11) | (res_sel << 7) | (funct3 << 4) | \
+                                        (sright << 3) | (sarith << 2) | (slt << 1) | sltuns
+    ops = np.asarray(ops)
+    if not np.isin(ops, [ALU_OP_NAMES.index(op) for op in ALU_CONTROLS]).all():
+        raise ValueError("AluCore does not implement the multiply operations")
+    res = evaluate_mixed(ops, a, b)
+    return write_columns(path, [(table[ops], 12, 2), (a, 8, 16), (b, 8, 16), (res, 8, 16)])
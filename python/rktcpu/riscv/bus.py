@@ -0,0 +1,390 @@
+import bisect
+import struct
+import sys
+
+from rktcpu.riscv.memory import read_hex, PAGE_SHIFT, PAGE_SIZE, PAGE_MASK
+
+# Memory map of tb_SimpleAllUp through DefaultInterconnect.vhd: the
+# instruction ROM, the ByteAddrBram window selected by
+# data_addr(31 downto 13) = 1 and the GpioRegister word. The console has no
+# RTL counterpart and sits outside the decoded addresses.
+ROM_REGION   = (0x00000000, 0x00001FFF)
+BRAM_REGION  = (0x00002000, 0x00003FFF)
+GPIO_ADDR    = 0x00010000
+CONSOLE_ADDR = 0x00010100
+
+# Snapshot keys of register device states, above every page number.
+DEVICE_STATE = 1 << (32 - PAGE_SHIFT)
+
+_MODE_MASKS = {"b": 0xFF, "h": 0xFFFF, "w": 0xFFFFFFFF, None: 0xFFFFFFFF}
+
+def _check_alignment(offset, mode) -> None:
+    # Same rules as PagedMemory, a halfword may only straddle the middle of a word.
+    if mode == "h" and offset & 3 == 3:
+        raise ValueError
+    if mode in ("w", None) and offset & 3:
+        raise ValueError
+
+def _extract(value, offset, mode) -> int:
+    _check_alignment(offset, mode)
+    return (value >> (8 * (offset & 3))) & _MODE_MASKS[mode]
+
+def _merge(value, offset, data, mode) -> int:
+    _check_alignment(offset, mode)
+    shift = 8 * (offset & 3)
+    mask  = _MODE_MASKS[mode] << shift
+    return ((value & ~mask) | ((int(data) << shift) & mask)) & 0xFFFFFFFF
+
+class Device():
+    """size bytes of bus address space starting at base.
+
+    read() and write() get the offset from base. Storage devices return
+    their bytearray from buffer(), the bus then reads (and writes, unless
+    read-only) the pages they fully cover without calling them. load() and
+    dump() are the bulk hooks used for program images and snapshots, by
+    default they go through write() and read() a byte at a time.
+    """
+    writable = True
+
+    def __init__(self, name, base, size) -> None:
+        if base % 4 or size <= 0:
+            raise ValueError("Device {} must start on a word boundary".format(name))
+        self.name = name
+        self.base = base
+        self.size = size
+        self.end  = base + size
+
+    def buffer(self):
+        return None
+
+    def read(self, offset, mode=None) -> int:
+        raise ValueError
+
+    def write(self, offset, data, mode=None) -> None:
+        raise ValueError
+
+    def load(self, offset, data) -> None:
+        for i, byte in enumerate(bytes(data)):
+            self.write(offset + i, byte, "b")
+
+    def dump(self, offset, length) -> bytes:
+        return bytes(self.read(offset + i, "b") for i in range(length))
+
+    def state(self) -> bytes:
+        return b""
+
+    def set_state(self, data) -> None:
+        pass
+
+class Ram(Device):
+    """Byte addressable storage like ByteAddrBram.vhd."""
+    def __init__(self, name, base, size) -> None:
+        if size % 4:
+            raise ValueError("Device {} must be a whole number of words".format(name))
+        super().__init__(name, base, size)
+        self.data  = bytearray(size)
+        self.bview = memoryview(self.data)
+        self.hview = self.bview.cast("H")
+        self.wview = self.bview.cast("I")
+
+    def buffer(self):
+        return self.data
+
+    def read(self, offset, mode=None) -> int:
+        _check_alignment(offset, mode)
+        if mode == "b":
+            return self.bview[offset]
+        elif mode == "h":
+            if offset & 1:
+                return self.bview[offset] | (self.bview[offset + 1] << 8)
+            return self.hview[offset >> 1]
+        return self.wview[offset >> 2]
+
+    def write(self, offset, data, mode=None) -> None:
+        _check_alignment(offset, mode)
+        data = int(data)
+        if mode == "b":
+            self.bview[offset] = data & 0xFF
+        elif mode == "h":
+            if offset & 1:
+                self.bview[offset]     = data & 0xFF
+                self.bview[offset + 1] = (data >> 8) & 0xFF
+            else:
+                self.hview[offset >> 1] = data & 0xFFFF
+        else:
+            self.wview[offset >> 2] = data & 0xFFFFFFFF
+
+    def load(self, offset, data) -> None:
+        data = memoryview(data).cast("B")
+        if offset + len(data) > self.size:
+            raise ValueError
+        self.data[offset:offset + len(data)] = data
+
+    def dump(self, offset, length) -> bytes:
+        return bytes(self.data[offset:offset + length])
+
+class Rom(Ram):
+    """Read-only storage like BramRom.vhd, only load() changes its contents."""
+    writable = False
+
+    def write(self, offset, data, mode=None) -> None:
+        raise ValueError
+
+class Gpio(Device):
+    """GpioRegister.vhd, one output register that reads back its value.
+
+    Every write calls each of listeners with the new value.
+    """
+    def __init__(self, name="gpio", base=GPIO_ADDR) -> None:
+        super().__init__(name, base, 4)
+        self.value     = 0
+        self.listeners = list()
+
+    def read(self, offset, mode=None) -> int:
+        return _extract(self.value, offset, mode)
+
+    def write(self, offset, data, mode=None) -> None:
+        self.value = _merge(self.value, offset, data, mode)
+        for listener in self.listeners:
+            listener(self.value)
+
+    def state(self) -> bytes:
+        return struct.pack("<I", self.value)
+
+    def set_state(self, data) -> None:
+        self.value, = struct.unpack("<I", data)
+
+class Console(Device):
+    """Character sink, a store to offset 0 emits its low byte.
+
+    The word at offset 4 is a status register that always reads 1 (ready).
+    Output is kept in output and passed to sink(byte) when given.
+    """
+    def __init__(self, name="console", base=CONSOLE_ADDR, sink=None) -> None:
+        super().__init__(name, base, 8)
+        self.output = bytearray()
+        self.sink   = sink
+
+    def read(self, offset, mode=None) -> int:
+        return _extract(1 if offset >> 2 else 0, offset, mode)
+
+    def write(self, offset, data, mode=None) -> None:
+        _check_alignment(offset, mode)
+        if offset == 0:
+            self.output.append(int(data) & 0xFF)
+            if self.sink is not None:
+                self.sink(int(data) & 0xFF)
+
+    def load(self, offset, data) -> None:
+        # A whole string at once, e.g. from a host-side bulk copy.
+        data = bytes(data)
+        if offset == 0:
+            self.output += data
+            if self.sink is not None:
+                for byte in data:
+                    self.sink(byte)
+
+    def text(self) -> str:
+        return self.output.decode("latin-1")
+
+    def state(self) -> bytes:
+        return bytes(self.output)
+
+    def set_state(self, data) -> None:
+        self.output = bytearray(data)
+
+class CallbackDevice(Device):
+    """Registers implemented by read(offset, mode) and write(offset, data, mode) callables."""
+    def __init__(self, name, base, size, read=None, write=None) -> None:
+        super().__init__(name, base, size)
+        self.on_read  = read
+        self.on_write = write
+
+    def read(self, offset, mode=None) -> int:
+        if self.on_read is None:
+            raise ValueError
+        return self.on_read(offset, mode) & _MODE_MASKS[mode]
+
+    def write(self, offset, data, mode=None) -> None:
+        if self.on_write is None:
+            raise ValueError
+        self.on_write(offset, int(data) & _MODE_MASKS[mode], mode)
+
+def default_devices() -> list:
+    return [
+        Rom("rom", ROM_REGION[0], ROM_REGION[1] - ROM_REGION[0] + 1),
+        Ram("bram", BRAM_REGION[0], BRAM_REGION[1] - BRAM_REGION[0] + 1),
+        Gpio(),
+        Console(),
+    ]
+
+class Bus():
+    """Memory made of devices mapped to disjoint address ranges.
+
+    Addresses are decoded through a page table of the pages a single device
+    covers, and a sorted interval index for the rest. Word accesses to
+    pages fully covered by storage devices go straight to a word view of
+    their buffer like PagedMemory, all others call the device. Accesses
+    outside every device raise ValueError. Snapshots use the {pagenum:
+    bytes} form of PagedMemory, so storage devices start on a page boundary.
+    """
+    def __init__(self, instr_path=None, instr_addr=None, devices=None) -> None:
+        if sys.byteorder != "little":
+            raise NotImplementedError("Bus requires a little-endian host")
+        self.devices = list()
+        self.bases   = list()
+        self.pagemap = dict()
+        # Word views of the fully covered storage pages, and of the
+        # writable ones written since the last snapshot, which are the only
+        # pages with a write fast path.
+        self.rpages  = dict()
+        self.wviews  = dict()
+        self.dirty   = dict()
+        self._snapshot = dict()
+        # Predecoded instructions keyed by word address, filled by the cpu model.
+        self.decoded = dict()
+        # Callables notified with the word address of a dropped instruction.
+        self.invalidation_hooks = list()
+        for device in default_devices() if devices is None else devices:
+            self.attach(device)
+        if ((instr_path == None) ^ (instr_addr == None)):
+            raise ValueError
+        elif (instr_path != None):
+            self.load(instr_addr, read_hex(instr_path))
+
+    def attach(self, device) -> None:
+        """Map device, its range must not overlap an attached device."""
+        index = bisect.bisect_right(self.bases, device.base)
+        if (index > 0 and self.devices[index - 1].end > device.base) or \
+           (index < len(self.devices) and self.devices[index].base < device.end):
+            raise ValueError("Device {} overlaps another device".format(device.name))
+        storage = device.buffer()
+        if storage is not None and device.base & PAGE_MASK:
+            raise ValueError("Storage device {} must start on a page boundary".format(device.name))
+        self.devices.insert(index, device)
+        self.bases.insert(index, device.base)
+        first = (device.base + PAGE_MASK) >> PAGE_SHIFT
+        last  = device.end >> PAGE_SHIFT
+        for pagenum in range(first, last):
+            self.pagemap[pagenum] = device
+            if storage is not None:
+                offset = (pagenum << PAGE_SHIFT) - device.base
+                view = memoryview(storage)[offset:offset + PAGE_SIZE].cast("I")
+                self.rpages[pagenum] = view
+                if device.writable:
+                    self.wviews[pagenum] = view
+        if storage is not None:
+            # Captured in full by the next snapshot.
+            for pagenum in range(device.base >> PAGE_SHIFT, (device.end + PAGE_MASK) >> PAGE_SHIFT):
+                self.dirty[pagenum] = self.wviews.get(pagenum)
+
+    def device(self, name) -> Device:
+        for device in self.devices:
+            if device.name == name:
+                return device
+        raise KeyError(name)
+
+    def find(self, addr) -> Device:
+        """Device mapped at addr."""
+        device = self.pagemap.get(addr >> PAGE_SHIFT)
+        if device is None:
+            index = bisect.bisect_right(self.bases, addr) - 1
+            if index < 0 or addr >= self.devices[index].end:
+                raise ValueError
+            device = self.devices[index]
+        return device
+
+    def _invalidate_range(self, start, end) -> None:
+        for addr in [a for a in self.decoded if start <= a < end]:
+            del self.decoded[addr]
+            for hook in self.invalidation_hooks:
+                hook(addr)
+
+    def _mark(self, device, start, end) -> None:
+        if device.buffer() is not None:
+            for pagenum in range(start >> PAGE_SHIFT, ((end - 1) >> PAGE_SHIFT) + 1):
+                self.dirty[pagenum] = self.wviews.get(pagenum)
+
+    def load(self, addr, data) -> None:
+        """Bulk copy bytes (or anything exposing a buffer) through the load() hooks of the devices."""
+        data  = memoryview(data).cast("B")
+        start = addr
+        while len(data):
+            device = self.find(addr)
+            count  = min(device.end - addr, len(data))
+            device.load(addr - device.base, data[:count])
+            self._mark(device, addr, addr + count)
+            data  = data[count:]
+            addr += count
+        self._invalidate_range(start & ~3, addr)
+
+    def dump(self, addr, length) -> bytes:
+        """Return length bytes starting at addr through the dump() hooks of the devices."""
+        out = bytearray()
+        end = addr + length
+        while addr < end:
+            device = self.find(addr)
+            count  = min(device.end, end) - addr
+            out   += device.dump(addr - device.base, count)
+            addr  += count
+        return bytes(out)
+
+    def snapshot(self) -> dict:
+        """Return {pagenum: bytes} for restore(), register device states follow the pages.
+
+        Only storage pages written since the previous snapshot (or restore)
+        are copied, the others are shared with it.
+        """
+        pages = dict(self._snapshot)
+        for pagenum in self.dirty:
+            device = self.find(pagenum << PAGE_SHIFT)
+            offset = (pagenum << PAGE_SHIFT) - device.base
+            pages[pagenum] = bytes(device.buffer()[offset:offset + PAGE_SIZE])
+        self.dirty.clear()
+        for index, device in enumerate(self.devices):
+            if device.buffer() is None:
+                pages[DEVICE_STATE + index] = device.state()
+        self._snapshot = pages
+        return pages
+
+    def restore(self, pages) -> None:
+        for key, data in pages.items():
+            if key >= DEVICE_STATE:
+                self.devices[key - DEVICE_STATE].set_state(data)
+            else:
+                device = self.find(key << PAGE_SHIFT)
+                offset = (key << PAGE_SHIFT) - device.base
+                device.buffer()[offset:offset + len(data)] = data
+        self.dirty.clear()
+        self._snapshot = dict(pages)
+        self._invalidate_range(0, 1 << 32)
+
+    def read(self, addr, mode=None):
+        addr = int(addr)
+        if mode == 'w' or mode is None:
+            page = self.rpages.get(addr >> PAGE_SHIFT)
+            if page is not None and not addr & 3:
+                return page[(addr & PAGE_MASK) >> 2]
+        return self._read_slow(addr, mode)
+
+    def _read_slow(self, addr, mode):
+        device = self.find(addr)
+        return device.read(addr - device.base, mode)
+
+    def write(self, addr, data, mode=None):
+        addr = int(addr)
+        # Drop any predecoded instruction at this word so that it is refetched.
+        if self.decoded and self.decoded.pop(addr & ~3, None) is not None:
+            for hook in self.invalidation_hooks:
+                hook(addr & ~3)
+        if mode == 'w' or mode is None:
+            page = self.dirty.get(addr >> PAGE_SHIFT)
+            if page is not None and not addr & 3:
+                page[(addr & PAGE_MASK) >> 2] = int(data) & 0xFFFFFFFF
+                return
+        self._write_slow(addr, int(data), mode)
+
+    def _write_slow(self, addr, data, mode):
+        device = self.find(addr)
+        device.write(addr - device.base, data, mode)
+        self._mark(device, addr, addr + 1)
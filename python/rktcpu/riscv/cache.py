@@ -0,0 +1,285 @@
+import random
+from array import array
+from dataclasses import dataclass, field
+
+import numpy as np
+
+from rktcpu.riscv.memory import IMEM_REGION, DMEM_REGION
+from rktcpu.riscv.rv32i import predecode
+
+# Accesses buffered before they are run through the cache models.
+DEFAULT_CHUNK = 1 << 16
+
+REPLACEMENT_POLICIES = ("lru", "fifo", "random")
+
+INVALID_TAG = -1
+
+@dataclass
+class CacheStats:
+    hits       : int = 0
+    misses     : int = 0
+    evictions  : int = 0
+    writebacks : int = 0
+    uncached   : int = 0
+    # pc -> [hits, misses]
+    per_pc     : dict = field(default_factory=dict)
+
+    @property
+    def accesses(self) -> int:
+        return self.hits + self.misses
+
+    @property
+    def hit_rate(self) -> float:
+        return self.hits / self.accesses if self.accesses else 0.0
+
+class CacheModel():
+    """Tag-only model of a write-back, write-allocate cache.
+
+    The defaults match Cache.vhd: direct mapped, 4-byte lines, 32 KiB.
+    Accesses are simulated in batches, tags and dirty bits are kept as
+    (sets, ways) NumPy arrays.
+    """
+    def __init__(self, name, region, size=32768, line=4, ways=1, policy="lru", seed=0) -> None:
+        for label, value in (("size", size), ("line", line), ("ways", ways)):
+            if value <= 0 or value & (value - 1):
+                raise ValueError("Cache {} must be a power of two: {}".format(label, value))
+        if size < line * ways:
+            raise ValueError("Cache size {} is smaller than one set".format(size))
+        if policy not in REPLACEMENT_POLICIES:
+            raise ValueError("Unknown replacement policy: {}".format(policy))
+        self.name       = name
+        self.region     = (int(region[0]), int(region[1]))
+        self.size       = size
+        self.line       = line
+        self.ways       = ways
+        self.policy     = policy
+        self.sets       = size // (line * ways)
+        self.line_shift = line.bit_length() - 1
+        self.set_bits   = self.sets.bit_length() - 1
+        self.tags   = np.full((self.sets, ways), INVALID_TAG, dtype=np.int64)
+        self.dirty  = np.zeros((self.sets, ways), dtype=bool)
+        # Last use (lru) or fill time (fifo) of each way.
+        self.stamps = np.zeros((self.sets, ways), dtype=np.int64)
+        self.clock  = 0
+        self.random = random.Random(seed)
+        self.stats  = CacheStats()
+
+    def access(self, addrs, pcs, writes) -> None:
+        """Run a batch of accesses, given as equal length arrays, through the cache."""
+        addrs  = np.asarray(addrs, dtype=np.int64)
+        pcs    = np.asarray(pcs, dtype=np.int64)
+        writes = np.asarray(writes, dtype=bool)
+        lo, hi = self.region
+        cacheable = (addrs >= lo) & (addrs <= hi)
+        self.stats.uncached += int(len(addrs) - cacheable.sum())
+        addrs, pcs, writes = addrs[cacheable], pcs[cacheable], writes[cacheable]
+        if not len(addrs):
+            return
+        lines = addrs >> self.line_shift
+        sets  = lines & (self.sets - 1)
+        tags  = lines >> self.set_bits
+        if self.ways == 1:
+            hits = self._access_direct(sets, tags, writes)
+        else:
+            hits = self._access_associative(sets, tags, writes)
+        self.stats.hits   += int(hits.sum())
+        self.stats.misses += int(len(hits) - hits.sum())
+
+        unique, inverse = np.unique(pcs, return_inverse=True)
+        pc_hits   = np.bincount(inverse, weights=hits, minlength=len(unique))
+        pc_totals = np.bincount(inverse, minlength=len(unique))
+        per_pc = self.stats.per_pc
+        for pc, h, total in zip(unique.tolist(), pc_hits.tolist(), pc_totals.tolist()):
+            counts = per_pc.setdefault(pc, [0, 0])
+            counts[0] += int(h)
+            counts[1] += total - int(h)
+
+    def _access_direct(self, sets, tags, writes) -> np.ndarray:
+        # With one way, an access hits when the previous access to its set
+        # had the same tag. Sorting by set keeps each set's accesses in order.
+        order = np.argsort(sets, kind="stable")
+        s, t, w = sets[order], tags[order], writes[order]
+        n = len(s)
+        first = np.ones(n, dtype=bool)
+        first[1:] = s[1:] != s[:-1]
+        prev = np.empty(n, dtype=np.int64)
+        prev[1:] = t[:-1]
+        prev[first] = self.tags[s[first], 0]
+        hit = prev == t
+
+        # A residency run starts at each miss and at the first access of a
+        # set, which continues the line already held when it hits.
+        starts = np.flatnonzero(~hit | first)
+        run = np.cumsum(~hit | first) - 1
+        run_dirty = np.maximum.reduceat(w.view(np.uint8), starts).astype(bool)
+        carried = hit[starts]
+        run_dirty[carried] |= self.dirty[s[starts[carried]], 0]
+
+        evict = ~hit & (prev != INVALID_TAG)
+        evicted_dirty = np.empty(n, dtype=bool)
+        evicted_dirty[first] = self.dirty[s[first], 0]
+        evicted_dirty[1:][~first[1:]] = run_dirty[run[:-1][~first[1:]]]
+        self.stats.evictions  += int(evict.sum())
+        self.stats.writebacks += int((evict & evicted_dirty).sum())
+
+        last = np.append(first[1:], True)
+        self.tags[s[last], 0]  = t[last]
+        self.dirty[s[last], 0] = run_dirty[run[last]]
+
+        out = np.empty(n, dtype=bool)
+        out[order] = hit
+        return out
+
+    def _access_associative(self, sets, tags, writes) -> np.ndarray:
+        touched = np.unique(sets)
+        rows   = dict(zip(touched.tolist(), self.tags[touched].tolist()))
+        dirty  = dict(zip(touched.tolist(), self.dirty[touched].tolist()))
+        stamps = dict(zip(touched.tolist(), self.stamps[touched].tolist()))
+        lru    = self.policy == "lru"
+        clock  = self.clock
+        hits   = np.zeros(len(sets), dtype=bool)
+        evictions = writebacks = 0
+        for i, (s, t, w) in enumerate(zip(sets.tolist(), tags.tolist(), writes.tolist())):
+            row = rows[s]
+            if t in row:
+                way = row.index(t)
+                hits[i] = True
+                if lru:
+                    stamps[s][way] = clock
+            else:
+                if INVALID_TAG in row:
+                    way = row.index(INVALID_TAG)
+                else:
+                    if self.policy == "random":
+                        way = self.random.randrange(self.ways)
+                    else:
+                        way = stamps[s].index(min(stamps[s]))
+                    evictions += 1
+                    writebacks += dirty[s][way]
+                row[way] = t
+                dirty[s][way] = False
+                stamps[s][way] = clock
+            if w:
+                dirty[s][way] = True
+            clock += 1
+        self.clock = clock
+        self.tags[touched]   = [rows[s] for s in touched.tolist()]
+        self.dirty[touched]  = [dirty[s] for s in touched.tolist()]
+        self.stamps[touched] = [stamps[s] for s in touched.tolist()]
+        self.stats.evictions  += evictions
+        self.stats.writebacks += writebacks
+        return hits
+
+    def report(self, top=10) -> str:
+        stats = self.stats
+        lines = [
+            "{} ({} B, {} B lines, {}-way {}, region 0x{:08X}-0x{:08X})".format(
+                self.name, self.size, self.line, self.ways, self.policy, *self.region),
+            "  accesses   {:>12}  hit rate {:.2%}".format(stats.accesses, stats.hit_rate),
+            "  hits       {:>12}".format(stats.hits),
+            "  misses     {:>12}".format(stats.misses),
+            "  evictions  {:>12}".format(stats.evictions),
+            "  writebacks {:>12}".format(stats.writebacks),
+            "  uncached   {:>12}".format(stats.uncached),
+        ]
+        worst = sorted(stats.per_pc.items(), key=lambda item: item[1][1], reverse=True)[:top]
+        worst = [(pc, counts) for pc, counts in worst if counts[1]]
+        if worst:
+            lines.append("  top misses by pc:")
+            lines += ["    0x{:08X} {:>10} misses {:>10} hits".format(pc, misses, hits)
+                      for pc, (hits, misses) in worst]
+        return "\n".join(lines)
+
+def _drain(buf) -> np.ndarray:
+    # Copy out before clearing, an array cannot be resized while viewed.
+    out = np.frombuffer(buf, dtype=buf.typecode).astype(np.int64)
+    del buf[:]
+    return out
+
+class _FetchTracker(dict):
+    """Predecoded instruction cache that records every lookup as an instruction fetch."""
+    def __init__(self, mem, decoded, fetches) -> None:
+        super().__init__(decoded)
+        self.mem     = mem
+        self.fetches = fetches
+
+    def get(self, pc, default=None):
+        self.fetches.append(pc)
+        decoded = dict.get(self, pc)
+        if decoded is None:
+            # Predecode here so that the engine never reads the instruction
+            # through the data path.
+            decoded = predecode(self.mem.read(pc))
+            self[pc] = decoded
+        return decoded
+
+class CachedMemory():
+    """Memory wrapper feeding instruction fetches and data accesses to cache models.
+
+    Fetches are seen through the predecoded instruction lookups of the
+    numpy and int engines, data accesses through read() and write(). Per-pc
+    data statistics use the pc of the executing instruction. Accesses are
+    buffered and simulated in chunks, call flush() before reading stats.
+    """
+    def __init__(self, mem, cpu, icache=None, dcache=None, chunk=DEFAULT_CHUNK) -> None:
+        self.mem    = mem
+        self.cpu    = cpu
+        self.icache = icache
+        self.dcache = dcache
+        self.chunk  = chunk
+        self.fetches = array("I")
+        self.daddrs  = array("I")
+        self.dpcs    = array("I")
+        self.dwrites = array("B")
+        if icache is not None:
+            mem.decoded = _FetchTracker(mem, mem.decoded, self.fetches)
+        if dcache is None:
+            self.read  = mem.read
+            self.write = mem.write
+
+    def __getattr__(self, name):
+        return getattr(self.mem, name)
+
+    @property
+    def decoded(self):
+        return self.mem.decoded
+
+    def read(self, addr, mode=None):
+        self.daddrs.append(addr)
+        self.dpcs.append(self.cpu.pc)
+        self.dwrites.append(0)
+        if len(self.daddrs) >= self.chunk:
+            self.flush()
+        return self.mem.read(addr, mode)
+
+    def write(self, addr, data, mode=None):
+        self.daddrs.append(addr)
+        self.dpcs.append(self.cpu.pc)
+        self.dwrites.append(1)
+        if len(self.daddrs) >= self.chunk:
+            self.flush()
+        self.mem.write(addr, data, mode)
+
+    def flush(self) -> None:
+        if self.icache is not None and self.fetches:
+            fetches = _drain(self.fetches)
+            self.icache.access(fetches, fetches, np.zeros(len(fetches), dtype=bool))
+        if self.dcache is not None and self.daddrs:
+            self.dcache.access(_drain(self.daddrs), _drain(self.dpcs), _drain(self.dwrites))
+
+    def report(self, top=10) -> str:
+        self.flush()
+        caches = [cache for cache in (self.icache, self.dcache) if cache is not None]
+        return "\n".join(cache.report(top) for cache in caches)
+
+def build_caches(settings) -> tuple:
+    """Create the (icache, dcache) models described by settings["icache"] and settings["dcache"].
+
+    Each entry is a dict of CacheModel arguments, the regions default to
+    those of CacheSystem.vhd.
+    """
+    caches = []
+    for name, region in (("icache", IMEM_REGION), ("dcache", DMEM_REGION)):
+        config = settings.get(name)
+        caches.append(None if config is None else CacheModel(name, **{"region": region, **config}))
+    return tuple(caches)
@@ -1,5 +1,3 @@
-import numpy as np
-
 MSTATUS_ADDR        = 0x300
 MISA_ADDR           = 0x301
 MDELEG_ADDR         = 0x302
@@ -23,9 +21,44 @@ MINSTRET_ADDR       = 0xB02
 MHPMCOUNTER3_ADDR   = 0xB03
 MHPMCOUNTER31_ADDR  = 0xB1F
 MCYCLEH_ADDR        = 0xB80
-MINSTRET_ADDR       = 0xB82
+MINSTRETH_ADDR      = 0xB82
 MHPMCOUNTERH3_ADDR  = 0xB83
 MHPMCOUNTERH31_ADDR = 0xB9F
+CYCLE_ADDR          = 0xC00
+INSTRET_ADDR        = 0xC02
+CYCLEH_ADDR         = 0xC80
+INSTRETH_ADDR       = 0xC82
+
+MASK32 = 0xFFFFFFFF
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+# ZiCsr.vhd resets mtvec to its cTrapBaseAddress generic.
+TRAP_BASE_ADDRESS = 0x00100000
+
+# Zicsr funct3 -> access mode, funct3 bit 2 selects the rs1 field as a
+# zero-extended immediate instead of a register.
+ZICSR_MODES = {
+    1: "w",
+    2: "s",
+    3: "c",
+    5: "w",
+    6: "s",
+    7: "c",
+}
+
+# Counter CSR address -> (counter, high half). The user-level shadows are
+# read-only.
+COUNTER_ADDRS = {
+    MCYCLE_ADDR    : ("mcycle", False),
+    MCYCLEH_ADDR   : ("mcycle", True),
+    MINSTRET_ADDR  : ("minstret", False),
+    MINSTRETH_ADDR : ("minstret", True),
+    CYCLE_ADDR     : ("mcycle", False),
+    CYCLEH_ADDR    : ("mcycle", True),
+    INSTRET_ADDR   : ("minstret", False),
+    INSTRETH_ADDR  : ("minstret", True),
+}
+READ_ONLY_ADDRS = frozenset((CYCLE_ADDR, CYCLEH_ADDR, INSTRET_ADDR, INSTRETH_ADDR))
 
 MCSR_ADDRS = [
             MSTATUS_ADDR,
@@ -51,29 +84,91 @@ MCSR_ADDRS = [
             MHPMCOUNTER3_ADDR,
             MHPMCOUNTER31_ADDR,
             MCYCLEH_ADDR,
-            MINSTRET_ADDR,
+            MINSTRETH_ADDR,
             MHPMCOUNTERH3_ADDR,
             MHPMCOUNTERH31_ADDR
         ]
 
 class CsrRegisters:
+    """Machine CSR file.
+
+    mcycle and minstret are not stepped, they are derived from retired
+    when read. step() bumps retired, while the engine run loops only bring
+    it up to date before a SYSTEM instruction and at the end of the run.
+    The model retires one instruction per cycle, so mcycle
+    equals minstret unless one of them is written.
+    """
     def __init__(self) -> None:
         self.registers = dict()
         for addr in MCSR_ADDRS:
-            self.registers[addr] = np.uint32(0)
+            self.registers[addr] = 0
+        for addr in range(MHPMEVENT3_ADDR, MHPMEVENT31_ADDR + 1):
+            self.registers[addr] = 0
+        for addr in range(MHPMCOUNTER3_ADDR, MHPMCOUNTER31_ADDR + 1):
+            self.registers[addr] = 0
+            self.registers[addr | 0x080] = 0
+        self.registers[MTVEC_ADDR] = TRAP_BASE_ADDRESS
+        self.retired = 0
+        # Each counter reads as retired + offset, writes only move the offset.
+        self.offsets = {"mcycle": 0, "minstret": 0}
+
+    def snapshot(self) -> tuple:
+        return (dict(self.registers), self.retired, dict(self.offsets))
+
+    def restore(self, state) -> None:
+        registers, self.retired, offsets = state
+        self.registers = dict(registers)
+        self.offsets   = dict(offsets)
+
+    def counter(self, name) -> int:
+        return (self.retired + self.offsets[name]) & MASK64
+
+    def read(self, addr) -> int:
+        if addr in COUNTER_ADDRS:
+            name, high = COUNTER_ADDRS[addr]
+            value = self.counter(name)
+            return value >> 32 if high else value & MASK32
+        # Unimplemented CSRs read as zero.
+        return self.registers.get(addr, 0)
+
+    def write(self, addr, data) -> None:
+        data = int(data) & MASK32
+        if addr in COUNTER_ADDRS:
+            if addr in READ_ONLY_ADDRS:
+                return
+            name, high = COUNTER_ADDRS[addr]
+            value = self.counter(name)
+            if high:
+                value = (data << 32) | (value & MASK32)
+            else:
+                value = (value & ~MASK32) | data
+            # The write takes precedence over the increment of the
+            # instruction doing it.
+            self.offsets[name] = value - self.retired - 1
+        elif addr in self.registers:
+            self.registers[addr] = data
+
+    def access(self, addr, data=None, mode=None) -> int:
+        """Atomically read addr and, if data is given, write, set ('s') or clear ('c') it.
 
-    def access(self, addr, data=None, mode=None):
-        register = self.registers[addr]
-        ret = int(register)
-        if mode == 's':
-            if data is not None:
-                register = np.bitwise_or(register, data)
-        elif mode == 'c':
-            if data is not None:
-                register = np.bitwise_and(register, data)
-        else:
-            register = data
+        Returns the value read before the write.
+        """
+        ret = self.read(addr)
+        if data is not None:
+            if mode == 's':
+                self.write(addr, ret | data)
+            elif mode == 'c':
+                self.write(addr, ret & ~data)
+            else:
+                self.write(addr, data)
         return ret
 
-    def step(self):
-        pass
\ No newline at end of file
+    def zicsr(self, decoded, opA) -> int:
+        """Execute a predecoded csrrw/s/c or csrrwi/si/ci with rs1 value opA, return the old value."""
+        mode = ZICSR_MODES[decoded.funct3]
+        if decoded.funct3 & 4:
+            opA = decoded.rs1
+        # csrrs/csrrc with x0 (or a zero immediate) never write.
+        if mode != "w" and decoded.rs1 == 0:
+            return self.access(decoded.imm)
+        return self.access(decoded.imm, opA, mode)
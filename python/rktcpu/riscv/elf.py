@@ -0,0 +1,99 @@
+import mmap
+import struct
+from dataclasses import dataclass
+
+ELF_MAGIC   = b"\x7fELF"
+ELFCLASS32  = 1
+ELFDATA2LSB = 1
+ET_EXEC     = 2
+EM_RISCV    = 243
+
+PT_LOAD     = 1
+PF_X        = 1
+SHT_SYMTAB  = 2
+
+ELF32_HEADER   = struct.Struct("<16sHHIIIIIHHHHHH")
+ELF32_PHDR     = struct.Struct("<IIIIIIII")
+ELF32_SHDR     = struct.Struct("<IIIIIIIIII")
+ELF32_SYM      = struct.Struct("<IIIBBH")
+
+@dataclass
+class Segment:
+    vaddr : int
+    data  : memoryview
+    memsz : int
+    flags : int
+
+class ElfImage():
+    """Little-endian ELF32 RISC-V executable mapped straight from disk.
+
+    Segment data are memoryviews into an mmap of the file, so loading an
+    image is one bulk copy per segment into the model memory.
+    """
+    def __init__(self, path) -> None:
+        with open(path, "rb") as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        (ident, etype, machine, _, entry, phoff, shoff, _, _,
+         phentsize, phnum, shentsize, shnum, _) = ELF32_HEADER.unpack_from(self._view, 0)
+        if ident[:4] != ELF_MAGIC:
+            raise ValueError("{} is not an ELF file".format(path))
+        if ident[4] != ELFCLASS32 or ident[5] != ELFDATA2LSB:
+            raise ValueError("{} is not a little-endian ELF32 file".format(path))
+        if machine != EM_RISCV:
+            raise ValueError("{} is not a RISC-V ELF file".format(path))
+        if etype != ET_EXEC:
+            raise ValueError("{} is not a linked executable".format(path))
+
+        self.entry    = entry
+        self.segments = list()
+        for i in range(phnum):
+            ptype, offset, vaddr, _, filesz, memsz, flags, _ = \
+                ELF32_PHDR.unpack_from(self._view, phoff + i * phentsize)
+            if ptype == PT_LOAD:
+                self.segments.append(Segment(
+                    vaddr=vaddr,
+                    data=self._view[offset:offset + filesz],
+                    memsz=memsz,
+                    flags=flags
+                ))
+
+        self.symbols = dict()
+        sections = [ELF32_SHDR.unpack_from(self._view, shoff + i * shentsize) for i in range(shnum)]
+        for _, shtype, _, _, offset, size, link, _, _, entsize in sections:
+            if shtype != SHT_SYMTAB or entsize == 0:
+                continue
+            strtab = sections[link][4]
+            for j in range(size // entsize):
+                name, value, _, _, _, _ = ELF32_SYM.unpack_from(self._view, offset + j * entsize)
+                if name:
+                    end = self._map.find(b"\0", strtab + name)
+                    self.symbols[bytes(self._view[strtab + name:end]).decode()] = value
+
+    def code_region(self) -> tuple:
+        """(first, last) address of the executable segments, or None without any."""
+        code = [segment for segment in self.segments if segment.flags & PF_X and segment.memsz]
+        if not code:
+            return None
+        return (min(segment.vaddr for segment in code),
+                max(segment.vaddr + segment.memsz for segment in code) - 1)
+
+    def load(self, mem) -> None:
+        """Copy every PT_LOAD segment into mem and zero-fill the rest of memsz (.bss)."""
+        for segment in self.segments:
+            if len(segment.data):
+                mem.load(segment.vaddr, segment.data)
+            if segment.memsz > len(segment.data):
+                mem.load(segment.vaddr + len(segment.data), bytes(segment.memsz - len(segment.data)))
+
+    def close(self) -> None:
+        for segment in self.segments:
+            segment.data.release()
+        self._view.release()
+        self._map.close()
+
+def load_elf(path, mem) -> ElfImage:
+    image = ElfImage(path)
+    image.load(mem)
+    return image
@@ -1,18 +1,63 @@
+import sys
+from array import array
+
 import numpy as np
 
 from rktcpu.riscv.utility import sign_extend, sll, srl, get_bits
 
+PAGE_SHIFT = 12
+PAGE_SIZE  = 1 << PAGE_SHIFT
+PAGE_MASK  = PAGE_SIZE - 1
+
+# Instruction and data regions of CacheSystem.vhd (cIMemRegion, cDMemRegion)
+IMEM_REGION = (0x00000000, 0x000FFFFF)
+DMEM_REGION = (0x00100000, 0x001FFFFF)
+
+def read_hex(path) -> array:
+    """Read a text hex file with one 32-bit word per line."""
+    with open(path, 'r') as f:
+        return array('I', [int(line, 16) for line in f if line.strip()])
+
 class Memory():
     def __init__(self, instr_path=None, instr_addr=None) -> None:
         self.memory = dict()
+        # Predecoded instructions keyed by word address, filled by the cpu model.
+        self.decoded = dict()
+        # Callables notified with the word address of a dropped instruction.
+        self.invalidation_hooks = list()
         if ((instr_path == None) ^ (instr_addr == None)):
             raise ValueError
         elif (instr_path != None):
-            f = open(instr_path, 'r')
-            for line in f:
-                instr = int(line, 16)
-                self.memory[instr_addr] = instr
-                instr_addr += 4
+            self.load(instr_addr, read_hex(instr_path))
+
+    def _invalidate_range(self, start, end) -> None:
+        for addr in [a for a in self.decoded if start <= a < end]:
+            del self.decoded[addr]
+            for hook in self.invalidation_hooks:
+                hook(addr)
+
+    def load(self, addr, data) -> None:
+        """Bulk copy bytes (or anything exposing a buffer, e.g. array('I')) into memory."""
+        data = memoryview(data).cast('B')
+        # Unaligned edges are merged byte by byte, the body is copied as words.
+        head = min((-addr) % 4, len(data))
+        for i in range(head):
+            self.write(addr + i, data[i], 'b')
+        body = (len(data) - head) & ~3
+        words = np.frombuffer(data[head:head + body], dtype='<u4')
+        start = addr + head
+        self.memory.update(zip(range(start, start + body, 4), words.tolist()))
+        self._invalidate_range(start, start + body)
+        for i in range(head + body, len(data)):
+            self.write(addr + i, data[i], 'b')
+
+    def snapshot(self) -> dict:
+        """Return a copy of the memory contents for restore()."""
+        return dict(self.memory)
+
+    def restore(self, state) -> None:
+        self.memory = dict(state)
+        self._invalidate_range(0, 1 << 32)
 
     def _perform_read(self, addr, offset, mode=None):
         if mode == 'b':
@@ -39,25 +84,202 @@ class Memory():
             raise ValueError
         
     def _perform_write(self, addr, offset, data, mode=None):
+        # Sub-word writes merge into the existing word.
         if mode == 'b':
             data = data & 0xFF
             data = sll(data, 8 * offset)
-            self.memory[addr] = data
+            mask = sll(0xFF, 8 * offset)
+            self.memory[addr - offset] = (self.memory[addr - offset] & ~mask) | data
         elif mode == 'h':
             if offset == 3:
                 raise ValueError
             data = data & 0xFFFF
             data = sll(data, 8 * offset)
-            self.memory[addr] = data
+            mask = sll(0xFFFF, 8 * offset)
+            self.memory[addr - offset] = (self.memory[addr - offset] & ~mask) | data
         else: # Supports None and "w".
             if offset > 0:
                 raise ValueError
             self.memory[addr] = data
 
     def write(self, addr, data, mode=None):
-        addr = int(addr[0])
+        addr = int(addr)
         offset = (addr % 4)
-        data = np.uint32(data)
+        data = int(data) & 0xFFFFFFFF
         if not (addr - offset in self.memory):
-            self.memory[addr - offset] = np.uint32(0)
-        self._perform_write(addr, offset, data, mode)
\ No newline at end of file
+            self.memory[addr - offset] = 0
+        # Drop any predecoded instruction at this word so that it is refetched.
+        if self.decoded.pop(addr - offset, None) is not None:
+            for hook in self.invalidation_hooks:
+                hook(addr - offset)
+        self._perform_write(addr, offset, data, mode)
+
+class PagedMemory():
+    """Flat memory made of lazily allocated pages backed by bytearrays.
+
+    Only addresses inside one of the regions are valid, by default the
+    instruction and data regions of CacheSystem.vhd. Untouched pages read as
+    zero and are allocated on their first write. Words, halfwords and bytes
+    are accessed through memoryview casts of the same page, which assumes a
+    little-endian host like the RISC-V target.
+    """
+    def __init__(self, instr_path=None, instr_addr=None, regions=(IMEM_REGION, DMEM_REGION)) -> None:
+        if sys.byteorder != "little":
+            raise NotImplementedError("PagedMemory requires a little-endian host")
+        self.regions = [(int(lo), int(hi)) for lo, hi in regions]
+        self.pages   = dict()
+        self.wpages  = dict()
+        self.hpages  = dict()
+        self.bpages  = dict()
+        # Word views of the pages written since the last snapshot, the only
+        # pages with a write fast path. The first write to any other page
+        # goes through _write_slow, which marks it dirty.
+        self.dirty   = dict()
+        self._snapshot = dict()
+        # Predecoded instructions keyed by word address, filled by the cpu model.
+        self.decoded = dict()
+        # Callables notified with the word address of a dropped instruction.
+        self.invalidation_hooks = list()
+        if ((instr_path == None) ^ (instr_addr == None)):
+            raise ValueError
+        elif (instr_path != None):
+            self.load(instr_addr, read_hex(instr_path))
+
+    def _valid(self, addr) -> bool:
+        for lo, hi in self.regions:
+            if lo <= addr <= hi:
+                return True
+        return False
+
+    def _allocate(self, pagenum) -> bytearray:
+        if not self._valid(pagenum << PAGE_SHIFT):
+            raise ValueError
+        page = bytearray(PAGE_SIZE)
+        view = memoryview(page)
+        self.pages[pagenum]  = page
+        self.bpages[pagenum] = view
+        self.hpages[pagenum] = view.cast('H')
+        self.wpages[pagenum] = view.cast('I')
+        self.dirty[pagenum]  = self.wpages[pagenum]
+        return page
+
+    def _invalidate_range(self, start, end) -> None:
+        for addr in [a for a in self.decoded if start <= a < end]:
+            del self.decoded[addr]
+            for hook in self.invalidation_hooks:
+                hook(addr)
+
+    def load(self, addr, data) -> None:
+        """Bulk copy bytes (or anything exposing a buffer, e.g. array('I')) into memory."""
+        data  = memoryview(data).cast('B')
+        start = addr
+        while len(data):
+            pagenum = addr >> PAGE_SHIFT
+            offset  = addr & PAGE_MASK
+            count   = min(PAGE_SIZE - offset, len(data))
+            page    = self.pages.get(pagenum)
+            if page is None:
+                page = self._allocate(pagenum)
+            page[offset:offset + count] = data[:count]
+            self.dirty[pagenum] = self.wpages[pagenum]
+            data  = data[count:]
+            addr += count
+        self._invalidate_range(start & ~3, addr)
+
+    def snapshot(self) -> dict:
+        """Return {pagenum: bytes} for restore().
+
+        Only pages written since the previous snapshot (or restore) are
+        copied, the others are shared with it.
+        """
+        pages = dict(self._snapshot)
+        for pagenum in self.dirty:
+            pages[pagenum] = bytes(self.pages[pagenum])
+        self.dirty.clear()
+        self._snapshot = pages
+        return pages
+
+    def restore(self, pages) -> None:
+        for table in (self.pages, self.wpages, self.hpages, self.bpages):
+            table.clear()
+        for pagenum, data in pages.items():
+            self._allocate(pagenum)[:] = data
+        self.dirty.clear()
+        self._snapshot = dict(pages)
+        self._invalidate_range(0, 1 << 32)
+
+    def dump(self, addr, length) -> bytes:
+        """Return length bytes starting at addr, untouched pages read as zero."""
+        out = bytearray(length)
+        pos = 0
+        while pos < length:
+            pagenum = (addr + pos) >> PAGE_SHIFT
+            offset  = (addr + pos) & PAGE_MASK
+            count   = min(PAGE_SIZE - offset, length - pos)
+            page    = self.pages.get(pagenum)
+            if page is not None:
+                out[pos:pos + count] = page[offset:offset + count]
+            pos += count
+        return bytes(out)
+
+    def read(self, addr, mode=None):
+        addr = int(addr)
+        if mode == 'w' or mode is None:
+            page = self.wpages.get(addr >> PAGE_SHIFT)
+            if page is not None and not addr & 3:
+                return page[(addr & PAGE_MASK) >> 2]
+        return self._read_slow(addr, mode)
+
+    def _read_slow(self, addr, mode):
+        pagenum = addr >> PAGE_SHIFT
+        if pagenum not in self.pages:
+            if not self._valid(addr):
+                raise ValueError
+            return 0
+        offset = addr & PAGE_MASK
+        if mode == 'b':
+            return self.bpages[pagenum][offset]
+        elif mode == 'h':
+            if offset & 1:
+                if offset & 3 == 3:
+                    raise ValueError
+                page = self.bpages[pagenum]
+                return page[offset] | (page[offset + 1] << 8)
+            return self.hpages[pagenum][offset >> 1]
+        else: # Supports None and "w".
+            raise ValueError
+
+    def write(self, addr, data, mode=None):
+        addr = int(addr)
+        # Drop any predecoded instruction at this word so that it is refetched.
+        if self.decoded and self.decoded.pop(addr & ~3, None) is not None:
+            for hook in self.invalidation_hooks:
+                hook(addr & ~3)
+        if mode == 'w' or mode is None:
+            page = self.dirty.get(addr >> PAGE_SHIFT)
+            if page is not None and not addr & 3:
+                page[(addr & PAGE_MASK) >> 2] = int(data) & 0xFFFFFFFF
+                return
+        self._write_slow(addr, int(data), mode)
+
+    def _write_slow(self, addr, data, mode):
+        pagenum = addr >> PAGE_SHIFT
+        if pagenum not in self.pages:
+            self._allocate(pagenum)
+        self.dirty[pagenum] = self.wpages[pagenum]
+        offset = addr & PAGE_MASK
+        if mode == 'b':
+            self.bpages[pagenum][offset] = data & 0xFF
+        elif mode == 'h':
+            if offset & 1:
+                if offset & 3 == 3:
+                    raise ValueError
+                page = self.bpages[pagenum]
+                page[offset]     = data & 0xFF
+                page[offset + 1] = (data >> 8) & 0xFF
+            else:
+                self.hpages[pagenum][offset >> 1] = data & 0xFFFF
+        else: # Supports None and "w".
+            if offset & 3:
+                raise ValueError
+            self.wpages[pagenum][offset >> 2] = data & 0xFFFFFFFF
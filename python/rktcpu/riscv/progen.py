@@ -0,0 +1,169 @@
+import numpy as np
+
+from rktcpu.riscv.rv32i import ECALL_INSTRUCTION, BRANCH_OPCODE, LOAD_OPCODE, STORE_OPCODE, ALU_OPCODE, \
+    ALU_IMMED_OPCODE, JUMP_OPCODE, JUMP_REG_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE
+from rktcpu.riscv.alu import ALT_FUNCT7
+
+# Relative frequency of each instruction class in the random body.
+DEFAULT_WEIGHTS = {
+    "alu"       : 4,
+    "alu_immed" : 4,
+    "lui"       : 1,
+    "auipc"     : 1,
+    "load"      : 2,
+    "store"     : 2,
+    "branch"    : 2,
+    "jal"       : 1,
+    "jalr"      : 1,
+}
+
+# Base register of every load and store, never written by the body.
+DATA_REGISTER = 31
+
+# Longest forward skip of a branch or jump, in instructions.
+MAX_SKIP = 8
+
+LOAD_FUNCT3  = np.array([0, 1, 2, 4, 5])
+STORE_FUNCT3 = np.array([0, 1, 2])
+BRANCH_FUNCT3 = np.array([0, 1, 4, 5, 6, 7])
+
+def _u32(values) -> np.ndarray:
+    return (np.asarray(values, dtype=np.int64) & 0xFFFFFFFF).astype(np.uint32)
+
+def encode_r(opcode, rd, funct3, rs1, rs2, funct7) -> np.ndarray:
+    return _u32((np.asarray(funct7, dtype=np.int64) << 25) | (np.asarray(rs2, dtype=np.int64) << 20)
+                | (np.asarray(rs1, dtype=np.int64) << 15) | (np.asarray(funct3, dtype=np.int64) << 12)
+                | (np.asarray(rd, dtype=np.int64) << 7) | opcode)
+
+def encode_i(opcode, rd, funct3, rs1, imm) -> np.ndarray:
+    return encode_r(opcode, rd, funct3, rs1, 0, 0) | _u32((np.asarray(imm, dtype=np.int64) & 0xFFF) << 20)
+
+def encode_s(opcode, funct3, rs1, rs2, imm) -> np.ndarray:
+    imm = np.asarray(imm, dtype=np.int64) & 0xFFF
+    return encode_r(opcode, imm & 0x1F, funct3, rs1, rs2, imm >> 5)
+
+def encode_b(funct3, rs1, rs2, imm) -> np.ndarray:
+    imm = np.asarray(imm, dtype=np.int64) & 0x1FFF
+    return encode_r(BRANCH_OPCODE, ((imm >> 1) & 0xF) << 1 | ((imm >> 11) & 0x1), funct3, rs1, rs2,
+                    ((imm >> 12) & 0x1) << 6 | ((imm >> 5) & 0x3F))
+
+def encode_u(opcode, rd, imm) -> np.ndarray:
+    """imm is the upper 20 bits."""
+    return _u32(((np.asarray(imm, dtype=np.int64) & 0xFFFFF) << 12) | (np.asarray(rd, dtype=np.int64) << 7) | opcode)
+
+def encode_j(rd, imm) -> np.ndarray:
+    imm = np.asarray(imm, dtype=np.int64) & 0x1FFFFF
+    fields = ((imm >> 20) & 0x1) << 19 | ((imm >> 1) & 0x3FF) << 9 | ((imm >> 11) & 0x1) << 8 | ((imm >> 12) & 0xFF)
+    return _u32((fields << 12) | (np.asarray(rd, dtype=np.int64) << 7) | JUMP_OPCODE)
+
+def _load_constant(rd, value) -> tuple:
+    # lui + addi pair, the upper part is rounded for the sign of the addi.
+    value = np.asarray(value, dtype=np.int64)
+    upper = ((value + 0x800) >> 12) & 0xFFFFF
+    return encode_u(LOAD_UPPER_OPCODE, rd, upper), encode_i(ALU_IMMED_OPCODE, rd, 0, rd, value & 0xFFF)
+
+def prologue_length(registers, data_bytes) -> int:
+    return 2 * registers + 2 + data_bytes // 4
+
+def random_programs(count, length, seed=0, registers=8, dependency=0.5, weights=None,
+                    memory_bytes=1 << 13, data_bytes=256) -> np.ndarray:
+    """Return (count, words) random RV32I programs that end in an ecall.
+
+    A prologue loads random values into x1..x{registers}, points x31 at
+    the middle of a data window at the top of memory_bytes and clears that
+    window with stores, so the body only reads initialized data. The body
+    draws length instructions from weights over the same few registers,
+    where each source is the previous destination with probability
+    dependency to build RAW hazard chains like test004/test005. Branches
+    and jumps only go forward, so every program reaches the ecall.
+    """
+    weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+    if not 1 <= registers < DATA_REGISTER:
+        raise ValueError("registers must be between 1 and {}".format(DATA_REGISTER - 1))
+    if data_bytes % 4 or not 8 <= data_bytes <= 4096:
+        raise ValueError("data_bytes must be a multiple of 4 between 8 and 4096")
+    start = prologue_length(registers, data_bytes)
+    words = start + length + 1
+    if 4 * words > memory_bytes - data_bytes:
+        raise ValueError("Programs of {} words overlap the data window".format(words))
+    rng = np.random.default_rng(seed)
+    out = np.zeros((count, words), dtype=np.uint32)
+
+    # Prologue.
+    values = rng.integers(0, 1 << 32, size=(count, registers), dtype=np.int64)
+    for r in range(registers):
+        out[:, 2 * r], out[:, 2 * r + 1] = _load_constant(r + 1, values[:, r])
+    data_base = memory_bytes - data_bytes // 2
+    lui, addi = _load_constant(DATA_REGISTER, np.full(count, data_base))
+    out[:, 2 * registers], out[:, 2 * registers + 1] = lui, addi
+    offsets = np.arange(-(data_bytes // 2), data_bytes // 2, 4)
+    out[:, 2 * registers + 2:start] = encode_s(STORE_OPCODE, 2, DATA_REGISTER, 0, offsets)
+
+    # Body, the register fields are drawn for every slot so that sources can
+    # follow earlier destinations, the other fields only for their class.
+    names = list(weights)
+    p = np.cumsum([weights[name] for name in names], dtype=np.float64)
+    cls = np.searchsorted(p / p[-1], rng.random((count, length)), side="right").ravel()
+    draw = lambda low, high, size=(count, length): rng.integers(low, high, size=size, dtype=np.int64)
+    rd  = draw(1, registers + 1)
+    rs1 = draw(0, registers + 1)
+    rs2 = draw(0, registers + 1)
+    rs1[:, 1:] = np.where(rng.random((count, length - 1)) < dependency, rd[:, :-1], rs1[:, 1:])
+    if length > 2:
+        rs2[:, 2:] = np.where(rng.random((count, length - 2)) < dependency / 2, rd[:, :-2], rs2[:, 2:])
+    rd, rs1, rs2 = rd.ravel(), rs1.ravel(), rs2.ravel()
+    slot = np.arange(count * length) % length
+    half = data_bytes // 2
+
+    program = np.empty(count * length, dtype=np.uint32)
+    for index, name in enumerate(names):
+        sel = np.flatnonzero(cls == index)
+        n = len(sel)
+        if not n:
+            continue
+        d, a, b = rd[sel], rs1[sel], rs2[sel]
+        if name in ("alu", "alu_immed"):
+            funct3 = draw(0, 8, n)
+            alt = rng.random(n) < 0.5
+            if name == "alu":
+                funct7 = np.where(alt & ((funct3 == 0) | (funct3 == 5)), ALT_FUNCT7, 0)
+                program[sel] = encode_r(ALU_OPCODE, d, funct3, a, b, funct7)
+            else:
+                imm = draw(-2048, 2048, n)
+                shamt = (imm & 0x1F) | np.where((funct3 == 5) & alt, ALT_FUNCT7 << 5, 0)
+                imm = np.where((funct3 == 1) | (funct3 == 5), shamt, imm)
+                program[sel] = encode_i(ALU_IMMED_OPCODE, d, funct3, a, imm)
+        elif name in ("lui", "auipc"):
+            opcode = LOAD_UPPER_OPCODE if name == "lui" else AUIPC_OPCODE
+            program[sel] = encode_u(opcode, d, draw(0, 1 << 20, n))
+        elif name == "load":
+            # Offsets aligned to the access size.
+            funct3 = LOAD_FUNCT3[draw(0, len(LOAD_FUNCT3), n)]
+            size = funct3 & 3
+            program[sel] = encode_i(LOAD_OPCODE, d, funct3, DATA_REGISTER, (draw(-half, half, n) >> size) << size)
+        elif name == "store":
+            funct3 = STORE_FUNCT3[draw(0, len(STORE_FUNCT3), n)]
+            program[sel] = encode_s(STORE_OPCODE, funct3, DATA_REGISTER, b, (draw(-half, half, n) >> funct3) << funct3)
+        else:
+            # Forward skips never pass the final ecall.
+            skip = 4 * np.minimum(draw(1, MAX_SKIP + 1, n), length - slot[sel])
+            link = np.where(rng.random(n) < 0.25, 0, d)
+            if name == "branch":
+                program[sel] = encode_b(BRANCH_FUNCT3[draw(0, len(BRANCH_FUNCT3), n)], a, b, skip)
+            elif name == "jal":
+                program[sel] = encode_j(link, skip)
+            elif name == "jalr":
+                # x0 based, a jal where the target does not fit the immediate.
+                target = 4 * (start + slot[sel]) + skip
+                program[sel] = np.where(target < 2048, encode_i(JUMP_REG_OPCODE, link, 0, 0, target),
+                                        encode_j(link, skip))
+            else:
+                raise ValueError("Unknown instruction class: {}".format(name))
+    out[:, start:start + length] = program.reshape(count, length)
+    out[:, -1] = ECALL_INSTRUCTION
+    return out
+
+def write_hex(path, program) -> None:
+    """Write one program in the tests/asm hex format."""
+    with open(path, "w") as f:
+        f.write("".join("%08x\n" % word for word in np.asarray(program).tolist()))
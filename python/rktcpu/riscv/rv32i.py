@@ -1,6 +1,9 @@
 import numpy as np
 
-from rktcpu.riscv.utility import sign_extend, sll, srl, get_bits, hex
+from rktcpu.riscv.utility import sign_extend, get_bits
+from rktcpu.riscv.csr import ZICSR_MODES
+from rktcpu.riscv.alu import ALU_OPS, alu_op
+from rktcpu.trace import open_trace
 
 BRANCH_OPCODE     = 0b1100011
 LOAD_OPCODE       = 0b0000011
@@ -14,16 +17,92 @@ AUIPC_OPCODE      = 0b0010111
 FENCE_OPCODE      = 0b0001111
 ECALL_OPCODE      = 0b1110011
 
+ECALL_INSTRUCTION = 0x00000073
+
+# Reasons returned by run() for stopping.
+STOP_MAX_INSTRUCTIONS = "max_instructions"
+STOP_BREAKPOINT       = "breakpoint"
+STOP_ECALL            = "ecall"
+STOP_IDLE             = "idle"
+
+# Load funct3 -> (memory mode, bits to sign extend from or None)
+LOAD_MODES = {
+    0: ("b", 8),
+    1: ("h", 16),
+    2: ("w", None),
+    4: ("b", None),
+    5: ("h", None),
+}
+
+# Store funct3 -> memory mode
+STORE_MODES = {
+    0: "b",
+    1: "h",
+    2: "w",
+}
+
+class Instruction():
+    """Predecoded instruction record, immediates are already sign-extended."""
+    __slots__ = ("instr", "opcode", "rd", "funct3", "rs1", "rs2", "funct7", "imm")
+
+    def __init__(self, instr) -> None:
+        self.instr  = instr
+        self.opcode = instr & 0x7F
+        self.rd     = (instr >> 7) & 0x1F
+        self.funct3 = (instr >> 12) & 0x7
+        self.rs1    = (instr >> 15) & 0x1F
+        self.rs2    = (instr >> 20) & 0x1F
+        self.funct7 = (instr >> 25) & 0x7F
+
+        opcode = self.opcode
+        if opcode == STORE_OPCODE:
+            imm = sign_extend((self.funct7 << 5) | self.rd, 12)
+        elif opcode == BRANCH_OPCODE:
+            imm = sign_extend(((instr >> 31) & 0x1) << 12 | ((instr >> 7) & 0x1) << 11 \
+                | ((instr >> 25) & 0x3F) << 5 | ((instr >> 8) & 0xF) << 1, 13)
+        elif opcode == JUMP_OPCODE:
+            imm = sign_extend(((instr >> 31) & 0x1) << 20 | ((instr >> 12) & 0xFF) << 12 \
+                | ((instr >> 20) & 0x1) << 11 | ((instr >> 21) & 0x3FF) << 1, 21)
+        elif opcode == LOAD_UPPER_OPCODE or opcode == AUIPC_OPCODE:
+            # U-type immediates already fill all 32 bits.
+            imm = instr & 0xFFFFF000
+        elif opcode == ECALL_OPCODE:
+            # The CSR address is unsigned.
+            imm = (instr >> 20) & 0xFFF
+        else:
+            imm = sign_extend((instr >> 20) & 0xFFF, 12)
+        self.imm = imm
+
+def predecode(instr) -> Instruction:
+    return Instruction(int(instr))
+
 class Rv32iModel():
-    def __init__(self, logpath=None, enablelogging=False) -> None:
+    def __init__(self, logpath=None, enablelogging=False, logformat="csv") -> None:
         self.pc        = np.uint32(0)
         self.registers = np.zeros([32,1], np.uint32)
+        self.log       = None
+        self.opcodes   = self._build_opcode_table()
         if enablelogging and (logpath is not None):
-            self.log = open(logpath, "w")
-            self.log.write("pc,rd,res,\n")
+            self.log = open_trace(logpath, logformat)
 
     def close(self):
-        self.log.close()
+        if self.log is not None:
+            self.log.close()
+
+    def _build_opcode_table(self) -> list:
+        opcodes = [self._exec_illegal] * 128
+        opcodes[ALU_OPCODE]        = self._exec_alu
+        opcodes[ALU_IMMED_OPCODE]  = self._exec_alu_immed
+        opcodes[LOAD_OPCODE]       = self._exec_load
+        opcodes[STORE_OPCODE]      = self._exec_store
+        opcodes[AUIPC_OPCODE]      = self._exec_auipc
+        opcodes[LOAD_UPPER_OPCODE] = self._exec_load_upper
+        opcodes[JUMP_OPCODE]       = self._exec_jump
+        opcodes[JUMP_REG_OPCODE]   = self._exec_jump_reg
+        opcodes[BRANCH_OPCODE]     = self._exec_branch
+        opcodes[FENCE_OPCODE]      = self._exec_fence
+        opcodes[ECALL_OPCODE]      = self._exec_system
+        return opcodes
 
     def _get_rs1(self, instr) -> int:
         return get_bits(instr, 15, 19)
@@ -72,31 +151,20 @@ class Rv32iModel():
         decoded["btype"]  = self._get_btype(instr)
         decoded["jtype"]  = self._get_jtype(instr)
         return decoded
+
+    def fetch(self, mem, pc) -> Instruction:
+        # Predecoded records are kept by the memory so that writes to a cached
+        # address drop the stale record, keeping self-modifying code correct.
+        pc = int(pc)
+        decoded = mem.decoded.get(pc)
+        if decoded is None:
+            decoded = predecode(mem.read(pc))
+            mem.decoded[pc] = decoded
+        return decoded
     
     def alu(self, opA, opB, funct3, funct7=None):
-        if funct3 == 0:
-            if funct7 == 0b0100000:
-                return np.uint32(opA) - np.uint32(opB)
-            else:
-                return np.uint32(opA) + np.uint32(opB)
-        elif funct3 == 1:
-            return sll(opA, get_bits(opB, 0, 4))
-        elif funct3 == 2:
-            return int(np.uint32(opA) < np.uint32(opB))
-        elif funct3 == 3:
-            return int(np.uint32(opA) < np.uint32(opB))
-        elif funct3 == 4:
-            return np.uint32(opA) ^ np.uint32(opB)
-        elif funct3 == 5:
-            if funct7 == 0b0100000:
-                return np.uint32(opA) >> np.uint32(get_bits(opB, 0, 4))
-            else:
-                return np.uint32(srl(opA, get_bits(opB, 0, 4)))
-        elif funct3 == 6:
-            return np.uint32(opA) | np.uint32(opB)
-        elif funct3 == 7:
-            return np.uint32(opA) & np.uint32(opB)
-        
+        return ALU_OPS[alu_op(funct3, funct7)](np.uint32(opA), np.uint32(opB))
+
     def branch(self, opA, opB, funct3) -> bool:
         if funct3 == 0:
             return opA == opB
@@ -111,116 +179,132 @@ class Rv32iModel():
         elif funct3 == 7:
             return np.uint32(opA) >= np.uint32(opB)
 
-    def step(self, mem, csr) -> None:
-        # Get the instruction pointed to by the pc
-        instr = mem.read(self.pc)
-        # Decode the instruction according to the spec
-        decoded  = self.decode(instr)
-        # Clear the pcupdate flag
-        pcupdate = False
-
-        if decoded["opcode"] == ALU_OPCODE:
-            opA = self.registers[decoded["rs1"]]
-            opB = self.registers[decoded["rs2"]]
-            res = self.alu(opA, opB, decoded["funct3"], decoded["funct7"])
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = res
-                self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(res[0], 8)))
-
-        elif decoded["opcode"] == ALU_IMMED_OPCODE:
-            opA = self.registers[decoded["rs1"]]
-            opB = np.uint32(np.int32(sign_extend(decoded["itype"], 12)))
-            if decoded["funct3"] == 1 or decoded["funct3"] == 5:
-                res = self.alu(opA, opB, decoded["funct3"], decoded["funct7"])
-            else:
-                res = self.alu(opA, opB, decoded["funct3"])
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = res
-                self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(res[0], 8)))
-
-        elif decoded["opcode"] == LOAD_OPCODE:
-            addr = self.registers[decoded["rs1"]] + \
-                np.uint32(np.int32(sign_extend(decoded["itype"], 12)))
-            addr = addr[0]
-            if decoded["funct3"] == 0:
-                mode = "b"
-            elif decoded["funct3"] == 1:
-                mode = "h"
-            elif decoded["funct3"] == 2:
-                mode = "w"
-            data = mem.read(addr, mode)
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = data
-                self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(data[0], 8)))
-
-        elif decoded["opcode"] == STORE_OPCODE:
-            addr = self.registers[decoded["rs1"]] + \
-                np.uint32(np.int32(sign_extend(decoded["stype"], 12)))
-            data = self.registers[decoded["rs2"]]
-            if decoded["funct3"] == 0:
-                mode = "b"
-            elif decoded["funct3"] == 1:
-                mode = "h"
-            elif decoded["funct3"] == 2:
-                mode = "w"
-            mem.write(addr, data, mode)
-
-        elif decoded["opcode"] == AUIPC_OPCODE:
-            res = self.pc + (decoded["utype"] << 12)
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = res
-                self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(res, 8)))
-
-        elif decoded["opcode"] == LOAD_UPPER_OPCODE:
-            res = np.uint32((decoded["utype"] << 12))
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = res
-            self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(res, 8)))
-
-        elif decoded["opcode"] == JUMP_OPCODE:
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = self.pc + 4
-                self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(self.pc + 4, 8)))
-            self.pc = int(np.uint32(self.pc) + np.uint32(np.int32(sign_extend(decoded["jtype"], 21))))
-            pcupdate = True
-
-        elif decoded["opcode"] == JUMP_REG_OPCODE:
-            if decoded["rd"] != 0:
-                self.registers[decoded["rd"]] = self.pc + 4
-                self.log.write("{},{},{},\n".format(hex(self.pc, 8), hex(decoded["rd"], 2), hex(self.pc + 4, 8)))
-            self.pc = int(np.uint32(self.registers[decoded["rs1"]]) \
-                          + np.uint32(np.int32(sign_extend(decoded["itype"], 12))))
-            pcupdate = True
-
-        elif decoded["opcode"] == BRANCH_OPCODE:
-            opA = self.registers[decoded["rs1"]]
-            opB = self.registers[decoded["rs2"]]
-            if self.branch(opA, opB, decoded["funct3"]):
-                self.pc = int(np.uint32(self.pc) + np.uint32(np.int32(sign_extend(decoded["btype"], 13))))
-                pcupdate = True
-
-        elif decoded["opcode"] == FENCE_OPCODE:
-            print("FENCE")
-        elif decoded["opcode"] == ECALL_OPCODE:
-            if decoded["funct3"] == 0:
-                print("ECALL")
-            elif decoded["funct3"] == 1:
-                addr = decoded["itype"]
-                # TODO: Finish this
-                #csr.access(addr)
-            elif decoded["funct3"] == 2:
-                pass
-            elif decoded["funct3"] == 3:
-                pass
-            elif decoded["funct3"] == 5:
-                pass
-            elif decoded["funct3"] == 6:
-                pass
-            elif decoded["funct3"] == 7:
-                pass
+    def get_registers(self) -> list:
+        return [int(value) for value in self.registers[:, 0]]
+
+    def set_registers(self, values) -> None:
+        self.registers[:, 0] = values
 
+    def write_register(self, rd, res) -> None:
+        if rd != 0:
+            self.registers[rd] = res
+            if self.log is not None:
+                self.log.write(self.pc, rd, res)
+
+    def register_opcode(self, opcode, handler) -> None:
+        """Install handler(cpu, decoded, mem, csr) for opcode.
+
+        The handler returns the next pc, or None to continue at pc + 4.
+        """
+        def custom(decoded, mem, csr):
+            nextpc = handler(self, decoded, mem, csr)
+            return self.pc + 4 if nextpc is None else nextpc
+        self.opcodes[opcode] = custom
+
+    def _exec_illegal(self, decoded, mem, csr):
+        raise ValueError
+
+    def _exec_alu(self, decoded, mem, csr):
+        opA = self.registers[decoded.rs1, 0]
+        opB = self.registers[decoded.rs2, 0]
+        self.write_register(decoded.rd, self.alu(opA, opB, decoded.funct3, decoded.funct7))
+        return self.pc + 4
+
+    def _exec_alu_immed(self, decoded, mem, csr):
+        opA = self.registers[decoded.rs1, 0]
+        opB = np.uint32(decoded.imm & 0xFFFFFFFF)
+        if decoded.funct3 == 1 or decoded.funct3 == 5:
+            res = self.alu(opA, opB, decoded.funct3, decoded.funct7)
         else:
+            res = self.alu(opA, opB, decoded.funct3)
+        self.write_register(decoded.rd, res)
+        return self.pc + 4
+
+    def _exec_load(self, decoded, mem, csr):
+        addr = self.registers[decoded.rs1, 0] + \
+            np.uint32(decoded.imm & 0xFFFFFFFF)
+        if decoded.funct3 not in LOAD_MODES:
+            raise ValueError
+        mode, signbits = LOAD_MODES[decoded.funct3]
+        data = mem.read(addr, mode)
+        if signbits is not None:
+            data = sign_extend(data, signbits) & 0xFFFFFFFF
+        self.write_register(decoded.rd, data)
+        return self.pc + 4
+
+    def _exec_store(self, decoded, mem, csr):
+        addr = self.registers[decoded.rs1, 0] + \
+            np.uint32(decoded.imm & 0xFFFFFFFF)
+        data = self.registers[decoded.rs2, 0]
+        if decoded.funct3 not in STORE_MODES:
+            raise ValueError
+        mem.write(addr, data, STORE_MODES[decoded.funct3])
+        return self.pc + 4
+
+    def _exec_auipc(self, decoded, mem, csr):
+        self.write_register(decoded.rd, np.uint32(self.pc) + np.uint32(decoded.imm))
+        return self.pc + 4
+
+    def _exec_load_upper(self, decoded, mem, csr):
+        self.write_register(decoded.rd, np.uint32(decoded.imm))
+        return self.pc + 4
+
+    def _exec_jump(self, decoded, mem, csr):
+        self.write_register(decoded.rd, self.pc + 4)
+        return int(np.uint32(self.pc) + np.uint32(decoded.imm & 0xFFFFFFFF))
+
+    def _exec_jump_reg(self, decoded, mem, csr):
+        # Compute the target before the link write in case rd == rs1.
+        target = int(self.registers[decoded.rs1, 0] \
+                     + np.uint32(decoded.imm & 0xFFFFFFFF))
+        self.write_register(decoded.rd, self.pc + 4)
+        return target
+
+    def _exec_branch(self, decoded, mem, csr):
+        opA = self.registers[decoded.rs1, 0]
+        opB = self.registers[decoded.rs2, 0]
+        if self.branch(opA, opB, decoded.funct3):
+            return int(np.uint32(self.pc) + np.uint32(decoded.imm & 0xFFFFFFFF))
+        return self.pc + 4
+
+    def _exec_fence(self, decoded, mem, csr):
+        return self.pc + 4
+
+    def _exec_system(self, decoded, mem, csr):
+        # ECALL does nothing here, run() stops before it when until_ecall is set.
+        if decoded.funct3 in ZICSR_MODES:
+            res = csr.zicsr(decoded, int(self.registers[decoded.rs1, 0]))
+            self.write_register(decoded.rd, np.uint32(res))
+        elif decoded.funct3 != 0:
             raise ValueError
-        
-        if not pcupdate:
-            self.pc += 4
\ No newline at end of file
+        return self.pc + 4
+
+    def run(self, mem, csr, max_instructions=None, breakpoints=frozenset(),
+            until_ecall=False, until_idle=False) -> tuple:
+        """Step until a stop condition is hit and return (retired, reason).
+
+        Breakpoints and ecalls stop before the instruction at that pc is
+        executed, except for the first instruction of the run so that a
+        stopped run can be resumed. An idle stop happens after a jump to self.
+        """
+        retired = 0
+        while max_instructions is None or retired < max_instructions:
+            pc = self.pc
+            if retired and pc in breakpoints:
+                return retired, STOP_BREAKPOINT
+            decoded = self.fetch(mem, pc)
+            if until_ecall and decoded.instr == ECALL_INSTRUCTION:
+                return retired, STOP_ECALL
+            self.pc = self.opcodes[decoded.opcode](decoded, mem, csr)
+            csr.retired += 1
+            retired += 1
+            if until_idle and self.pc == pc:
+                return retired, STOP_IDLE
+        return retired, STOP_MAX_INSTRUCTIONS
+
+    def step(self, mem, csr) -> None:
+        # Get the predecoded instruction pointed to by the pc
+        decoded = self.fetch(mem, self.pc)
+        # Dispatch on the opcode, each handler returns the next pc
+        self.pc = self.opcodes[decoded.opcode](decoded, mem, csr)
+        csr.retired += 1
@@ -0,0 +1,243 @@
+import sys
+
+from rktcpu.riscv.rv32i import \
+    ECALL_INSTRUCTION, STOP_MAX_INSTRUCTIONS, STOP_BREAKPOINT, STOP_ECALL, STOP_IDLE, \
+    BRANCH_OPCODE, LOAD_OPCODE, STORE_OPCODE, ALU_OPCODE, ALU_IMMED_OPCODE, \
+    JUMP_OPCODE, JUMP_REG_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE
+from rktcpu.riscv.rv32i_int import Rv32iIntModel, MASK32, _illegal, \
+    _add, _sub, _sll, _slt, _sltu, _xor, _srl, _sra, _or, _and, \
+    _beq, _bne, _blt, _bge, _bltu, _bgeu
+
+# Longest straight-line run translated into a single block.
+MAX_BLOCK_LENGTH = 64
+
+TERMINATOR_OPCODES = (BRANCH_OPCODE, JUMP_OPCODE, JUMP_REG_OPCODE)
+
+# Inline expression templates for the base ALU and branch operations. Signed
+# comparisons flip the sign bit so that they can be done on unsigned ints.
+ALU_EXPRESSIONS = {
+    _add  : "({a} + {b}) & 0xFFFFFFFF",
+    _sub  : "({a} - {b}) & 0xFFFFFFFF",
+    _sll  : "({a} << ({b} & 0x1F)) & 0xFFFFFFFF",
+    _slt  : "int(({a} ^ 0x80000000) < ({b} ^ 0x80000000))",
+    _sltu : "int({a} < {b})",
+    _xor  : "{a} ^ {b}",
+    _srl  : "{a} >> ({b} & 0x1F)",
+    _sra  : "((({a} ^ 0x80000000) - 0x80000000) >> ({b} & 0x1F)) & 0xFFFFFFFF",
+    _or   : "{a} | {b}",
+    _and  : "{a} & {b}",
+}
+
+BRANCH_EXPRESSIONS = {
+    _beq  : "{a} == {b}",
+    _bne  : "{a} != {b}",
+    _blt  : "({a} ^ 0x80000000) < ({b} ^ 0x80000000)",
+    _bge  : "({a} ^ 0x80000000) >= ({b} ^ 0x80000000)",
+    _bltu : "{a} < {b}",
+    _bgeu : "{a} >= {b}",
+}
+
+class BlockExit(Exception):
+    """Raised by a translated block that has to stop before its end."""
+    def __init__(self, nextpc, retired) -> None:
+        self.nextpc  = nextpc
+        self.retired = retired
+
+class Rv32iBlockModel(Rv32iIntModel):
+    """Int engine that translates straight-line basic blocks into Python functions.
+
+    A block starts at any pc and runs until a branch or jump (inclusive), or
+    until an instruction that cannot be translated (SYSTEM, FENCE and custom
+    opcodes), which is then executed through step(). Blocks are cached by
+    their start pc and the cache is flushed whenever a store hits a
+    predecoded instruction.
+    """
+    def __init__(self, logpath=None, enablelogging=False, logformat="csv") -> None:
+        super().__init__(logpath=logpath, enablelogging=enablelogging, logformat=logformat)
+        self.blocks      = dict()
+        self.breakpoints = frozenset()
+        self._hooked     = None
+        self._default_opcodes = list(self.opcodes)
+
+    def flush_blocks(self, addr=None) -> None:
+        self.blocks.clear()
+
+    def _translatable(self, decoded) -> bool:
+        opcode = decoded.opcode
+        if self.opcodes[opcode] is not self._default_opcodes[opcode]:
+            return False
+        if opcode == LOAD_OPCODE:
+            return self.load_ops[decoded.funct3] is not _illegal
+        if opcode == STORE_OPCODE:
+            return self.store_ops[decoded.funct3] is not None
+        if opcode == BRANCH_OPCODE:
+            return self.branch_ops[decoded.funct3] is not _illegal
+        return opcode in (ALU_OPCODE, ALU_IMMED_OPCODE, LOAD_OPCODE, STORE_OPCODE,
+                          LOAD_UPPER_OPCODE, AUIPC_OPCODE) + TERMINATOR_OPCODES
+
+    def _scan(self, mem, pc) -> list:
+        instrs = []
+        while len(instrs) < MAX_BLOCK_LENGTH:
+            if instrs and pc in self.breakpoints:
+                break
+            try:
+                decoded = self.fetch(mem, pc)
+            except ValueError:
+                break
+            if not self._translatable(decoded):
+                break
+            instrs.append((pc, decoded))
+            if decoded.opcode in TERMINATOR_OPCODES:
+                break
+            pc += 4
+        return instrs
+
+    def _emit_write(self, lines, namespace, pc, rd, expr) -> None:
+        lines.append("    r[{}] = {}".format(rd, expr))
+        if self.log is not None:
+            lines.append("    " + self.log.inline(pc, rd, "r[{}]".format(rd), namespace))
+
+    def _emit_op(self, table, expressions, namespace, index, a, b) -> str:
+        op = table[index]
+        if op in expressions:
+            return expressions[op].format(a=a, b=b)
+        name = "op{}".format(len(namespace))
+        namespace[name] = op
+        return "{}({}, {})".format(name, a, b)
+
+    def compile_block(self, mem, start):
+        instrs = self._scan(mem, start)
+        if not instrs:
+            return None
+        namespace = {"BlockExit": BlockExit}
+        lines = ["def block(cpu, r, mem):"]
+        nextpc = start
+        for count, (pc, d) in enumerate(instrs, start=1):
+            rs1    = "r[{}]".format(d.rs1)
+            rs2    = "r[{}]".format(d.rs2)
+            nextpc = (pc + 4) & MASK32
+            opcode = d.opcode
+            if opcode == ALU_OPCODE:
+                expr = self._emit_op(self.alu_ops, ALU_EXPRESSIONS, namespace,
+                                     (d.funct7 << 3) | d.funct3, rs1, rs2)
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, expr)
+            elif opcode == ALU_IMMED_OPCODE:
+                expr = self._emit_op(self.alu_immed_ops, ALU_EXPRESSIONS, namespace,
+                                     (d.funct7 << 3) | d.funct3, rs1, str(d.imm & MASK32))
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, expr)
+            elif opcode == LOAD_UPPER_OPCODE:
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, str(d.imm))
+            elif opcode == AUIPC_OPCODE:
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, str((pc + d.imm) & MASK32))
+            elif opcode == LOAD_OPCODE:
+                name = "ld{}".format(pc)
+                namespace[name] = self.load_ops[d.funct3]
+                lines.append("    cpu.pc = {}".format(pc))
+                expr = "{}(mem, ({} + {}) & 0xFFFFFFFF)".format(name, rs1, d.imm)
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, expr)
+                else:
+                    lines.append("    " + expr)
+            elif opcode == STORE_OPCODE:
+                mode = self.store_ops[d.funct3]
+                lines.append("    cpu.pc = {}".format(pc))
+                lines.append("    mem.write(({} + {}) & 0xFFFFFFFF, {}, {!r})".format(rs1, d.imm, rs2, mode))
+                # A store into translated code flushes the block cache, stop
+                # here so the remaining instructions are refetched.
+                if count < len(instrs):
+                    lines.append("    if {} not in cpu.blocks: raise BlockExit({}, {})".format(start, nextpc, count))
+            elif opcode == BRANCH_OPCODE:
+                expr = self._emit_op(self.branch_ops, BRANCH_EXPRESSIONS, namespace,
+                                     d.funct3, rs1, rs2)
+                lines.append("    if {}: return {}".format(expr, (pc + d.imm) & MASK32))
+            elif opcode == JUMP_OPCODE:
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, str(nextpc))
+                nextpc = (pc + d.imm) & MASK32
+            elif opcode == JUMP_REG_OPCODE:
+                lines.append("    t = ({} + {}) & 0xFFFFFFFF".format(rs1, d.imm))
+                if d.rd != 0:
+                    self._emit_write(lines, namespace, pc, d.rd, str(nextpc))
+                lines.append("    return t")
+        lines.append("    return {}".format(nextpc))
+        exec("\n".join(lines), namespace)
+        # Only register-only blocks whose terminator can jump back to the
+        # start are candidates for idle loop detection.
+        last = instrs[-1][1]
+        selfloop = last.opcode in TERMINATOR_OPCODES \
+            and all(d.opcode not in (LOAD_OPCODE, STORE_OPCODE) for _, d in instrs) \
+            and (last.opcode == JUMP_REG_OPCODE or ((instrs[-1][0] + last.imm) & MASK32) == start)
+        return (namespace["block"], len(instrs), selfloop)
+
+    def set_breakpoints(self, breakpoints) -> None:
+        # Blocks are split at breakpoints, so a new set needs new blocks.
+        breakpoints = frozenset(breakpoints)
+        if breakpoints != self.breakpoints:
+            self.breakpoints = breakpoints
+            self.flush_blocks()
+
+    def run(self, mem, csr, max_instructions=None, breakpoints=frozenset(),
+            until_ecall=False, until_idle=False) -> tuple:
+        if self._hooked is not mem:
+            self.flush_blocks()
+            mem.invalidation_hooks.append(self.flush_blocks)
+            self._hooked = mem
+        self.set_breakpoints(breakpoints)
+        breakpoints = self.breakpoints
+        blocks    = self.blocks
+        registers = self.registers
+        limit     = sys.maxsize if max_instructions is None else max_instructions
+        base      = csr.retired
+        retired   = 0
+        try:
+            while retired < limit:
+                pc = self.pc
+                if retired and pc in breakpoints:
+                    return retired, STOP_BREAKPOINT
+                block = blocks.get(pc)
+                if block is None:
+                    block = self.compile_block(mem, pc)
+                    if block is None:
+                        # Not translatable, execute through the dispatch table.
+                        block = (None, 1, False)
+                    blocks[pc] = block
+                fn, length, selfloop = block
+                if fn is None or limit - retired < length:
+                    if until_ecall and self.fetch(mem, pc).instr == ECALL_INSTRUCTION:
+                        return retired, STOP_ECALL
+                    # SYSTEM instructions always take this path, step()
+                    # counts from an up to date retired count.
+                    csr.retired = base + retired
+                    self.step(mem, csr)
+                    retired += 1
+                    if until_idle and self.pc == pc:
+                        return retired, STOP_IDLE
+                    continue
+                try:
+                    if until_idle and selfloop:
+                        # A block that branches to itself without changing any
+                        # register can never leave.
+                        before = registers[:]
+                        self.pc = fn(self, registers, mem)
+                        retired += length
+                        if self.pc == pc and registers == before:
+                            return retired, STOP_IDLE
+                    else:
+                        self.pc = fn(self, registers, mem)
+                        retired += length
+                except BlockExit as e:
+                    self.pc = e.nextpc
+                    retired += e.retired
+                except Exception:
+                    # Blocks are straight-line and set cpu.pc before every
+                    # load and store, so it holds the faulting instruction
+                    # and everything before it retired.
+                    retired += ((self.pc - pc) & MASK32) >> 2
+                    raise
+            return retired, STOP_MAX_INSTRUCTIONS
+        finally:
+            csr.retired = base + retired
@@ -0,0 +1,200 @@
+import sys
+
+from rktcpu.riscv.rv32i import Rv32iModel, predecode, LOAD_MODES, STORE_MODES, \
+    ECALL_INSTRUCTION, STOP_MAX_INSTRUCTIONS, STOP_BREAKPOINT, STOP_ECALL, STOP_IDLE, \
+    BRANCH_OPCODE, LOAD_OPCODE, STORE_OPCODE, ALU_OPCODE, ALU_IMMED_OPCODE, \
+    JUMP_OPCODE, JUMP_REG_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE, \
+    FENCE_OPCODE, ECALL_OPCODE
+from rktcpu.riscv.alu import ALT_FUNCT7
+
+MASK32   = 0xFFFFFFFF
+SIGN_BIT = 0x80000000
+
+def to_signed(val) -> int:
+    return val - 0x100000000 if val & SIGN_BIT else val
+
+def _illegal(*args):
+    raise ValueError
+
+# ALU operations, each takes two 32-bit unsigned operands.
+def _add(opA, opB):  return (opA + opB) & MASK32
+def _sub(opA, opB):  return (opA - opB) & MASK32
+def _sll(opA, opB):  return (opA << (opB & 0x1F)) & MASK32
+def _slt(opA, opB):  return int(to_signed(opA) < to_signed(opB))
+def _sltu(opA, opB): return int(opA < opB)
+def _xor(opA, opB):  return opA ^ opB
+def _srl(opA, opB):  return opA >> (opB & 0x1F)
+def _sra(opA, opB):  return (to_signed(opA) >> (opB & 0x1F)) & MASK32
+def _or(opA, opB):   return opA | opB
+def _and(opA, opB):  return opA & opB
+
+BASE_ALU_OPS = [_add, _sll, _slt, _sltu, _xor, _srl, _or, _and]
+
+# Branch comparisons indexed by funct3.
+def _beq(opA, opB):  return opA == opB
+def _bne(opA, opB):  return opA != opB
+def _blt(opA, opB):  return to_signed(opA) < to_signed(opB)
+def _bge(opA, opB):  return to_signed(opA) >= to_signed(opB)
+def _bltu(opA, opB): return opA < opB
+def _bgeu(opA, opB): return opA >= opB
+
+BRANCH_OPS = [_beq, _bne, _illegal, _illegal, _blt, _bge, _bltu, _bgeu]
+
+def funct_index(funct3, funct7) -> int:
+    return (funct7 << 3) | funct3
+
+class Rv32iIntModel(Rv32iModel):
+    """Execution engine that keeps all architectural state as plain Python ints.
+
+    Produces the same register-write log as Rv32iModel while avoiding the
+    cost of boxed NumPy scalar operations on every instruction. Execution is
+    table driven: a 128-entry opcode table selects the handler, and the ALU,
+    branch, load, store and SYSTEM handlers index per-funct3/funct7 tables.
+    """
+    def __init__(self, logpath=None, enablelogging=False, logformat="csv") -> None:
+        super().__init__(logpath=logpath, enablelogging=enablelogging, logformat=logformat)
+        self.pc        = 0
+        self.registers = [0] * 32
+
+        # Register-register ops indexed by funct7 << 3 | funct3, every funct7
+        # other than 0b0100000 decodes as the base operation.
+        self.alu_ops = [BASE_ALU_OPS[i & 0x7] for i in range(1024)]
+        self.alu_ops[funct_index(0, ALT_FUNCT7)] = _sub
+        self.alu_ops[funct_index(5, ALT_FUNCT7)] = _sra
+        # Register-immediate ops, funct7 only selects between the shifts.
+        self.alu_immed_ops = list(self.alu_ops)
+        self.alu_immed_ops[funct_index(0, ALT_FUNCT7)] = _add
+
+        self.branch_ops = list(BRANCH_OPS)
+        self.load_ops   = [self._load_op(LOAD_MODES.get(i)) for i in range(8)]
+        self.store_ops  = [STORE_MODES.get(i) for i in range(8)]
+        self.system_ops = [self._system_ecall] + [self._system_csr] * 7
+        self.system_ops[4] = _illegal
+
+    def register_alu_op(self, funct3, funct7, op, immediate=False) -> None:
+        """Install op(opA, opB) for an ALU_OPCODE (or ALU_IMMED_OPCODE) funct pair."""
+        table = self.alu_immed_ops if immediate else self.alu_ops
+        table[funct_index(funct3, funct7)] = op
+
+    def _load_op(self, mode):
+        if mode is None:
+            return _illegal
+        mode, signbits = mode
+        if signbits is None:
+            return lambda mem, addr: mem.read(addr, mode)
+        sign_bit = 1 << (signbits - 1)
+        return lambda mem, addr: ((mem.read(addr, mode) ^ sign_bit) - sign_bit) & MASK32
+
+    def get_registers(self) -> list:
+        return list(self.registers)
+
+    def set_registers(self, values) -> None:
+        # In place, translated blocks hold on to the list.
+        self.registers[:] = [int(value) for value in values]
+
+    def write_register(self, rd, res) -> None:
+        if rd != 0:
+            self.registers[rd] = res
+            if self.log is not None:
+                self.log.write(self.pc, rd, res)
+
+    def alu(self, opA, opB, funct3, funct7=None):
+        if funct7 is None:
+            return self.alu_immed_ops[funct3](opA, opB)
+        return self.alu_ops[funct_index(funct3, funct7)](opA, opB)
+
+    def branch(self, opA, opB, funct3) -> bool:
+        return self.branch_ops[funct3](opA, opB)
+
+    def _exec_alu(self, decoded, mem, csr):
+        registers = self.registers
+        res = self.alu_ops[(decoded.funct7 << 3) | decoded.funct3](registers[decoded.rs1], registers[decoded.rs2])
+        self.write_register(decoded.rd, res)
+        return self.pc + 4
+
+    def _exec_alu_immed(self, decoded, mem, csr):
+        res = self.alu_immed_ops[(decoded.funct7 << 3) | decoded.funct3](self.registers[decoded.rs1], decoded.imm & MASK32)
+        self.write_register(decoded.rd, res)
+        return self.pc + 4
+
+    def _exec_load(self, decoded, mem, csr):
+        addr = (self.registers[decoded.rs1] + decoded.imm) & MASK32
+        self.write_register(decoded.rd, self.load_ops[decoded.funct3](mem, addr))
+        return self.pc + 4
+
+    def _exec_store(self, decoded, mem, csr):
+        mode = self.store_ops[decoded.funct3]
+        if mode is None:
+            raise ValueError
+        addr = (self.registers[decoded.rs1] + decoded.imm) & MASK32
+        mem.write(addr, self.registers[decoded.rs2], mode)
+        return self.pc + 4
+
+    def _exec_auipc(self, decoded, mem, csr):
+        self.write_register(decoded.rd, (self.pc + decoded.imm) & MASK32)
+        return self.pc + 4
+
+    def _exec_load_upper(self, decoded, mem, csr):
+        self.write_register(decoded.rd, decoded.imm)
+        return self.pc + 4
+
+    def _exec_jump(self, decoded, mem, csr):
+        self.write_register(decoded.rd, self.pc + 4)
+        return (self.pc + decoded.imm) & MASK32
+
+    def _exec_jump_reg(self, decoded, mem, csr):
+        target = (self.registers[decoded.rs1] + decoded.imm) & MASK32
+        self.write_register(decoded.rd, self.pc + 4)
+        return target
+
+    def _exec_branch(self, decoded, mem, csr):
+        registers = self.registers
+        if self.branch_ops[decoded.funct3](registers[decoded.rs1], registers[decoded.rs2]):
+            return (self.pc + decoded.imm) & MASK32
+        return self.pc + 4
+
+    def _exec_system(self, decoded, mem, csr):
+        return self.system_ops[decoded.funct3](decoded, mem, csr)
+
+    def _system_ecall(self, decoded, mem, csr):
+        return self.pc + 4
+
+    def _system_csr(self, decoded, mem, csr):
+        self.write_register(decoded.rd, csr.zicsr(decoded, self.registers[decoded.rs1]))
+        return self.pc + 4
+
+    def step(self, mem, csr) -> None:
+        decoded = mem.decoded.get(self.pc)
+        if decoded is None:
+            decoded = self.fetch(mem, self.pc)
+        self.pc = self.opcodes[decoded.opcode](decoded, mem, csr)
+        csr.retired += 1
+
+    def run(self, mem, csr, max_instructions=None, breakpoints=frozenset(),
+            until_ecall=False, until_idle=False) -> tuple:
+        cache    = mem.decoded
+        opcodes  = self.opcodes
+        limit    = sys.maxsize if max_instructions is None else max_instructions
+        base     = csr.retired
+        retired  = 0
+        try:
+            while retired < limit:
+                pc = self.pc
+                decoded = cache.get(pc)
+                if decoded is None:
+                    decoded = self.fetch(mem, pc)
+                if breakpoints and retired and pc in breakpoints:
+                    return retired, STOP_BREAKPOINT
+                if decoded.opcode == ECALL_OPCODE:
+                    if until_ecall and decoded.instr == ECALL_INSTRUCTION:
+                        return retired, STOP_ECALL
+                    # The CSR counters are only brought up to date when they
+                    # can be observed.
+                    csr.retired = base + retired
+                self.pc = opcodes[decoded.opcode](decoded, mem, csr)
+                retired += 1
+                if until_idle and self.pc == pc:
+                    return retired, STOP_IDLE
+            return retired, STOP_MAX_INSTRUCTIONS
+        finally:
+            csr.retired = base + retired
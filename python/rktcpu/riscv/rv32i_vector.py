@@ -0,0 +1,308 @@
+import numpy as np
+
+from rktcpu.riscv.rv32i import STOP_MAX_INSTRUCTIONS, STOP_ECALL, STOP_IDLE, ECALL_INSTRUCTION, \
+    BRANCH_OPCODE, LOAD_OPCODE, STORE_OPCODE, ALU_OPCODE, ALU_IMMED_OPCODE, \
+    JUMP_OPCODE, JUMP_REG_OPCODE, LOAD_UPPER_OPCODE, AUIPC_OPCODE, FENCE_OPCODE, ECALL_OPCODE
+from rktcpu.riscv.alu import ALT_FUNCT7, ALU_OPS, ALU_OP_NAMES, alu_op
+from rktcpu.trace import TRACE_DTYPE, CSV_HEADER, CSV_RECORD, open_trace
+
+# Instance stopped on a fetch outside its memory, a misaligned or out of
+# range access, an illegal instruction or a CSR access (not modelled).
+STOP_FAULT = "fault"
+
+# Stop codes of Rv32iVectorModel.stopped, 0 is still running.
+STOP_REASONS = (None, STOP_ECALL, STOP_IDLE, STOP_FAULT)
+_ECALL, _IDLE, _FAULT = 1, 2, 3
+
+DEFAULT_MEMORY_BYTES = 1 << 13
+
+# Instances are grouped each step by a key, the ALU_OP_NAMES index for
+# ALU_OPCODE and ALU_IMMED_OPCODE or one of the kinds below.
+_FAULT_KIND, _LOAD, _STORE, _BRANCH, _JAL, _JALR, _LUI, _AUIPC, _NOP, _SYSTEM = range(16, 26)
+_KEYS = 26
+
+_OPCODE_KINDS = {LOAD_OPCODE: _LOAD, STORE_OPCODE: _STORE, BRANCH_OPCODE: _BRANCH, JUMP_OPCODE: _JAL,
+                 JUMP_REG_OPCODE: _JALR, LOAD_UPPER_OPCODE: _LUI, AUIPC_OPCODE: _AUIPC,
+                 FENCE_OPCODE: _NOP, ECALL_OPCODE: _SYSTEM}
+
+def _key(opcode, alt, funct3) -> int:
+    # alt is funct7 == ALT_FUNCT7, which only matters for SUB and SRA(I).
+    funct7 = ALT_FUNCT7 if alt else 0
+    if opcode == ALU_OPCODE:
+        return ALU_OP_NAMES.index(alu_op(funct3, funct7))
+    if opcode == ALU_IMMED_OPCODE:
+        return ALU_OP_NAMES.index(alu_op(funct3, funct7 if funct3 == 5 else None))
+    return _OPCODE_KINDS.get(opcode, _FAULT_KIND)
+
+# Indexed by opcode << 4 | alt << 3 | funct3.
+_KEY_TABLE = np.array([_key(index >> 4, (index >> 3) & 1, index & 7) for index in range(128 << 4)], dtype=np.uint8)
+
+# Load funct3 -> value mask and sign bit, 0 marks an illegal funct3.
+_LOAD_MASK = np.array([0xFF, 0xFFFF, 0xFFFFFFFF, 0, 0xFF, 0xFFFF, 0, 0], dtype=np.uint32)
+_LOAD_SIGN = np.array([0x80, 0x8000, 0, 0, 0, 0, 0, 0], dtype=np.uint32)
+_STORE_MASK = np.array([0xFF, 0xFFFF, 0xFFFFFFFF, 0, 0, 0, 0, 0], dtype=np.uint32)
+
+def _select(mask, a, b) -> np.ndarray:
+    # np.where(mask, a, b) without a branch per element, several times
+    # faster on the unpredictable masks of random programs.
+    ones = np.negative(mask.view(np.uint8), dtype=np.uint32)
+    return b ^ ((a ^ b) & ones)
+
+def _sign(instr) -> np.ndarray:
+    # All ones where bit 31 is set.
+    return (instr.view(np.int32) >> 31).view(np.uint32)
+
+def _imm_i(instr) -> np.ndarray:
+    return (instr.view(np.int32) >> 20).view(np.uint32)
+
+def _imm_s(instr) -> np.ndarray:
+    return (_imm_i(instr) & np.uint32(0xFFFFFFE0)) | ((instr >> 7) & 0x1F)
+
+def _imm_b(instr) -> np.ndarray:
+    return (_sign(instr) << 12) | ((instr >> 7) & 0x1) << 11 | ((instr >> 25) & 0x3F) << 5 | ((instr >> 8) & 0xF) << 1
+
+def _imm_j(instr) -> np.ndarray:
+    return (_sign(instr) << 20) | (instr & 0xFF000) | ((instr >> 20) & 0x1) << 11 | ((instr >> 21) & 0x3FF) << 1
+
+def _misaligned(masks) -> np.ndarray:
+    # Indexed by funct3 << 2 | addr & 3: an illegal funct3, a misaligned word
+    # or a halfword across words, the accesses PagedMemory rejects.
+    bad = np.zeros(32, dtype=bool)
+    for funct3, mask in enumerate(masks.tolist()):
+        for offset in range(4):
+            bad[funct3 << 2 | offset] = mask == 0 or (mask == 0xFFFFFFFF and offset) or (mask == 0xFFFF and offset == 3)
+    return bad
+
+_LOAD_MISALIGNED  = _misaligned(_LOAD_MASK)
+_STORE_MISALIGNED = _misaligned(_STORE_MASK)
+
+def _mark(stop, count, lo, select, code) -> np.ndarray:
+    # Set code for the selected instances of the group starting at lo, the
+    # stop array is only allocated on the first stop of a step.
+    if stop is None:
+        stop = np.zeros(count, dtype=np.uint8)
+    stop[lo:lo + len(select)][select] = code
+    return stop
+
+class Rv32iVectorModel():
+    """count independent RV32I instances executed in lockstep with NumPy.
+
+    Each instance owns a flat memory of memory_bytes starting at address 0
+    and a pc in a (count,) array. Memory and registers are (words, count)
+    and (32, count) arrays, instance-minor so that the gathers and scatters
+    of a step walk them in ascending instance order. Every step fetches and
+    decodes the instruction of all running instances, sorts them by
+    operation and executes each group as one slice. The register writes are the ones
+    Rv32iIntModel would log, instances stop on an ecall (before it
+    retires), a jump to self (after it retires) or a fault, where the int
+    engine would raise.
+    """
+    def __init__(self, count, memory_bytes=DEFAULT_MEMORY_BYTES, trace=True) -> None:
+        if memory_bytes % 4:
+            raise ValueError("memory_bytes must be a multiple of 4")
+        self.count     = count
+        self.words     = memory_bytes // 4
+        self.pc        = np.zeros(count, dtype=np.uint32)
+        # Row 32 takes the results that are not written, so that the write
+        # back is one unconditional scatter. Writes to x0 land in row 0,
+        # which is cleared after every step.
+        self._regs     = np.zeros((33, count), dtype=np.uint32)
+        self.registers = self._regs[:32]
+        self.memory    = np.zeros((self.words, count), dtype=np.uint32)
+        self.retired   = np.zeros(count, dtype=np.int64)
+        self.stopped   = np.zeros(count, dtype=np.uint8)
+        self.trace     = trace
+        # Register writes as (instance, pc, rd, res) arrays, one per step.
+        self._writes   = list()
+
+    def load(self, programs, addr=0) -> None:
+        """Copy programs, a (count, words) array or one image for every instance, to addr."""
+        programs = np.asarray(programs, dtype=np.uint32)
+        if addr % 4 or addr // 4 + programs.shape[-1] > self.words:
+            raise ValueError("Program does not fit the instance memory")
+        start = addr // 4
+        self.memory[start:start + programs.shape[-1]] = programs.T if programs.ndim == 2 else programs[:, None]
+
+    def stop_reasons(self) -> list:
+        return [STOP_REASONS[code] or STOP_MAX_INSTRUCTIONS for code in self.stopped.tolist()]
+
+    def run(self, max_instructions=None, until_idle=True) -> int:
+        """Step every running instance until it stops or retires max_instructions more, returns the total retired."""
+        before = int(self.retired.sum())
+        steps  = 0
+        active = np.flatnonzero(self.stopped == 0)
+        while len(active) and (max_instructions is None or steps < max_instructions):
+            halted = self._step(active, until_idle)
+            if halted is not None:
+                # Stopped instances retired every earlier step, and this
+                # one too for a jump to self.
+                instances, codes = halted
+                self.stopped[instances] = codes
+                self.retired[instances] += steps + (codes == _IDLE)
+                active = active[self.stopped[active] == 0]
+            steps += 1
+        self.retired[active] += steps
+        return int(self.retired.sum()) - before
+
+    def _step(self, act, until_idle):
+        """Execute one instruction of the instances act, returns (instances, stop codes) of those that stopped."""
+        count  = self.count
+        memory = self.memory.reshape(-1)
+        regs   = self._regs.reshape(-1)
+        pc     = self.pc[act]
+        word   = pc >> 2
+        fetch  = ((pc & 3) == 0) & (word < self.words)
+        bad_fetch = not fetch.all()
+        if bad_fetch:
+            word[~fetch] = 0
+        instr  = memory[word * count + act]
+        rs1v   = regs[((instr >> 15) & 0x1F) * count + act]
+        rs2v   = regs[((instr >> 20) & 0x1F) * count + act]
+        funct3 = (instr >> 12) & 0x7
+        key    = _KEY_TABLE[((instr & 0x7F) << 4) | (((instr >> 25) == ALT_FUNCT7).view(np.uint8) << 3) | funct3]
+        if bad_fetch:
+            key[~fetch] = _FAULT_KIND
+
+        # Sort by key (a radix sort for uint8), each group is then a slice.
+        # The big arrays are only read and written above and below in
+        # ascending instance order, the sort permutes the step's own arrays.
+        order  = np.argsort(key, kind="stable")
+        key    = key[order]
+        bounds = np.searchsorted(key, np.arange(_KEYS + 1)).tolist()
+        sact   = act[order]
+        instr  = instr[order]
+        funct3 = funct3[order]
+        pc     = pc[order]
+        rs1v   = rs1v[order]
+        rs2v   = rs2v[order]
+        n      = len(act)
+        rd     = (instr >> 7) & 0x1F
+        nextpc = pc + np.uint32(4)
+        res    = np.zeros(n, dtype=np.uint32)
+        rows   = np.full(n, 32, dtype=np.uint32)
+        stop   = None
+
+        for k in range(_KEYS):
+            lo, hi = bounds[k], bounds[k + 1]
+            if lo == hi:
+                continue
+            s = slice(lo, hi)
+            i = instr[s]
+            if k < _FAULT_KIND:
+                # Bit 5 of the opcode tells ALU_OPCODE from ALU_IMMED_OPCODE.
+                opB = _select((i & 0x20) != 0, rs2v[s], _imm_i(i))
+                res[s] = ALU_OPS[ALU_OP_NAMES[k]](rs1v[s], opB)
+                rows[s] = rd[s]
+            elif k == _LOAD:
+                f3   = funct3[s]
+                addr = rs1v[s] + _imm_i(i)
+                mask = _LOAD_MASK[f3]
+                bad  = _LOAD_MISALIGNED[(f3 << 2) | (addr & 3)] | (addr >= 4 * self.words)
+                index = addr >> 2
+                if bad.any():
+                    index[bad] = 0
+                    stop = _mark(stop, n, lo, bad, _FAULT)
+                data = (memory[index * count + sact[s]] >> ((addr & 3) << 3)) & mask
+                sign = _LOAD_SIGN[f3]
+                res[s] = (data ^ sign) - sign
+                rows[s] = rd[s]
+            elif k == _STORE:
+                addr = rs1v[s] + _imm_s(i)
+                f3   = funct3[s]
+                mask = _STORE_MASK[f3]
+                data = rs2v[s]
+                instances = sact[s]
+                bad  = _STORE_MISALIGNED[(f3 << 2) | (addr & 3)] | (addr >= 4 * self.words)
+                if bad.any():
+                    stop = _mark(stop, n, lo, bad, _FAULT)
+                    ok = ~bad
+                    addr, mask, data, instances = addr[ok], mask[ok], data[ok], instances[ok]
+                # Read-modify-write of one word per instance, the indices are unique.
+                shift = (addr & 3) << 3
+                where = (addr >> 2) * count + instances
+                mask  = mask << shift
+                memory[where] = (memory[where] & ~mask) | ((data << shift) & mask)
+            elif k == _BRANCH:
+                f3 = funct3[s]
+                a, b = rs1v[s], rs2v[s]
+                cond = f3 >> 1
+                taken = _select(cond == 0, a == b, _select(cond == 2, a.view(np.int32) < b.view(np.int32), a < b))
+                nextpc[s] = _select((taken ^ (f3 & 1)).astype(bool), pc[s] + _imm_b(i), nextpc[s])
+                if (cond == 1).any():
+                    stop = _mark(stop, n, lo, cond == 1, _FAULT)
+            elif k == _JAL:
+                res[s] = nextpc[s]
+                rows[s] = rd[s]
+                nextpc[s] = pc[s] + _imm_j(i)
+            elif k == _JALR:
+                res[s] = nextpc[s]
+                rows[s] = rd[s]
+                nextpc[s] = rs1v[s] + _imm_i(i)
+            elif k == _LUI:
+                res[s] = i & np.uint32(0xFFFFF000)
+                rows[s] = rd[s]
+            elif k == _AUIPC:
+                res[s] = pc[s] + (i & np.uint32(0xFFFFF000))
+                rows[s] = rd[s]
+            elif k == _SYSTEM:
+                # ecall stops before it retires, other funct3 == 0 encodings
+                # are no-ops as in the int engine, the CSRs are not modelled.
+                stop = _mark(stop, n, lo, i == ECALL_INSTRUCTION, _ECALL)
+                stop = _mark(stop, n, lo, (i != ECALL_INSTRUCTION) & (funct3[s] != 0), _FAULT)
+            elif k == _FAULT_KIND:
+                stop = _mark(stop, n, lo, np.ones(hi - lo, dtype=bool), _FAULT)
+
+        if stop is not None:
+            go = stop == 0
+            rows[~go] = 32
+            nextpc = _select(go, nextpc, pc)
+        if self.trace:
+            # Rows 1 to 31 are the logged writes.
+            index = np.flatnonzero((rows - np.uint32(1)) < 31)
+            if len(index):
+                self._writes.append((sact[index], pc[index], rows[index].astype(np.uint8), res[index]))
+        if until_idle:
+            idle = nextpc == pc
+            if stop is not None:
+                idle &= stop == 0
+            if idle.any():
+                stop = _mark(stop, n, 0, idle, _IDLE)
+
+        # Back to instance order for the write back.
+        out = np.empty(n, dtype=np.uint32)
+        out[order] = rows
+        index = out * count + act
+        out[order] = res
+        regs[index] = out
+        self._regs[0] = 0
+        out[order] = nextpc
+        self.pc[act] = out
+        if stop is None:
+            return None
+        halted = np.flatnonzero(stop)
+        return sact[halted], stop[halted]
+
+    def traces(self) -> list:
+        """Register writes of every instance as TRACE_DTYPE arrays."""
+        if not self._writes:
+            return [np.empty(0, dtype=TRACE_DTYPE) for _ in range(self.count)]
+        instance = np.concatenate([w[0] for w in self._writes])
+        records = np.empty(len(instance), dtype=TRACE_DTYPE)
+        records["pc"]  = np.concatenate([w[1] for w in self._writes])
+        records["rd"]  = np.concatenate([w[2] for w in self._writes])
+        records["res"] = np.concatenate([w[3] for w in self._writes])
+        # The writes are in step order, a stable sort keeps it per instance.
+        order = np.argsort(instance, kind="stable")
+        ends = np.cumsum(np.bincount(instance, minlength=self.count))
+        return np.split(records[order], ends[:-1])
+
+    def write_trace(self, path, records, fmt="csv") -> None:
+        """Write one instance's records from traces() as a golden log."""
+        if fmt == "csv":
+            with open(path, "w") as f:
+                f.write(CSV_HEADER)
+                f.write("".join(CSV_RECORD % record for record in records.tolist()))
+        else:
+            sink = open_trace(path, fmt)
+            sink.write_array(records)
+            sink.close()
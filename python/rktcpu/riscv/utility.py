@@ -5,7 +5,7 @@ def sign_extend(value, bits):
     return (value & (sign_bit - 1)) - (value & sign_bit)
 
 def sll(val, n):
-    return (val << n) & (1 << np.iinfo(type(val)).bits - 1)
+    return (val << n) & 0xFFFFFFFF
 
 def srl(val, n): 
     return (val % 0x100000000) >> n
@@ -0,0 +1,106 @@
+import os
+import pathlib
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+
+from rktcpu.model import RktCpuModel
+from rktcpu.compare import compare_traces, format_report
+from rktcpu.goldencache import golden_key
+
+# Golden runs are kept going through idle loops since the golden log has
+# to cover the whole HDL run.
+DEFAULT_MAX_INSTRUCTIONS = 2000
+
+GOLDEN_SETTINGS = {
+    "enablelogging" : True,
+    "logformat"     : "bin",
+    "startingaddr"  : 0,
+    "engine"        : "block",
+    "memory"        : "paged"
+}
+
+@dataclass
+class TestResult:
+    name       : str
+    retired    : int = 0
+    reason     : str = None
+    compared   : int = 0
+    mismatches : int = 0
+    hdl_log    : bool = False
+    passed     : bool = False
+    elapsed    : float = 0.0
+    cached     : bool = False
+    report     : str = ""
+
+def run_test(hexpath, logdir="tests/logs", max_instructions=DEFAULT_MAX_INSTRUCTIONS,
+             settings=None, cache=None) -> TestResult:
+    """Generate the golden log of one program and compare it with the HDL log if present.
+
+    With a GoldenCache, the golden log is only generated when no trace of
+    the same image, settings and model source is cached.
+    """
+    start = time.perf_counter()
+    name = pathlib.Path(hexpath).stem
+    result = TestResult(name=name)
+    try:
+        golden = os.path.join(logdir, "{}_golden.bin".format(name))
+        settings = dict(GOLDEN_SETTINGS, **(settings or {}))
+        key  = None if cache is None else golden_key(hexpath, settings, max_instructions)
+        info = None if cache is None else cache.get(key, golden)
+        if info is None:
+            model = RktCpuModel(dict(settings, logpath=golden, hexpath=hexpath))
+            run = model.run(max_instructions=max_instructions, until_idle=False)
+            model.close()
+            info = {"retired": run.retired, "reason": run.reason}
+            if cache is not None:
+                cache.put(key, golden, info)
+        else:
+            result.cached = True
+        result.retired = info["retired"]
+        result.reason  = info["reason"]
+
+        output = os.path.join(logdir, "{}.csv".format(name))
+        result.hdl_log = os.path.exists(output)
+        if result.hdl_log:
+            comparison = compare_traces(output, golden)
+            result.compared   = comparison.compared
+            result.mismatches = comparison.mismatches
+            result.passed     = comparison.passed
+            result.report     = format_report(comparison)
+        else:
+            result.passed = True
+    except Exception:
+        result.report = traceback.format_exc()
+    result.elapsed = time.perf_counter() - start
+    return result
+
+def run_tests(tests, logdir="tests/logs", workers=None, max_instructions=DEFAULT_MAX_INSTRUCTIONS,
+              settings=None, cache=None) -> list:
+    """Run every program through run_test on a pool of workers, in the order given."""
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_test, test, logdir, max_instructions, settings, cache) for test in tests]
+        results = [future.result() for future in futures]
+    if cache is not None:
+        cache.evict()
+    return results
+
+def summarize(results, elapsed=None) -> str:
+    lines = ["{:<10} {:>9} {:<18} {:>9} {:>10} {:>8}  {}".format(
+        "test", "retired", "reason", "compared", "mismatches", "time", "status")]
+    for r in results:
+        status = "PASS" if r.passed else "FAIL"
+        if r.passed and not r.hdl_log:
+            status = "NO HDL LOG"
+        lines.append("{:<10} {:>9} {:<18} {:>9} {:>10} {:>7.3f}s  {}".format(
+            r.name, r.retired, str(r.reason), r.compared, r.mismatches, r.elapsed, status))
+    failed = sum(not r.passed for r in results)
+    lines.append("{} tests, {} failed, {} golden logs cached, {:.3f} s in workers".format(
+        len(results), failed, sum(r.cached for r in results), sum(r.elapsed for r in results)))
+    if elapsed is not None:
+        lines[-1] += ", {:.3f} s wall".format(elapsed)
+    return "\n".join(lines)
+
+def exit_code(results) -> int:
+    return 0 if all(r.passed for r in results) else 1
@@ -0,0 +1,103 @@
+import struct
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+# Snapshot files hold a header followed by the snapshots in order.
+SNAPSHOT_MAGIC   = b"RKTSNAP\0"
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER  = struct.Struct("<8sII")
+# retired, pc, x0..x31, mcycle and minstret offsets, csr count, memory kind
+SNAPSHOT_RECORD  = struct.Struct("<QI32IQQIB")
+CSR_ENTRY        = struct.Struct("<HI")
+# pagenum, flags, compressed length
+PAGE_ENTRY       = struct.Struct("<IBI")
+WORDS_ENTRY      = struct.Struct("<II")
+
+MEMORY_PAGED = 0
+MEMORY_DICT  = 1
+
+# Page flag for a page that is identical to the one in the previous snapshot.
+PAGE_SHARED = 1
+
+MASK64 = 0xFFFFFFFFFFFFFFFF
+
+@dataclass
+class Snapshot:
+    retired   : int
+    pc        : int
+    registers : list
+    csr       : tuple
+    memory    : dict
+    paged     : bool = True
+
+def _write_snapshot(f, snapshot, previous) -> None:
+    registers, retired, offsets = snapshot.csr
+    f.write(SNAPSHOT_RECORD.pack(
+        snapshot.retired, snapshot.pc, *snapshot.registers,
+        offsets["mcycle"] & MASK64, offsets["minstret"] & MASK64,
+        len(registers), MEMORY_PAGED if snapshot.paged else MEMORY_DICT
+    ))
+    f.write(b"".join(CSR_ENTRY.pack(addr, value) for addr, value in registers.items()))
+    if snapshot.paged:
+        f.write(struct.pack("<I", len(snapshot.memory)))
+        for pagenum, data in sorted(snapshot.memory.items()):
+            if previous is not None and previous.get(pagenum) is data:
+                f.write(PAGE_ENTRY.pack(pagenum, PAGE_SHARED, 0))
+            else:
+                packed = zlib.compress(data)
+                f.write(PAGE_ENTRY.pack(pagenum, 0, len(packed)))
+                f.write(packed)
+    else:
+        words = np.array(sorted(snapshot.memory.items()), dtype="<u4").reshape(-1, 2)
+        packed = zlib.compress(words.tobytes())
+        f.write(WORDS_ENTRY.pack(len(words), len(packed)))
+        f.write(packed)
+
+def _read_snapshot(f, previous) -> Snapshot:
+    fields = SNAPSHOT_RECORD.unpack(f.read(SNAPSHOT_RECORD.size))
+    retired, pc = fields[0], fields[1]
+    registers = list(fields[2:34])
+    mcycle, minstret, csrcount, kind = fields[34:]
+    csr = dict(CSR_ENTRY.iter_unpack(f.read(CSR_ENTRY.size * csrcount)))
+    offsets = {"mcycle": mcycle, "minstret": minstret}
+    memory = dict()
+    if kind == MEMORY_PAGED:
+        count, = struct.unpack("<I", f.read(4))
+        for _ in range(count):
+            pagenum, flags, length = PAGE_ENTRY.unpack(f.read(PAGE_ENTRY.size))
+            if flags & PAGE_SHARED:
+                memory[pagenum] = previous[pagenum]
+            else:
+                memory[pagenum] = zlib.decompress(f.read(length))
+    elif kind == MEMORY_DICT:
+        count, length = WORDS_ENTRY.unpack(f.read(WORDS_ENTRY.size))
+        words = np.frombuffer(zlib.decompress(f.read(length)), dtype="<u4").reshape(count, 2)
+        memory = dict(words.tolist())
+    else:
+        raise ValueError("Unknown snapshot memory kind: {}".format(kind))
+    return Snapshot(retired=retired, pc=pc, registers=registers, csr=(csr, retired, offsets),
+                    memory=memory, paged=kind == MEMORY_PAGED)
+
+def save_snapshots(path, snapshots) -> None:
+    """Write snapshots to path, pages shared with the previous snapshot are stored once."""
+    with open(path, "wb") as f:
+        f.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, SNAPSHOT_VERSION, len(snapshots)))
+        previous = None
+        for snapshot in snapshots:
+            _write_snapshot(f, snapshot, previous)
+            previous = snapshot.memory if snapshot.paged else None
+
+def load_snapshots(path) -> list:
+    with open(path, "rb") as f:
+        magic, version, count = SNAPSHOT_HEADER.unpack(f.read(SNAPSHOT_HEADER.size))
+        if magic != SNAPSHOT_MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError("{} is not a version {} snapshot file".format(path, SNAPSHOT_VERSION))
+        snapshots = []
+        previous = None
+        for _ in range(count):
+            snapshot = _read_snapshot(f, previous)
+            snapshots.append(snapshot)
+            previous = snapshot.memory if snapshot.paged else None
+        return snapshots
@@ -0,0 +1,172 @@
+import collections
+import itertools
+import os
+import struct
+from array import array
+
+import numpy as np
+
+# Binary traces start with a small header followed by packed fixed-size records.
+TRACE_MAGIC   = b"RKTTRACE"
+TRACE_VERSION = 1
+TRACE_HEADER  = struct.Struct("<8sII")
+TRACE_DTYPE   = np.dtype([("pc", "<u4"), ("rd", "u1"), ("res", "<u4")])
+
+CSV_HEADER = "pc,rd,res,\n"
+CSV_RECORD = "0x%08X,0x%02X,0x%08X,\n"
+
+# Records buffered by a sink before they are written out.
+DEFAULT_CHUNK = 1 << 16
+
+class CsvTraceSink():
+    """Register-write trace in the original pc,rd,res CSV format."""
+    def __init__(self, path, chunk=DEFAULT_CHUNK) -> None:
+        self.file = open(path, "w", buffering=1 << 20)
+        self.file.write(CSV_HEADER)
+
+    def write(self, pc, rd, res) -> None:
+        self.file.write(CSV_RECORD % (pc, rd, res))
+
+    def inline(self, pc, rd, expr, namespace) -> str:
+        # Used by the block translator, the pc and rd fields are formatted once.
+        namespace["csv_write"] = self.file.write
+        return "csv_write({!r} % {})".format("0x%08X,0x%02X,0x%%08X,\n" % (pc, rd), expr)
+
+    def flush(self) -> None:
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+class BinaryTraceSink():
+    """Register-write trace as packed TRACE_DTYPE records, written in chunks."""
+    def __init__(self, path, chunk=DEFAULT_CHUNK) -> None:
+        self.file    = open(path, "wb")
+        self.chunk   = chunk
+        self.records = list()
+        self.file.write(TRACE_HEADER.pack(TRACE_MAGIC, TRACE_VERSION, TRACE_DTYPE.itemsize))
+
+    def write(self, pc, rd, res) -> None:
+        self.records.append((pc, rd, res))
+        if len(self.records) >= self.chunk:
+            self.flush()
+
+    def inline(self, pc, rd, expr, namespace) -> str:
+        namespace["trace_write"] = self.write
+        return "trace_write({}, {}, {})".format(pc, rd, expr)
+
+    def write_array(self, records) -> None:
+        self.flush()
+        np.asarray(records, dtype=TRACE_DTYPE).tofile(self.file)
+
+    def flush(self) -> None:
+        if not self.records:
+            return
+        words = np.frombuffer(array("I", itertools.chain.from_iterable(self.records)), dtype=np.uint32)
+        words = words.reshape(-1, 3)
+        out = np.empty(len(words), dtype=TRACE_DTYPE)
+        out["pc"]  = words[:, 0]
+        out["rd"]  = words[:, 1]
+        out["res"] = words[:, 2]
+        out.tofile(self.file)
+        self.records.clear()
+        self.file.flush()
+
+    def close(self) -> None:
+        self.flush()
+        self.file.close()
+
+class QueueTraceSink():
+    """Register writes kept in a deque for a consumer in the same process."""
+    def __init__(self) -> None:
+        self.records = collections.deque()
+
+    def write(self, pc, rd, res) -> None:
+        self.records.append((pc, rd, res))
+
+    def inline(self, pc, rd, expr, namespace) -> str:
+        namespace["queue_append"] = self.records.append
+        return "queue_append(({}, {}, {}))".format(pc, rd, expr)
+
+    def flush(self) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+TRACE_FORMATS = {
+    "csv" : CsvTraceSink,
+    "bin" : BinaryTraceSink,
+}
+
+def open_trace(path, fmt="csv", chunk=DEFAULT_CHUNK):
+    if fmt not in TRACE_FORMATS:
+        raise ValueError("Unknown trace format: {}".format(fmt))
+    return TRACE_FORMATS[fmt](path, chunk=chunk)
+
+def is_binary_trace(path) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(TRACE_MAGIC)) == TRACE_MAGIC
+
+def read_binary_trace(path) -> np.ndarray:
+    """Memory map a binary trace as a TRACE_DTYPE array."""
+    with open(path, "rb") as f:
+        magic, version, itemsize = TRACE_HEADER.unpack(f.read(TRACE_HEADER.size))
+    if magic != TRACE_MAGIC or version != TRACE_VERSION or itemsize != TRACE_DTYPE.itemsize:
+        raise ValueError("{} is not a version {} binary trace".format(path, TRACE_VERSION))
+    if os.path.getsize(path) == TRACE_HEADER.size:
+        return np.empty(0, dtype=TRACE_DTYPE)
+    return np.memmap(path, dtype=TRACE_DTYPE, mode="r", offset=TRACE_HEADER.size)
+
+def iter_csv_trace(path, chunk=DEFAULT_CHUNK):
+    """Yield TRACE_DTYPE arrays of up to chunk records parsed from a CSV trace."""
+    with open(path, "r") as f:
+        f.readline()
+        while True:
+            lines = list(itertools.islice(f, chunk))
+            if not lines:
+                return
+            out = np.empty(len(lines), dtype=TRACE_DTYPE)
+            fields = [line.split(",", 3) for line in lines]
+            out["pc"]  = [int(field[0], 16) for field in fields]
+            out["rd"]  = [int(field[1], 16) for field in fields]
+            out["res"] = [int(field[2], 16) for field in fields]
+            yield out
+
+def iter_trace(path, chunk=DEFAULT_CHUNK):
+    """Yield TRACE_DTYPE arrays of up to chunk records from a trace in either format."""
+    if is_binary_trace(path):
+        records = read_binary_trace(path)
+        for i in range(0, len(records), chunk):
+            yield records[i:i + chunk]
+    else:
+        yield from iter_csv_trace(path, chunk)
+
+def read_trace(path) -> np.ndarray:
+    """Read a trace in either format as a TRACE_DTYPE array."""
+    if is_binary_trace(path):
+        return read_binary_trace(path)
+    chunks = list(iter_csv_trace(path))
+    if not chunks:
+        return np.empty(0, dtype=TRACE_DTYPE)
+    return np.concatenate(chunks)
+
+def convert(src, dst, fmt=None, chunk=DEFAULT_CHUNK) -> int:
+    """Convert a trace to the other format (or fmt) and return the record count."""
+    if is_binary_trace(src):
+        fmt = fmt or "csv"
+        records = read_binary_trace(src)
+        chunks = (records[i:i + chunk] for i in range(0, len(records), chunk))
+    else:
+        fmt = fmt or "bin"
+        chunks = iter_csv_trace(src, chunk)
+    count = 0
+    sink = open_trace(dst, fmt, chunk)
+    for records in chunks:
+        if fmt == "bin":
+            sink.write_array(records)
+        else:
+            sink.file.write("".join(CSV_RECORD % record for record in records.tolist()))
+        count += len(records)
+    sink.close()
+    return count
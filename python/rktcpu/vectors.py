@@ -0,0 +1,31 @@
+import numpy as np
+
+def format_columns(columns) -> np.ndarray:
+    """Render (values, digits, base) columns as space separated fixed-width text lines.
+
+    base is 16 or 2. Returns an (n, width) uint8 array of ASCII text that
+    ends each line with a newline, built without per-row Python work.
+    """
+    widths = [digits for _, digits, _ in columns]
+    count  = len(columns[0][0])
+    out = np.full((count, sum(widths) + len(widths)), ord(" "), dtype=np.uint8)
+    pos = 0
+    for values, digits, base in columns:
+        bits   = 4 if base == 16 else 1
+        dtype  = np.uint32 if bits * digits <= 32 else np.uint64
+        shifts = (bits * np.arange(digits - 1, -1, -1)).astype(dtype)
+        values = np.asarray(values).astype(dtype)
+        nibbles = ((values[:, None] >> shifts) & dtype(base - 1)).astype(np.uint8)
+        # ASCII without a table lookup, "A" follows "9" after 7 more characters.
+        nibbles += np.uint8(ord("0")) + np.uint8(7) * (nibbles > 9).view(np.uint8)
+        out[:, pos:pos + digits] = nibbles
+        pos += digits + 1
+    out[:, -1] = ord("\n")
+    return out
+
+def write_columns(path, columns) -> int:
+    """Write format_columns() lines to path, returns the number of lines."""
+    lines = format_columns(columns)
+    with open(path, "wb") as f:
+        f.write(lines.tobytes())
+    return len(lines)
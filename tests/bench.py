@@ -0,0 +1,56 @@
+import os
+import sys
+import glob
+import argparse
+
+path = os.path.abspath(os.path.dirname(__file__))
+RKTCPU_PATH=path + "/../python"
+sys.path.append(RKTCPU_PATH)
+
+from rktcpu.bench import (run_benchmarks, save_results, load_results, compare_results, machine_differences,
+                          format_results, DEFAULT_THRESHOLD)
+
+def report_slowdowns(baseline, current, threshold) -> int:
+    for key in machine_differences(baseline, current):
+        print("note: {} differs from the baseline: {} -> {}".format(
+            key, baseline["machine"].get(key), current["machine"].get(key)))
+    slower = compare_results(baseline, current, threshold)
+    for name, old, new, change in slower:
+        print("slowdown {}: {:.0f} -> {:.0f} ({:+.1%})".format(name, old, new, change))
+    return 1 if slower else 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput benchmarks of the golden model.",
+                                     epilog="example: python tests/bench.py run --save base.json; after a model "
+                                            "change: python tests/bench.py run --baseline base.json")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run = commands.add_parser("run", help="run the benchmarks")
+    run.add_argument("--quick", action="store_true", help="a tenth of the work, for a smoke test")
+    run.add_argument("--scale", type=float, default=1.0, help="work per benchmark relative to the defaults")
+    run.add_argument("-k", "--filter", action="append", help="only benchmarks matching this glob, e.g. 'micro/*'")
+    run.add_argument("--save", help="write the results JSON")
+    run.add_argument("--baseline", help="results JSON to compare with")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative slowdown")
+    run.add_argument("tests", nargs="*", help="hex files (default: tests/asm/test*.hex)")
+    compare = commands.add_parser("compare", help="compare two saved results")
+    compare.add_argument("baseline")
+    compare.add_argument("current")
+    compare.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="allowed relative slowdown")
+    args = parser.parse_args()
+
+    if args.command == "compare":
+        baseline, current = load_results(args.baseline), load_results(args.current)
+        print(format_results(current, baseline))
+        sys.exit(report_slowdowns(baseline, current, args.threshold))
+
+    baseline = load_results(args.baseline) if args.baseline else None
+    scale = args.scale / 10 if args.quick else args.scale
+    tests = args.tests or sorted(glob.glob("tests/asm/test*.hex"))
+    progress = lambda name, result: print("{:<32} {:>12.0f} {}/s".format(name, result["rate"], result["unit"]),
+                                          file=sys.stderr)
+    current = run_benchmarks(tests, scale=scale, patterns=args.filter, progress=progress)
+    print(format_results(current, baseline))
+    if args.save:
+        save_results(args.save, current)
+    if baseline is not None:
+        sys.exit(report_slowdowns(baseline, current, args.threshold))
@@ -0,0 +1,34 @@
+import os
+import sys
+import argparse
+
+path = os.path.abspath(os.path.dirname(__file__))
+RKTCPU_PATH=path + "/../python"
+sys.path.append(RKTCPU_PATH)
+
+from rktcpu.lockstep import run_lockstep, format_lockstep_report, DEFAULT_POLL
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Check the HDL register-write log against the model while the simulation runs.",
+        epilog="example: python tests/lockstep.py tests/asm/test006.hex tests/logs/test006.csv "
+               "-- python tests/run.py 'tb.tb_RktCpuRiscV.Test006*'")
+    parser.add_argument("hex", help="program hex file")
+    parser.add_argument("log", help="log written by RegisterWriteLogger (cLoggerPath)")
+    parser.add_argument("--fifo", action="store_true", help="create the log as a named FIFO")
+    parser.add_argument("--engine", default="int")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL, help="seconds between polls")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="stop after this many seconds without new log lines")
+    parser.add_argument("command", nargs=argparse.REMAINDER, help="simulator command, after --")
+    args = parser.parse_args()
+
+    command = args.command[1:] if args.command[:1] == ["--"] else args.command
+    if not command and args.timeout is None:
+        parser.error("a simulator command or --timeout is required")
+
+    result = run_lockstep(args.hex, args.log, command=command or None, fifo=args.fifo,
+                          settings={"engine": args.engine}, poll=args.poll, timeout=args.timeout)
+    print(format_lockstep_report(result))
+    print("PASS" if result.passed else "FAIL")
+    sys.exit(0 if result.passed else 1)
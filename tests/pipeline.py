@@ -0,0 +1,50 @@
+import os
+import sys
+import glob
+import argparse
+
+path = os.path.abspath(os.path.dirname(__file__))
+RKTCPU_PATH=path + "/../python"
+sys.path.append(RKTCPU_PATH)
+
+from rktcpu.pipeline import analyze, format_pipeline_report, write_summary, compare_summary
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CPI and stall attribution of the HDL cycle logs.",
+                                     epilog="example: python tests/pipeline.py --save cpi.csv; after an RTL "
+                                            "change: python tests/pipeline.py --baseline cpi.csv")
+    parser.add_argument("--logdir", default="tests/logs")
+    parser.add_argument("--top", type=int, default=10, help="pcs listed per test")
+    parser.add_argument("--quiet", action="store_true", help="print the summary table only")
+    parser.add_argument("--save", help="write the per-test summary CSV")
+    parser.add_argument("--baseline", help="summary CSV to compare the CPI with")
+    parser.add_argument("--tolerance", type=float, default=0.0, help="allowed relative CPI increase")
+    parser.add_argument("tests", nargs="*", help="hex files (default: tests/asm/test*.hex)")
+    args = parser.parse_args()
+
+    reports = []
+    for hexpath in args.tests or sorted(glob.glob("tests/asm/test*.hex")):
+        name = os.path.splitext(os.path.basename(hexpath))[0]
+        logpath = os.path.join(args.logdir, name + ".csv")
+        if not os.path.exists(logpath):
+            print("{}: no HDL log {}".format(name, logpath))
+            continue
+        report = analyze(logpath, hexpath, name=name, top=args.top)
+        reports.append(report)
+        if not args.quiet:
+            ref = os.path.splitext(hexpath)[0] + ".ref"
+            print(format_pipeline_report(report, ref if os.path.exists(ref) else None))
+            print()
+
+    print("{:<10} {:>10} {:>10} {:>8} {:>8} {:>10}".format("test", "retired", "cycles", "CPI", "steady", "stalls"))
+    for report in reports:
+        print("{:<10} {:>10} {:>10} {:>8.3f} {:>8.3f} {:>10}".format(
+            report.name, report.retired, report.cycles, report.cpi, report.steady_cpi, report.stall_cycles))
+
+    if args.save:
+        write_summary(args.save, reports)
+    if args.baseline:
+        regressions = compare_summary(args.baseline, reports, args.tolerance)
+        for name, old, new in regressions:
+            print("CPI regression {}: {:.3f} -> {:.3f}".format(name, old, new))
+        sys.exit(1 if regressions else 0)
@@ -1,6 +1,17 @@
 from vunit import VUnit
+import os
+import sys
 import pathlib
 
+path = os.path.abspath(os.path.dirname(__file__))
+RKTCPU_PATH=path + "/../python"
+sys.path.append(RKTCPU_PATH)
+
+import numpy as np
+
+from rktcpu.gdu import random_operands, corner_operands, write_vectors
+from rktcpu.riscv.alu import alu_suite, write_alu_vectors
+
 def get_vhdl_files(dir, recursive=False):
     directory = pathlib.Path(dir)
     if recursive:
@@ -96,6 +107,21 @@ tb_cfg = dict(instructions="./tests/asm/test007.hex")
 tb_SimpleAllUp = tb.test_bench('tb_SimpleAllUp')
 tb_SimpleAllUp.add_config(name='Test007_WordMemoryAccesses', generics=dict(encoded_tb_cfg=encode(tb_cfg)))
 
+###############################################
+
+# Reference vectors read by the t_vector_file tests, tests/logs is not
+# tracked so they are written from the golden model on every run.
+os.makedirs("./tests/logs", exist_ok=True)
+
+ops, a, b = alu_suite(1 << 14)
+write_alu_vectors("./tests/logs/alu_vectors.txt", ops, a, b)
+
+# Every division pair is written unsigned and signed.
+cnum, cdenom = corner_operands()
+rnum, rdenom = random_operands(1000)
+num, denom = np.tile(np.concatenate((cnum, rnum)), 2), np.tile(np.concatenate((cdenom, rdenom)), 2)
+write_vectors("./tests/logs/division_vectors.txt", num, denom, np.repeat([False, True], len(num) // 2))
+
 # Run vunit function
 vu.add_compile_option('ghdl.a_flags', ['-frelaxed'])
 vu.set_sim_option('ghdl.elab_flags', ['-frelaxed'])
@@ -1,63 +1,46 @@
 import os
 import sys
 import glob
-import pathlib
-import re
-import pandas as pd
+import time
+import argparse
 
 path = os.path.abspath(os.path.dirname(__file__))
 RKTCPU_PATH=path + "/../python"
 sys.path.append(RKTCPU_PATH)
 
-from rktcpu.model import RktCpuModel
+from rktcpu.runner import run_tests, summarize, exit_code, DEFAULT_MAX_INSTRUCTIONS
+from rktcpu.goldencache import GoldenCache, DEFAULT_MAX_BYTES
 
-# Get all test hex files.
-tests = sorted(glob.glob("tests/asm/test*.hex"))
-for test in tests:
-    # Generate the settings struct and new paths for log files
-    _, tail = os.path.split(test)
-    name = pathlib.Path(tail).stem
-    logname = "tests/logs/{}_golden.csv".format(name)
-    settings = {
-        "logpath"       : logname,
-        "enablelogging" : True,
-        "hexpath"       : test,
-        "startingaddr"  : 0
-    }
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate golden logs and compare them with the HDL logs.")
+    parser.add_argument("-j", "--jobs", type=int, default=None,
+                        help="number of worker processes (default: one per CPU)")
+    parser.add_argument("-n", "--max-instructions", type=int, default=DEFAULT_MAX_INSTRUCTIONS)
+    parser.add_argument("--logdir", default="tests/logs")
+    parser.add_argument("--cache-dir", default="tests/logs/golden_cache",
+                        help="golden trace cache (default: %(default)s)")
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_MAX_BYTES >> 20,
+                        help="cache size limit in MiB (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="always regenerate the golden logs")
+    parser.add_argument("tests", nargs="*", help="hex files (default: tests/asm/test*.hex)")
+    args = parser.parse_args()
 
-    # Create the model and run it for an arbitrary amount of time
-    model = RktCpuModel(settings)
-    for _ in range(2000):
-        model.step()
-    model.close()
+    # Get all test hex files.
+    tests = args.tests or sorted(glob.glob("tests/asm/test*.hex"))
+    os.makedirs(args.logdir, exist_ok=True)
 
-outputs = sorted(["tests/logs/" + f for f in os.listdir("tests/logs/") if re.search(r'test\d+\.csv$', f)])
-goldens = sorted(glob.glob("tests/logs/test*_golden.csv"))
-for output, golden in zip(outputs, goldens):
-    # Get the log from the HDL simulation.
-    df = pd.read_csv(output)
-    # Filter the log for valid register writes.
-    # TODO: Check for invalid register writes...
-    df = df[df.valid == "'1'"]
-    df = df[df.rdwen == "'1'"]
-    # Reset the index but keep the past index so we can check specific rows in the CSV
-    df.reset_index(inplace=True, drop=False)
+    cache = None if args.no_cache else GoldenCache(args.cache_dir, max_bytes=args.cache_size << 20)
 
-    # Get the log of the golden model for comparison.
-    golden_df = pd.read_csv(golden)
-    # Trim the golden log to fit only the amount of time the HDL simulation was run for.
-    golden_df_head = golden_df.head(df.shape[0])
-    # Combine the golden log with the simulation log for easier comparison.
-    df["golden_pc"] = golden_df_head.pc
-    df["golden_rd"] = golden_df_head.rd
-    df["golden_res"] = golden_df_head.res
-    
-    print(80 * "*")
-    print("Test: {}".format(output))
-    print(80 * "*")
-    comparison = df.apply(lambda row: not all(i in row.golden_pc for i in row.pc), axis=1)
-    print("> Differing PC values: {}".format(comparison.sum()))
-    comparison = df.apply(lambda row: not all(i in row.golden_rd for i in row.rd), axis=1)
-    print("> Differing RD values: {}".format(comparison.sum()))
-    comparison = df.apply(lambda row: not all(i in row.golden_res for i in row.res), axis=1)
-    print("> Differing RES values: {}".format(comparison.sum()))
\ No newline at end of file
+    start = time.perf_counter()
+    results = run_tests(tests, logdir=args.logdir, workers=args.jobs,
+                        max_instructions=args.max_instructions, cache=cache)
+    elapsed = time.perf_counter() - start
+
+    for result in results:
+        if result.report and not result.passed:
+            print(80 * "*")
+            print("Test: {}".format(result.name))
+            print(80 * "*")
+            print(result.report)
+    print(summarize(results, elapsed))
+    sys.exit(exit_code(results))